@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+import numpy as np
+from typing import Dict, List
+
+# Histogram bucket upper bounds (last bucket is open-ended)
+BATCH_ROWS_BUCKETS = [100, 200, 400, 800, 1600, 3200, 6400]
+BATCH_REQUESTS_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+QUEUE_DELAY_MS_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 25]
+
+
+class _Histogram:
+    """Fixed-bucket counts; only written by the batcher thread."""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        self.counts[int(np.searchsorted(self.bounds, value))] += 1
+        self.total += value
+        self.n += 1
+
+    def summary(self) -> Dict:
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.n,
+            "mean": round(self.total / self.n, 3) if self.n else 0.0,
+            "buckets": dict(zip(labels, list(self.counts))),
+        }
+
+
+class _Request:
+    __slots__ = ("ranker", "X", "enqueued", "done", "scores", "error")
+
+    def __init__(self, ranker, X: np.ndarray):
+        self.ranker = ranker
+        self.X = X
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.scores = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces ranker inference across concurrent searches.
+
+    Callers hand over their feature matrix and block. A single worker
+    thread takes the first waiting request, keeps collecting requests for
+    up to `window_ms` after it arrived (or until `max_batch_rows` rows),
+    scores each ranker's rows with one predict call and hands every caller
+    its slice back. Requests made against different rankers (e.g. across a
+    model swap) are batched separately.
+    """
+
+    def __init__(self, window_ms: float = 1.0, max_batch_rows: int = 4096):
+        self.window = window_ms / 1000.0
+        self.max_batch_rows = max_batch_rows
+        self.queue: "queue.SimpleQueue[_Request]" = queue.SimpleQueue()
+        self.batch_rows = _Histogram(BATCH_ROWS_BUCKETS)
+        self.batch_requests = _Histogram(BATCH_REQUESTS_BUCKETS)
+        self.queue_delay_ms = _Histogram(QUEUE_DELAY_MS_BUCKETS)
+        self.thread = threading.Thread(target=self._run, name="ranker-batcher", daemon=True)
+        self.thread.start()
+
+    def predict(self, ranker, X: np.ndarray) -> np.ndarray:
+        """Scores X with ranker.predict_features, batched with other callers."""
+        request = _Request(ranker, X)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.scores
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            batch = [first]
+            rows = len(first.X)
+            deadline = first.enqueued + self.window
+            while rows < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                rows += len(request.X)
+            self._score(batch)
+
+    def _score(self, batch: List[_Request]):
+        started = time.perf_counter()
+        groups: Dict[int, List[_Request]] = {}
+        for request in batch:
+            groups.setdefault(id(request.ranker), []).append(request)
+            self.queue_delay_ms.observe((started - request.enqueued) * 1000)
+
+        for requests in groups.values():
+            X = np.concatenate([r.X for r in requests]) if len(requests) > 1 else requests[0].X
+            self.batch_rows.observe(len(X))
+            self.batch_requests.observe(len(requests))
+            try:
+                scores = requests[0].ranker.predict_features(X)
+                offsets = np.cumsum([len(r.X) for r in requests])[:-1]
+                for request, part in zip(requests, np.split(scores, offsets)):
+                    request.scores = part
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+            for request in requests:
+                request.done.set()
+
+    def get_stats(self) -> Dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch_rows": self.max_batch_rows,
+            "batch_rows": self.batch_rows.summary(),
+            "batch_requests": self.batch_requests.summary(),
+            "queue_delay_ms": self.queue_delay_ms.summary(),
+        }
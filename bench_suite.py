@@ -0,0 +1,227 @@
+"""
+In-process benchmark suite: builds a fresh SearchEngine per corpus size
+from data_gen's synthetic items, replays a query mix from
+data_gen.generate_queries and reports indexing time, memory and latency
+percentiles per search stage, as JSON for comparing commits.
+
+    python bench_suite.py                              # 10k, 100k, 1M, 5M items
+    python bench_suite.py --sizes 10000,100000 --queries 2000 --out bench.json
+
+Each size runs in its own process, so memory figures (RSS, peak RSS) are
+not polluted by the previous size. Items are generated and indexed in
+chunks (one index segment each, then compacted by the merge policy, as
+bulk loads are in production), so even 5M items never exist as Python
+dicts all at once.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+NUM_QUERIES = 5000
+K = 20
+CHUNK_SIZE = 250_000
+# The ranker is trained once per run on clicks over a small corpus; its
+# features do not depend on corpus size
+TRAINING_ITEMS = 5000
+TRAINING_SESSIONS = 10_000
+STAGES = ["retrieve", "features", "predict", "hydrate", "total"]
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), 0 where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    a = np.asarray(samples)
+    return {
+        "mean": round(float(a.mean()), 4),
+        "p50": round(float(np.percentile(a, 50)), 4),
+        "p95": round(float(np.percentile(a, 95)), 4),
+        "p99": round(float(np.percentile(a, 99)), 4),
+        "max": round(float(a.max()), 4),
+    }
+
+
+def train_ranker(seed: int):
+    """A ranker fitted on simulated clicks over a small synthetic corpus."""
+    import data_gen
+    from ranker import Ranker
+    from retriever import Retriever
+
+    random.seed(seed)
+    np.random.seed(seed)
+    items = data_gen.generate_items(TRAINING_ITEMS)
+    clicks = data_gen.generate_click_logs(items, data_gen.generate_queries(1000), TRAINING_SESSIONS)
+    retriever = Retriever()
+    retriever.index(items)
+    ranker = Ranker()
+    ranker.fit(clicks, retriever)
+    return ranker
+
+
+def build_engine(n_items: int, ranker, seed: int):
+    """A fresh engine over n_items synthetic items; returns (engine, index seconds, segments before merging)."""
+    import data_gen
+    from engine import SearchEngine
+    from retriever import Retriever
+
+    random.seed(seed)
+    engine = SearchEngine(cache_size=0) # Every search runs the whole pipeline
+    retriever = Retriever()
+    index_seconds = 0.0
+    for start in range(0, n_items, CHUNK_SIZE):
+        chunk = data_gen.generate_items(min(CHUNK_SIZE, n_items - start))
+        for i, item in enumerate(chunk):
+            item["id"] = f"item_{start + i}"
+        t = time.perf_counter()
+        retriever = retriever.with_items(chunk)
+        index_seconds += time.perf_counter() - t
+        del chunk
+    segments = len(retriever.bm25.segments)
+    with engine.lock:
+        engine._publish(retriever=retriever, ranker=ranker)
+    t = time.perf_counter()
+    engine._merge_segments()
+    index_seconds += time.perf_counter() - t
+    return engine, index_seconds, segments
+
+
+def time_stages(engine, queries: List[str], k: int) -> Dict[str, List[float]]:
+    """Per-stage latencies (ms) of the search pipeline, mirroring SearchEngine.search."""
+    snapshot = engine.snapshot
+    retriever, ranker = snapshot.retriever, snapshot.ranker
+    timings = {stage: [] for stage in STAGES}
+    for query in queries:
+        t0 = time.perf_counter()
+        doc_ids, scores = retriever.retrieve(query, k=k * 5)
+        t1 = time.perf_counter()
+        X = ranker.features(retriever, doc_ids, query)
+        t2 = time.perf_counter()
+        if ranker.model is not None and len(doc_ids):
+            order = np.argsort(-ranker.predict_features(X), kind="stable")
+        else:
+            order = np.arange(len(doc_ids))
+        t3 = time.perf_counter()
+        top = order[:k]
+        results = retriever.store.hydrate(doc_ids[top])
+        for item, i in zip(results, top.tolist()):
+            item["score"] = float(scores[i])
+        t4 = time.perf_counter()
+        for stage, (a, b) in zip(STAGES, [(t0, t1), (t1, t2), (t2, t3), (t3, t4), (t0, t4)]):
+            timings[stage].append((b - a) * 1000)
+    return timings
+
+
+def run_size(n_items: int, n_queries: int, k: int, seed: int) -> Dict:
+    """Benchmarks one corpus size; meant to run in a fresh process."""
+    import data_gen
+
+    rss_start = rss_bytes()
+    ranker = train_ranker(seed)
+    engine, index_seconds, segments = build_engine(n_items, ranker, seed)
+    retriever = engine.snapshot.retriever
+    index_arrays, _ = retriever.bm25.to_state()
+    rss_indexed = rss_bytes()
+
+    random.seed(seed + 1)
+    queries = data_gen.generate_queries(n_queries)
+    # Warm-up: first-touch page faults, lazy doc map, predictor caches
+    time_stages(engine, queries[:50], k)
+    stages = time_stages(engine, queries, k)
+
+    end_to_end = []
+    for query in queries:
+        t = time.perf_counter()
+        engine.search(query, k=k)
+        end_to_end.append((time.perf_counter() - t) * 1000)
+    engine.click_log.close()
+
+    total = sum(stages["total"]) / 1000
+    return {
+        "items": n_items,
+        "queries": n_queries,
+        "k": k,
+        "index_seconds": round(index_seconds, 3),
+        "index_items_per_second": round(n_items / index_seconds),
+        "segments": {"built": segments, "after_merge": len(retriever.bm25.segments)},
+        "memory": {
+            "index_bytes": int(sum(a.nbytes for a in index_arrays.values())),
+            "store_bytes": retriever.store.nbytes,
+            "rss_bytes": rss_indexed,
+            "rss_growth_bytes": rss_indexed - rss_start,
+            "peak_rss_bytes": peak_rss_bytes(),
+        },
+        "latency_ms": {stage: percentiles(samples) for stage, samples in stages.items()},
+        "end_to_end_ms": percentiles(end_to_end),
+        "qps_single_thread": round(n_queries / total, 1),
+    }
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process search benchmark across corpus sizes.")
+    parser.add_argument("--sizes", default=",".join(str(n) for n in SIZES),
+                        help="comma-separated item counts")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_suite_results.json")
+    args = parser.parse_args()
+
+    report = {"environment": environment(), "results": []}
+    for n_items in [int(s) for s in args.sizes.split(",") if s]:
+        print(f"\n=== {n_items} items ===")
+        # A fresh process per size keeps memory numbers independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(run_size, n_items, args.queries, args.k, args.seed).result()
+        report["results"].append(result)
+        lat = result["latency_ms"]
+        print(f"index {result['index_seconds']:.2f}s, index {result['memory']['index_bytes'] / 2**20:.1f} MiB, "
+              f"store {result['memory']['store_bytes'] / 2**20:.1f} MiB, "
+              f"peak RSS {result['memory']['peak_rss_bytes'] / 2**20:.0f} MiB")
+        print("  " + "  ".join(f"{stage} p50 {lat[stage]['p50']:.3f} p99 {lat[stage]['p99']:.3f}" for stage in STAGES))
+        print(f"  end to end p50 {result['end_to_end_ms']['p50']:.3f} p99 {result['end_to_end_ms']['p99']:.3f} ms")
+        # Written after every size, so a long run still leaves results
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
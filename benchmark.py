@@ -5,6 +5,7 @@ import concurrent.futures
 import numpy as np
 import json
 import os
+from engine import read_items
 
 API_URL = "http://localhost:8000"
 SEARCH_URL = f"{API_URL}/search"
@@ -74,8 +75,7 @@ if __name__ == "__main__":
     # To truly measure 10k, 20k etc., we would need to reload the engine with subset of items.
     
     # Load items to know how many we have
-    with open("items.jsonl", "r") as f:
-        all_items = [json.loads(line) for line in f]
+    all_items = list(read_items("items.jsonl").values())
 
     for itm in item_counts:
         # Re-index with subset for accuracy
@@ -0,0 +1,105 @@
+"""
+Recall vs latency of the dense (IVF) index against exact search: every
+query's top-k by approximate search (dense.DenseIndex.search) is compared
+with the exact top-k over all vectors (DenseIndex.exact) while the number
+of probed lists grows.
+
+    python benchmark_dense.py                          # 1M items
+    python benchmark_dense.py --items 100000 --nprobe 1,4,16 --queries 500
+
+Recall counts the approximate results at least as similar as the k-th
+exact one, so that which of several identical titles is returned does
+not matter. Query embedding is timed separately ("embed_ms"): it is the
+same for approximate and exact search.
+"""
+import argparse
+import json
+import random
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import data_gen
+from bench_suite import CHUNK_SIZE, environment, percentiles
+from dense import DenseIndex
+
+NUM_ITEMS = 1_000_000
+NPROBE = [1, 2, 4, 8, 16, 32, 64]
+NUM_QUERIES = 1000
+K = 100
+# Similarities within this of the k-th exact one count as ties (float
+# sums in different orders)
+TIE_EPSILON = 1e-5
+
+
+def build(n_items: int, seed: int) -> DenseIndex:
+    random.seed(seed)
+    titles: List[str] = []
+    for start in range(0, n_items, CHUNK_SIZE):
+        titles.extend(item["title"] for item in data_gen.generate_items(min(CHUNK_SIZE, n_items - start)))
+    return DenseIndex.build(titles, np.arange(len(titles)), seed)
+
+
+def timed(search, vectors: np.ndarray) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], List[float]]:
+    """(doc ids, similarities) of `search` for each query vector, and its latencies (ms)."""
+    results, samples = [], []
+    for v in vectors:
+        t = time.perf_counter()
+        results.append(search(v))
+        samples.append((time.perf_counter() - t) * 1000)
+    return results, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense IVF index recall and latency against exact search.")
+    parser.add_argument("--items", type=int, default=NUM_ITEMS)
+    parser.add_argument("--nprobe", default=",".join(str(n) for n in NPROBE), help="comma-separated probe counts")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="dense_benchmark.json")
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    index = build(args.items, args.seed)
+    build_seconds = time.perf_counter() - t
+    print(f"Indexed {len(index)} items in {len(index.centroids)} lists ({build_seconds:.1f} s, "
+          f"{index.nbytes / 2**20:.0f} MiB)")
+
+    random.seed(args.seed + 1)
+    queries = data_gen.generate_queries(args.queries)
+    embed_ms = []
+    for query in queries:
+        t = time.perf_counter()
+        index.embedder.embed([query])
+        embed_ms.append((time.perf_counter() - t) * 1000)
+    vectors = index.embedder.embed(queries)
+
+    exact, exact_ms = timed(lambda v: index.exact(v, args.k), vectors)
+    report: Dict = {"environment": environment(), "items": args.items, "k": args.k, "lists": len(index.centroids),
+                    "build_seconds": round(build_seconds, 2), "index_bytes": index.nbytes,
+                    "embed_ms": percentiles(embed_ms), "exact_ms": percentiles(exact_ms), "results": []}
+    print(f"exact: p50 {report['exact_ms']['p50']:.2f} ms p99 {report['exact_ms']['p99']:.2f} ms "
+          f"(embedding p50 {report['embed_ms']['p50']:.2f} ms)")
+    for nprobe in [int(n) for n in args.nprobe.split(",") if n]:
+        approx, approx_ms = timed(lambda v: index.search(v, args.k, nprobe), vectors)
+        # Queries with no neighbour at all are skipped
+        recalls = [min(int(np.count_nonzero(a_sims >= e_sims[-1] - TIE_EPSILON)), len(e_sims)) / len(e_sims)
+                   for (_, a_sims), (_, e_sims) in zip(approx, exact) if len(e_sims)]
+        result = {
+            "nprobe": nprobe,
+            "recall": round(float(np.mean(recalls)), 4) if recalls else None,
+            "latency_ms": percentiles(approx_ms),
+            "speedup": round(float(np.mean(exact_ms)) / float(np.mean(approx_ms)), 2),
+        }
+        report["results"].append(result)
+        print(f"nprobe {nprobe:>3}: recall@{args.k} {result['recall']:.4f}, p50 {result['latency_ms']['p50']:.2f} ms "
+              f"p99 {result['latency_ms']['p99']:.2f} ms, x{result['speedup']} vs exact")
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import json
+import time
+import numpy as np
+import click_log
+from engine import read_items
+from ranker import Ranker
+from retriever import Retriever
+from tree_predictor import TreeEnsemble
+
+BATCH_SIZES = [1, 10, 50, 100, 200, 500, 1000]
+
+def time_predict(fn, X, min_seconds=0.5):
+    """Returns (mean, p50, p99) latency in ms of fn(X)."""
+    fn(X) # Warm-up
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds or len(latencies) < 20:
+        t = time.perf_counter()
+        fn(X)
+        latencies.append((time.perf_counter() - t) * 1000)
+    return np.mean(latencies), np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def benchmark_predictor(clicks_path="clicks.jsonl", items_path="items.jsonl"):
+    items = list(read_items(items_path).values())
+    clicks = list(click_log.read_clicks(clicks_path))
+    if not clicks:
+        print("No clicks found. Use data_gen.py first.")
+        return
+
+    retriever = Retriever()
+    retriever.index(items)
+    ranker = Ranker()
+    ranker.fit(clicks, retriever)
+    X, _, _, _ = ranker.prepare_stream(clicks[:2000], retriever)
+    compiled = TreeEnsemble.from_booster(ranker.model.booster_)
+
+    max_err = np.max(np.abs(compiled.predict(X) - ranker.model.predict(X)))
+    print(f"Trees: {len(compiled.roots)}, max depth: {compiled.max_depth}, max |diff| vs LightGBM: {max_err:.2e}")
+
+    results = []
+    print(f"{'batch':>6} {'lgbm mean':>10} {'lgbm p99':>9} {'compiled mean':>14} {'compiled p99':>13} {'speedup':>8}")
+    for batch in BATCH_SIZES:
+        rows = X[np.random.randint(0, len(X), size=batch)]
+        lgb_mean, lgb_p50, lgb_p99 = time_predict(ranker.model.predict, rows)
+        cmp_mean, cmp_p50, cmp_p99 = time_predict(compiled.predict, rows)
+        print(f"{batch:>6} {lgb_mean:>10.3f} {lgb_p99:>9.3f} {cmp_mean:>14.3f} {cmp_p99:>13.3f} {lgb_mean / cmp_mean:>7.1f}x")
+        results.append({
+            "batch_size": batch,
+            "lightgbm_ms": {"mean": lgb_mean, "p50": lgb_p50, "p99": lgb_p99},
+            "compiled_ms": {"mean": cmp_mean, "p50": cmp_p50, "p99": cmp_p99},
+        })
+
+    with open("predictor_benchmark.json", "w") as f:
+        json.dump({"max_abs_diff": float(max_err), "results": results}, f, indent=2)
+    print("\nResults saved to predictor_benchmark.json")
+
+if __name__ == "__main__":
+    benchmark_predictor()
@@ -0,0 +1,75 @@
+import json
+import random
+import sys
+import time
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import data_gen
+from retriever import Retriever
+from serialize import dumps
+
+NUM_ITEMS = 50_000
+NUM_QUERIES = 500
+K = 20
+# None: whole items, as /search returned before projection
+FIELD_SETS = [None, ["id", "score"], ["title", "price"], ["id", "title", "price", "score", "ranker_score"]]
+
+
+def fastapi_default(retriever, doc_ids, scores, query):
+    """The previous path: full item dicts, encoded by FastAPI's JSONResponse."""
+    results = [retriever.store.item(row) for row in doc_ids.tolist()]
+    for item, score in zip(results, scores.tolist()):
+        item["score"] = score
+    return JSONResponse(content=jsonable_encoder({"items": results, "meta": {"total_candidates": len(doc_ids)}})).body
+
+
+def projected(retriever, doc_ids, scores, query, fields):
+    """The current path: column-wise projection (see ItemStore.project), then serialize.dumps."""
+    item_fields = None if fields is None else [f for f in fields if f not in ("score", "ranker_score")]
+    results = retriever.store.project(doc_ids, item_fields)
+    if fields is None or "score" in fields:
+        for item, score in zip(results, scores.tolist()):
+            item["score"] = score
+    return dumps({"items": results, "meta": {"total_candidates": len(doc_ids)}})
+
+
+def measure(fn, requests):
+    """(mean bytes, mean CPU us) per response."""
+    fn(*requests[0])  # Warm-up
+    sizes = []
+    start = time.process_time()
+    for args in requests:
+        sizes.append(len(fn(*args)))
+    cpu = time.process_time() - start
+    return float(np.mean(sizes)), cpu * 1e6 / len(requests)
+
+
+def benchmark_response():
+    random.seed(42)
+    retriever = Retriever()
+    retriever.index(data_gen.generate_items(NUM_ITEMS))
+    requests = []
+    for query in data_gen.generate_queries(NUM_QUERIES):
+        doc_ids, scores = retriever.retrieve(query, K)
+        requests.append((retriever, doc_ids, scores, query))
+
+    base_bytes, base_us = measure(fastapi_default, requests)
+    results = [{"path": "fastapi_default", "fields": None, "bytes": base_bytes, "cpu_us": base_us}]
+    print(f"{'path':<16} {'fields':<36} {'bytes':>7} {'cpu us':>8} {'speedup':>8}")
+    print(f"{'fastapi_default':<16} {'(all)':<36} {base_bytes:>7.0f} {base_us:>8.1f} {1.0:>7.1f}x")
+    for fields in FIELD_SETS:
+        size, us = measure(lambda *args: projected(*args, fields), requests)
+        label = ",".join(fields) if fields else "(all)"
+        print(f"{'projected':<16} {label:<36} {size:>7.0f} {us:>8.1f} {base_us / us:>7.1f}x")
+        results.append({"path": "projected", "fields": fields, "bytes": size, "cpu_us": us})
+
+    with open("response_benchmark.json", "w") as f:
+        json.dump({"serializer": "orjson" if "orjson" in sys.modules else "json", "k": K, "results": results},
+                  f, indent=2)
+    print("\nResults saved to response_benchmark.json")
+
+
+if __name__ == "__main__":
+    benchmark_response()
@@ -0,0 +1,126 @@
+"""
+Core scaling of sharded scatter-gather search (sharding.ShardedSearch):
+the same synthetic catalog is split into 1, 2, 4 and 8 worker processes
+and queried single-stream (latency) and from concurrent client threads
+(throughput). Speedups are relative to one shard, which does the same
+work as a single SearchEngine process plus the IPC round trips.
+
+    python benchmark_shards.py                       # 1M items, 1-8 shards
+    python benchmark_shards.py --items 100000 --shards 1,2 --queries 500
+
+Scaling is bounded by the cores available (reported as "cpus"): with
+fewer cores than shards, the extra shards only add overhead.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+import data_gen
+from bench_suite import CHUNK_SIZE, environment, percentiles, train_ranker
+from sharding import ShardedSearch
+
+NUM_ITEMS = 1_000_000
+SHARDS = [1, 2, 4, 8]
+NUM_QUERIES = 2000
+K = 20
+# Client threads per shard for the throughput run: enough requests in
+# flight to keep every worker busy while others wait on the coordinator
+CLIENTS_PER_SHARD = 2
+
+
+def build(n_shards: int, n_items: int, seed: int) -> ShardedSearch:
+    """A coordinator over n_items synthetic items (same items for every shard count)."""
+    random.seed(seed)
+    search = ShardedSearch(n_shards)
+    for start in range(0, n_items, CHUNK_SIZE):
+        chunk = data_gen.generate_items(min(CHUNK_SIZE, n_items - start))
+        for i, item in enumerate(chunk):
+            item["id"] = f"item_{start + i}"
+        search.add_items(chunk)
+        del chunk
+    return search
+
+
+def latency(search: ShardedSearch, ranker, queries: List[str], k: int) -> List[float]:
+    samples = []
+    for query in queries:
+        t = time.perf_counter()
+        search.search(query, k, ranker, fields=["id", "title"])
+        samples.append((time.perf_counter() - t) * 1000)
+    return samples
+
+
+def throughput(search: ShardedSearch, ranker, queries: List[str], k: int, clients: int) -> float:
+    """Queries per second with `clients` closed-loop threads sharing the query list."""
+    it = iter(queries)
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                query = next(it, None)
+            if query is None:
+                return
+            search.search(query, k, ranker, fields=["id", "title"])
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(queries) / (time.perf_counter() - t)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded search scaling across worker processes.")
+    parser.add_argument("--items", type=int, default=NUM_ITEMS)
+    parser.add_argument("--shards", default=",".join(str(n) for n in SHARDS), help="comma-separated shard counts")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="shard_benchmark.json")
+    args = parser.parse_args()
+
+    ranker = train_ranker(args.seed)
+    random.seed(args.seed + 1)
+    queries = data_gen.generate_queries(args.queries)
+
+    report: Dict = {"environment": environment(), "items": args.items, "k": args.k, "results": []}
+    base = None
+    for n_shards in [int(s) for s in args.shards.split(",") if s]:
+        print(f"\n=== {n_shards} shard(s), {args.items} items ===")
+        t = time.perf_counter()
+        search = build(n_shards, args.items, args.seed)
+        build_seconds = time.perf_counter() - t
+        try:
+            latency(search, ranker, queries[:50], args.k)  # Warm-up
+            lat = latency(search, ranker, queries, args.k)
+            qps = throughput(search, ranker, queries, args.k, CLIENTS_PER_SHARD * n_shards)
+        finally:
+            search.close()
+        mean = float(np.mean(lat))
+        base = base or (mean, qps)
+        result = {
+            "shards": n_shards,
+            "build_seconds": round(build_seconds, 2),
+            "latency_ms": percentiles(lat),
+            "qps": round(qps, 1),
+            "latency_speedup": round(base[0] / mean, 2),
+            "throughput_speedup": round(qps / base[1], 2),
+        }
+        report["results"].append(result)
+        print(f"latency p50 {result['latency_ms']['p50']:.2f} ms p99 {result['latency_ms']['p99']:.2f} ms, "
+              f"{qps:.0f} qps; speedup x{result['latency_speedup']} latency, x{result['throughput_speedup']} throughput")
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
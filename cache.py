@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Size estimate of a cached search result (see estimate_size), fitted on
+# JSON sizes of real results: about 30 bytes per item field or facet
+# value, plus the meta
+FIELD_BYTES = 32
+ENTRY_BYTES = 128
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Approximate serialized size of a search result ({"items": [...],
+    "meta": {...}}), from its item field and facet value counts; no
+    serialization on the request path.
+    """
+    if not isinstance(value, dict):
+        return ENTRY_BYTES
+    fields = sum(len(item) for item in value.get("items", ()))
+    fields += sum(len(counts) for counts in value.get("meta", {}).get("facets", {}).values())
+    return ENTRY_BYTES + FIELD_BYTES * fields
+
+
+class ResultCache:
+    """
+    Bounded LRU cache for search results with TTL expiry.
+
+    Every entry is tagged with the generation it was computed at; a lookup
+    with a newer generation treats it as a miss and drops it, so bumping
+    the generation invalidates the whole cache without touching it.
+    Size is bounded both by entry count and by the approximate (JSON) size
+    of the cached values (see estimate_size).
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 60.0, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (generation, expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # LRU (count or memory limit)
+        self.expirations = 0  # TTL
+        self.invalidations = 0  # stale generation
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_generation, expires_at, size, value = entry
+            if entry_generation != generation or expires_at < now:
+                if entry_generation != generation:
+                    self.invalidations += 1
+                else:
+                    self.expirations += 1
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, generation: int, value: Any):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generation, expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
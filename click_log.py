@@ -0,0 +1,210 @@
+import fcntl
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def files(path: str) -> List[str]:
+    """All files of the click log at `path`: rotated ones (oldest first), then the active one."""
+    rotated = sorted(glob.glob(glob.escape(path) + ".[0-9]*"))
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def read_clicks(path: str) -> Iterator[Dict]:
+    """Every click of the log at `path`, in write order; unparsable lines are skipped."""
+    for name in files(path):
+        with open(name, "r") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+class ClickLogWriter:
+    """
+    Buffered, append-only click log.
+
+    `log` only puts the click on a bounded queue (constant time, never
+    touches the file). A writer thread drains the queue and appends
+    whole batches with one write call (group commit): a batch is written
+    once `batch_size` clicks are waiting or `flush_interval` seconds after
+    its first click. Durability follows `fsync`:
+
+        "always"    fsync after every batch
+        "interval"  fsync at most every `fsync_interval` seconds
+        "never"     leave it to the OS
+
+    The active file is rotated to `<path>.<NNNNNN>` once it exceeds
+    `max_bytes` or was written to by this writer for more than `max_age`
+    seconds; `read_clicks` reads the rotated files and the active one in
+    order. Several processes may append to the same log (each with its
+    own writer): rotation is serialized by a lock file, `<path>.lock`.
+
+    When the queue is full (the disk cannot keep up) clicks are dropped
+    and counted rather than slowing down the request path.
+    """
+
+    def __init__(self, path: str, max_queue: int = 100_000, batch_size: int = 1000,
+                 flush_interval: float = 0.05, fsync: str = "interval", fsync_interval: float = 1.0,
+                 max_bytes: int = 64 * 1024 * 1024, max_age: float = 24 * 3600):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+
+        # Metrics; enqueued/dropped are guarded by _lock, the rest belong
+        # to the writer thread
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.rotations = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.write_seconds = 0.0
+
+        self._file = None
+        self._opened_at = 0.0
+        self._last_fsync = time.monotonic()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="click-log", daemon=True)
+        self._thread.start()
+
+    def log(self, click: Dict) -> bool:
+        """Queues a click; False if it was dropped because the queue is full."""
+        try:
+            self.queue.put_nowait(click)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def flush(self, timeout: float = 10.0):
+        """Waits until everything queued so far is written (e.g. before training)."""
+        deadline = time.monotonic() + timeout
+        while self.written + self.errors < self.enqueued and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def close(self):
+        """Writes what is queued, fsyncs and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if stop:
+                if self._file is not None:
+                    self._sync()
+                    self._file.close()
+                return
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "a")
+            self._opened_at = time.time()
+
+    def _write(self, batch: List[Dict]):
+        self.max_depth = max(self.max_depth, self.queue.qsize() + len(batch))
+        start = time.monotonic()
+        try:
+            self._open()
+            self._file.write("".join(json.dumps(click) + "\n" for click in batch))
+            self._file.flush()
+            now = time.monotonic()
+            if self.fsync == "always" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+                self._sync()
+            self.written += len(batch)
+            self.batches += 1
+        except OSError as e:
+            self.errors += len(batch)
+            print(f"Click log write failed: {e}")
+        else:
+            # The batch is written either way: a failed rotation is retried after the next one
+            try:
+                if self._file.tell() >= self.max_bytes or time.time() - self._opened_at >= self.max_age:
+                    self._rotate()
+            except OSError as e:
+                print(f"Click log rotation failed: {e}")
+        self.write_seconds += time.monotonic() - start
+
+    def _sync(self):
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+        self._last_fsync = time.monotonic()
+
+    def _rotate(self):
+        """
+        Renames the active file to the next `<path>.<NNNNNN>`, under the
+        lock file. If another process already rotated the file this writer
+        had open, it is only closed; the next batch opens the new one.
+        """
+        self._sync()
+        opened = os.fstat(self._file.fileno())
+        self._file.close()
+        self._file = None
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    active = os.stat(self.path)
+                except FileNotFoundError:
+                    return
+                if (active.st_dev, active.st_ino) != (opened.st_dev, opened.st_ino):
+                    return
+                rotated = files(self.path)[:-1]
+                seq = int(rotated[-1].rsplit(".", 1)[1]) + 1 if rotated else 1
+                os.rename(self.path, f"{self.path}.{seq:06d}")
+                self.rotations += 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get_stats(self) -> Dict:
+        return {
+            "queued": self.queue.qsize(),
+            "max_queued": self.max_depth,
+            "capacity": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "batches": self.batches,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "avg_write_ms": round(self.write_seconds * 1000 / self.batches, 3) if self.batches else 0.0,
+            "fsyncs": self.fsyncs,
+            "rotations": self.rotations,
+        }
@@ -0,0 +1,205 @@
+import copy
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+# Character n-grams (within word boundaries) hashed into this many buckets
+HASH_FEATURES = 1 << 16
+NGRAM_RANGE = (3, 4)
+# Embedding size after truncated SVD of the TF-IDF matrix...
+DIM = 64
+# ...fitted, like the idf, on at most this many titles
+FIT_SAMPLE = 50_000
+# IVF: about sqrt(n) k-means lists, trained on a sample of this many
+# vectors per list, and searched NPROBE lists at a time by default
+TRAIN_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+NPROBE = 8
+# Vectors added since the lists were built are scanned exhaustively;
+# beyond this many they are assigned into the lists
+MAX_DELTA = 50_000
+# Reciprocal rank fusion constant (Cormack et al.): damps the weight of
+# the very first ranks
+RRF_K = 60
+
+Keep = Callable[[np.ndarray], np.ndarray]
+
+
+class Embedder:
+    """
+    Local text embeddings: hashed character n-gram counts, sublinear
+    TF-IDF, then truncated SVD to DIM dimensions, L2-normalized (so the
+    dot product is the cosine). No model download; n-grams also match
+    partial words and misspellings that share no token with a title.
+
+    Only the fit uses scikit-learn: idf and SVD are linear, so they fold
+    into one HASH_FEATURES x DIM projection, and embedding a query is a
+    sparse row times that matrix (the TF-IDF norm cancels out in the
+    final normalization).
+    """
+
+    def __init__(self, titles: List[str], seed: int = 0):
+        self.vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=NGRAM_RANGE, n_features=HASH_FEATURES,
+                                            alternate_sign=False, norm=None, lowercase=True)
+        rng = np.random.default_rng(seed)
+        if len(titles) > FIT_SAMPLE:
+            titles = [titles[i] for i in rng.choice(len(titles), FIT_SAMPLE, replace=False).tolist()]
+        counts = self.vectorizer.transform(titles)
+        tfidf = TfidfTransformer(sublinear_tf=True).fit(counts)
+        dim = max(1, min(DIM, counts.shape[0] - 1))
+        svd = TruncatedSVD(n_components=dim, random_state=seed).fit(tfidf.transform(counts))
+        self.projection = np.ascontiguousarray((svd.components_ * tfidf.idf_).T, dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        return self.projection.shape[1]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """float32 unit vectors, one row per text (zero for texts without n-grams)."""
+        counts = self.vectorizer.transform(texts).astype(np.float32)
+        counts.data = 1 + np.log(counts.data)  # Sublinear tf, as fitted
+        X = np.asarray(counts @ self.projection)
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return np.divide(X, norms, out=np.zeros_like(X), where=norms > 0)
+
+
+def _top(doc_ids: np.ndarray, sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The k best by similarity descending, doc id ascending on ties."""
+    if len(doc_ids) > k:
+        kth = np.partition(sims, len(sims) - k)[len(sims) - k]
+        above = np.flatnonzero(sims > kth)
+        # Ties at the cut are common (identical titles): lowest doc ids first
+        tied = np.flatnonzero(sims == kth)
+        tied = tied[np.argsort(doc_ids[tied], kind="stable")[:k - len(above)]]
+        keep = np.concatenate([above, tied])
+        doc_ids, sims = doc_ids[keep], sims[keep]
+    order = np.lexsort((doc_ids, -sims))
+    return doc_ids[order], sims[order]
+
+
+def kmeans(X: np.ndarray, n_lists: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (Lloyd) centroids of unit vectors X, as unit vectors."""
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(X @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, X)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        # Empty lists restart from random points
+        sums[empty] = X[rng.choice(len(X), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class DenseIndex:
+    """
+    Approximate nearest-neighbour search over item embeddings with an
+    inverted file (IVF): vectors are grouped by their nearest k-means
+    centroid, stored contiguously per list (CSR), and a query only scores
+    the lists of its `nprobe` nearest centroids.
+
+    Copy-on-write like the BM25 index: `with_docs` returns a version with
+    the new vectors in an exhaustively scanned delta, sharing the lists;
+    past MAX_DELTA they are assigned into new lists (centroids are kept).
+    Deleted documents are filtered at query time (`keep`), never removed.
+    """
+
+    def __init__(self, embedder: Embedder, centroids: np.ndarray, doc_ids: np.ndarray, vectors: np.ndarray):
+        self.embedder = embedder
+        self.centroids = centroids
+        assign = np.argmax(vectors @ centroids.T, axis=1) if len(vectors) else np.zeros(0, dtype=np.int64)
+        order = np.argsort(assign, kind="stable")
+        self.doc_ids = doc_ids[order].astype(np.int64)
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.indptr = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=self.indptr[1:])
+        self.delta_ids = np.zeros(0, dtype=np.int64)
+        self.delta_vectors = np.zeros((0, embedder.dim), dtype=np.float32)
+
+    @classmethod
+    def build(cls, titles: List[str], doc_ids: np.ndarray, seed: int = 0) -> "DenseIndex":
+        """Fits the embedder and the IVF lists on `titles` (of `doc_ids`) and indexes them."""
+        embedder = Embedder(titles, seed)
+        vectors = embedder.embed(titles)
+        n_lists = max(1, int(np.sqrt(len(titles))))
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > n_lists * TRAIN_PER_LIST:
+            sample = vectors[rng.choice(len(vectors), n_lists * TRAIN_PER_LIST, replace=False)]
+        centroids = kmeans(sample, min(n_lists, len(sample)), seed=seed) if len(sample) else \
+            np.zeros((1, embedder.dim), dtype=np.float32)
+        return cls(embedder, centroids, np.asarray(doc_ids, dtype=np.int64), vectors)
+
+    def __len__(self):
+        return len(self.doc_ids) + len(self.delta_ids)
+
+    def with_docs(self, titles: List[str], doc_ids: np.ndarray) -> "DenseIndex":
+        if not titles:
+            return self
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        vectors = self.embedder.embed(titles)
+        if len(self.delta_ids) + len(doc_ids) > MAX_DELTA:
+            return DenseIndex(self.embedder, self.centroids,
+                              np.concatenate([self.doc_ids, self.delta_ids, doc_ids]),
+                              np.concatenate([self.vectors, self.delta_vectors, vectors]))
+        index = copy.copy(self)
+        index.delta_ids = np.concatenate([self.delta_ids, doc_ids])
+        index.delta_vectors = np.concatenate([self.delta_vectors, vectors])
+        return index
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = NPROBE,
+               keep: Optional[Keep] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k (doc ids, cosine similarity) for a query vector,
+        best first; `keep` (doc ids -> bool mask) drops documents first.
+        """
+        probes = np.argpartition(-(self.centroids @ query), min(nprobe, len(self.centroids)) - 1)[:nprobe]
+        starts, ends = self.indptr[probes], self.indptr[probes + 1]
+        positions = np.concatenate([np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist())] +
+                                   [np.zeros(0, dtype=np.int64)])
+        doc_ids = np.concatenate([self.doc_ids[positions], self.delta_ids])
+        sims = np.concatenate([self.vectors[positions] @ query, self.delta_vectors @ query])
+        return self._finish(doc_ids, sims, k, keep)
+
+    def exact(self, query: np.ndarray, k: int, keep: Optional[Keep] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """`search` scoring every vector (the recall baseline)."""
+        doc_ids = np.concatenate([self.doc_ids, self.delta_ids])
+        sims = np.concatenate([self.vectors @ query, self.delta_vectors @ query])
+        return self._finish(doc_ids, sims, k, keep)
+
+    @staticmethod
+    def _finish(doc_ids: np.ndarray, sims: np.ndarray, k: int, keep: Optional[Keep]) -> Tuple[np.ndarray, np.ndarray]:
+        positive = sims > 0
+        doc_ids, sims = doc_ids[positive], sims[positive]
+        if keep is not None and len(doc_ids):
+            mask = keep(doc_ids)
+            doc_ids, sims = doc_ids[mask], sims[mask]
+        if k <= 0 or not len(doc_ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return _top(doc_ids, sims, k)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.embedder.projection, self.centroids, self.doc_ids, self.vectors, self.indptr,
+                                      self.delta_ids, self.delta_vectors))
+
+
+def fuse(ranked: List[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reciprocal rank fusion of doc id lists (each best first): every list
+    adds 1 / (RRF_K + rank) to its documents. Returns the k best (doc
+    ids, fused scores), best first, doc id ascending on ties.
+    """
+    ranked = [np.asarray(r, dtype=np.int64) for r in ranked if len(r)]
+    if not ranked:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    docs = np.concatenate(ranked)
+    contrib = np.concatenate([1.0 / (RRF_K + 1 + np.arange(len(r))) for r in ranked])
+    unique, inverse = np.unique(docs, return_inverse=True)
+    scores = np.bincount(inverse, weights=contrib, minlength=len(unique))
+    order = np.lexsort((unique, -scores))[:k]
+    return unique[order], scores[order]
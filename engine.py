@@ -1,133 +1,823 @@
+import dataclasses
 import json
+import multiprocessing
+import numpy as np
 import os
 import threading
 import time
-from typing import List, Dict, Optional
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
+from batcher import MicroBatcher
+from cache import ResultCache
+from dense import fuse
+import click_log
+import index_snapshot
+import metrics
+from inverted_index import IndexSegment
+from model_registry import ModelRegistry, passes_gate, train_candidate
+from query_stats import QueryStats
+from suggest import Suggester
 from retriever import Retriever
 from ranker import Ranker
+from sharding import ShardedSearch
 
 DATA_DIR = "."
 ITEMS_FILE = os.path.join(DATA_DIR, "items.jsonl")
 CLICKS_FILE = os.path.join(DATA_DIR, "clicks.jsonl")
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "index_snapshot")
+MODELS_DIR = os.path.join(DATA_DIR, "models")
+# Timed stages of a search, in order; the API layer adds "serialize"
+SEARCH_STAGES = ["tokenize", "fuzzy", "filter", "retrieve", "dense", "facets", "features", "predict", "assemble"]
+# Per-result fields added by search, besides the item's own keys
+RESULT_FIELDS = ("score", "ranker_score")
+# Suggestions also complete the most searched queries of this window,
+# refreshed at most every TRENDING_TTL seconds
+TRENDING_WINDOW = 3600
+TRENDING_QUERIES = 200
+TRENDING_TTL = 1.0
+# How often a server checks for an index snapshot written by another
+# process (e.g. a reindex in another uvicorn worker)
+SNAPSHOT_POLL_SECONDS = 1.0
+# ...and for a ranker another process promoted
+RANKER_POLL_SECONDS = 1.0
+# Sharded mode: items sent to the shards per write while loading, and how
+# long shards replaced by a reindex keep serving searches already on them
+SHARD_LOAD_CHUNK = 50_000
+SHARD_RETIRE_SECONDS = 10.0
+
+def read_items(path: str = ITEMS_FILE) -> Dict[str, Dict]:
+    """
+    Replays the items log: later lines replace earlier items with the same
+    id, and tombstone lines ({"id": ..., "_deleted": true}) remove them.
+    """
+    items = {}
+    with open(path, "r") as f:
+        for line in f:
+            item = json.loads(line)
+            if item.get("_deleted"):
+                items.pop(item["id"], None)
+            else:
+                items[item["id"]] = item
+    return items
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Everything a search reads (the retriever carries the item store), and
+    the suggester of the same items.
+    Never modified once published: writers build the next snapshot off to
+    the side and swap `SearchEngine.snapshot` (a single reference
+    assignment, atomic in CPython), so readers never wait on indexing or
+    training. `generation` changes whenever search results may change and
+    keys the result cache. In sharded mode the items live in `shards`
+    (updated in place by writers, which then bump the generation) and the
+    retriever stays empty.
+    """
+    retriever: Retriever
+    ranker: Ranker
+    generation: int = 0
+    suggester: Suggester = field(default_factory=Suggester)
+    shards: Optional[ShardedSearch] = None
 
 class SearchEngine:
-    def __init__(self):
-        self.retriever = Retriever()
-        self.ranker = Ranker()
-        self.items = []
-        self.lock = threading.Lock()
-        self.click_logger = ThreadPoolExecutor(max_workers=1)
-        self.query_logs = [] # Store (timestamp, query) for real-time metrics
+    def __init__(self, cache_size: int = 10_000, cache_ttl: float = 60.0, cache_max_bytes: int = 64 * 1024 * 1024,
+                 batch_window_ms: Optional[float] = None, max_batch_rows: int = 4096, dense: bool = False,
+                 shards: int = 0):
+        if dense and shards:
+            raise ValueError("dense and shards cannot be combined: shards have no dense index")
+        self.snapshot = Snapshot(retriever=Retriever(), ranker=Ranker())
+        self.cache = ResultCache(cache_size, cache_ttl, cache_max_bytes)
+        # Optional: coalesce ranker inference of concurrent searches
+        self.batcher = MicroBatcher(batch_window_ms, max_batch_rows) if batch_window_ms is not None else None
+        self.lock = threading.Lock() # Serializes writers; searches never take it
+        self.click_log = click_log.ClickLogWriter(CLICKS_FILE)
+        self.indexer = ThreadPoolExecutor(max_workers=1) # Background segment merges and lookup builds
+        self.registry = ModelRegistry(MODELS_DIR)
+        self.trainer = ThreadPoolExecutor(max_workers=1) # Runs retrain jobs, see retrain()
+        self.training_pool = None # Process that fits the models, started on first use
+        self.training = None # Future of the pending retrain job
+        self.query_stats = QueryStats() # Fixed-memory sliding-window query counts
+        self._trending = (0.0, []) # (expires_at, [(query, count)]) for suggest()
+        self._snapshot_generation = None # Of the on-disk snapshot served, see _open_snapshot
+        # Also retrieve by embedding (see dense.py), fused with BM25; only
+        # with the in-process index (shards=0)
+        self.dense = dense
+        # Serve from this many shard processes (see sharding.py) instead of
+        # an in-process index; 0 for none. Shards have no dense index, so
+        # dense must be False
+        self.n_shards = shards
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Hot-path metrics are sharded per thread (no locks); the rest is read at scrape time."""
+        self.metrics = metrics.Registry()
+        m = self.metrics
+        self.searches = m.counter("search_requests_total", "Searches, including cache hits.")
+        self.search_seconds = m.histogram("search_duration_seconds", "Search latency inside the engine.")
+        self.batch_seconds = m.histogram("search_batch_duration_seconds", "Batch search latency inside the engine.")
+        self.stage_seconds = {stage: m.histogram("search_stage_duration_seconds", "Time per search stage.", stage=stage)
+                              for stage in SEARCH_STAGES + ["serialize"]}
+        self.suggest_seconds = m.histogram("suggest_duration_seconds", "Suggest latency inside the engine.")
+        self.postings_read = m.counter("search_postings_read_total", "Index postings read by retrieval.")
+        self.candidates_scored = m.counter("search_candidates_scored_total", "Documents BM25-scored by retrieval.")
+        m.counter("search_cache_hits_total", "Result cache hits.", fn=lambda: self.cache.hits)
+        m.counter("search_cache_misses_total", "Result cache misses.", fn=lambda: self.cache.misses)
+        self.ingest_pending = m.gauge("ingest_pending_requests", "Add/delete calls waiting for or holding the writer lock.")
+        m.gauge("click_log_queue_depth", "Clicks queued for the log writer.", fn=lambda: self.click_log.queue.qsize())
+        m.counter("click_log_written_total", "Clicks written to the log.", fn=lambda: self.click_log.written)
+        m.counter("click_log_dropped_total", "Clicks dropped because the queue was full.", fn=lambda: self.click_log.dropped)
+        m.gauge("ranker_batch_queue_depth", "Searches waiting for batched ranker inference.",
+                fn=lambda: self.batcher.queue.qsize() if self.batcher else 0)
+        m.gauge("index_items", "Live indexed items.", fn=lambda: self._items_count(self.snapshot))
+        m.gauge("index_segments", "Index segments.",
+                fn=lambda: len(self.snapshot.retriever.bm25.segments) if self.snapshot.retriever.bm25 else 0)
+        m.gauge("index_generation", "Generation of the served snapshot.", fn=lambda: self.snapshot.generation)
+        m.gauge("ranker_training", "1 while a ranker is being retrained.",
+                fn=lambda: int(self.training is not None and not self.training.done()))
+
+    @property
+    def retriever(self) -> Retriever:
+        return self.snapshot.retriever
+
+    @property
+    def ranker(self) -> Ranker:
+        return self.snapshot.ranker
+
+    def _publish(self, invalidate: bool = True, **changes):
+        """
+        Swaps in a new snapshot. Call with self.lock held. Unless
+        `invalidate` is False (changes that cannot alter results, like
+        segment merges), the generation is bumped, which invalidates every
+        cached result.
+        """
+        if invalidate:
+            changes["generation"] = self.snapshot.generation + 1
+        self.snapshot = dataclasses.replace(self.snapshot, **changes)
 
     def load(self):
-        """Loads items and trains models if data exists."""
+        """
+        Loads items (from the index snapshot when possible) and the latest
+        saved ranker; a ranker is only trained, in the background, if
+        there is none yet.
+        """
         print("Loading data...")
-        if os.path.exists(ITEMS_FILE):
-            with open(ITEMS_FILE, "r") as f:
-                self.items = [json.loads(line) for line in f]
-            
-            # Build Index
-            self.retriever.index(self.items)
-            
-            # Train Ranker if clicks exist
-            if os.path.exists(CLICKS_FILE):
-                self._train_ranker()
+        if os.path.exists(ITEMS_FILE) and self.n_shards:
+            shards, suggester = self._load_shards()
+            with self.lock:
+                self._publish(shards=shards, suggester=suggester)
+            self._load_ranker()
+        elif os.path.exists(ITEMS_FILE):
+            retriever, generation = self._open_snapshot()
+            with self.lock:
+                self._snapshot_generation = generation
+                self._publish(retriever=retriever)
+            self.indexer.submit(self._build_lookups)
+            if self.dense:
+                self.indexer.submit(self._build_dense)
+            self.indexer.submit(self._merge_segments)
+            threading.Thread(target=self._watch_snapshot, daemon=True).start()
+            self._load_ranker()
         else:
+            if self.n_shards:
+                with self.lock:
+                    self._publish(shards=ShardedSearch(self.n_shards))
             print(f"Warning: {ITEMS_FILE} not found. System starts empty.")
 
-    def _train_ranker(self):
-        print("Training ranker...")
-        clicks = []
+    def _load_ranker(self):
+        """
+        Serves the latest saved ranker, or trains one in the background if
+        there is none; then follows the rankers other processes promote.
+        """
+        latest = self.registry.load_latest()
+        if latest is not None:
+            ranker, meta = latest
+            print(f"Loaded ranker {meta['version']} (NDCG@10 {meta['ndcg']:.4f}, {meta['click_count']} clicks).")
+            with self.lock:
+                self._publish(ranker=ranker)
+        else:
+            self.retrain()
+        threading.Thread(target=self._watch_ranker, daemon=True).start()
+
+    def _load_shards(self) -> Tuple[ShardedSearch, Suggester]:
+        """
+        Sharded mode: new shard processes holding the items of items.jsonl,
+        and the suggester of those items. Shards index from the log (they
+        keep no on-disk snapshot), so each server process has its own.
+        """
+        items = list(read_items(ITEMS_FILE).values())
+        shards = ShardedSearch(self.n_shards)
+        for start in range(0, len(items), SHARD_LOAD_CHUNK):
+            shards.add_items(items[start:start + SHARD_LOAD_CHUNK])
+        print(f"Indexed {len(shards)} items in {self.n_shards} shards.")
+        return shards, Suggester().with_items(items)
+
+    def retrain(self) -> Optional[Future]:
+        """
+        Trains a candidate ranker on the click log in a background process.
+        It is saved to the model registry and served only if it passes the
+        validation gate. Returns the job's future (resolving to the served
+        version or None); a job already running is reused.
+        """
+        if not click_log.files(CLICKS_FILE):
+            return None
+        with self.lock:
+            if self.training is None or self.training.done():
+                self.training = self.trainer.submit(self._retrain)
+            return self.training
+
+    def _retrain(self) -> Optional[str]:
         try:
-            with open(CLICKS_FILE, "r") as f:
-                for line in f:
-                    try:
-                        clicks.append(json.loads(line))
-                    except:
-                        continue
+            if self.training_pool is None:
+                # spawn: forking a threaded process (and LightGBM's OpenMP) is unsafe
+                self.training_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            served = self.snapshot.ranker.version
+            self.click_log.flush() # Train on every click logged so far
+            # One process trains at a time (e.g. uvicorn workers starting
+            # together); the others then serve its model instead
+            with self.registry.exclusive():
+                latest = self.registry.load_latest()
+                if latest is not None and latest[1]["version"] != served:
+                    ranker, version = latest[0], latest[1]["version"]
+                    print(f"Ranker {version} was promoted meanwhile; not training.")
+                else:
+                    print("Training ranker...")
+                    version = self.training_pool.submit(
+                        train_candidate, ITEMS_FILE, CLICKS_FILE, SNAPSHOT_DIR, self.registry.root).result()
+                    if version is None:
+                        print("No ranker training data.")
+                        return None
+                    meta = self.registry.meta(version)
+                    if not passes_gate(meta):
+                        print(f"Ranker {version} rejected by the validation gate.")
+                        return None
+                    ranker = self.registry.load(version)
+                    self.registry.promote(version)
+                # Searches keep using the published ranker until the swap
+                with self.lock:
+                    self._publish(ranker=ranker)
+            print(f"Serving ranker {version}.")
+            return version
         except Exception as e:
-            print(f"Error reading clicks: {e}")
-            return
+            print(f"Ranker training failed: {e}")
+            return None
 
-        if clicks:
-            self.ranker.train(clicks, self.items)
-
-    def search(self, query: str, k: int = 20, user_id: Optional[str] = None) -> Dict:
-        start_time = time.time()
+    def search(self, query: str, k: int = 20, user_id: Optional[str] = None, timings: bool = False,
+               fields: Optional[List[str]] = None, fuzzy: bool = True, filters: Optional[Dict] = None,
+               facets: Optional[List[str]] = None, hybrid: bool = True) -> Dict:
+        """
+        Top-k items for `query`. `fields` projects each result to those item
+        keys and/or "score" / "ranker_score" (whole items and both scores
+        if None); only the requested store columns are read. Unless
+        `fuzzy` is False, query terms no item contains also match their
+        nearest vocabulary terms, down-weighted (see FuzzyIndex).
+        `filters` restricts results by category, brand and/or price (see
+        FilterIndex.select) before scoring; `facets` lists fields whose
+        value counts over all matching items are returned in meta. Once
+        the engine has a dense index, its nearest neighbours of the query
+        are fused with the BM25 candidates by reciprocal rank (and "score"
+        is the fused score) unless `hybrid` is False. With
+        `timings`, meta also holds the time spent in each stage (ms); all
+        stage times feed self.metrics. In sharded mode the same search runs
+        across the shard processes (see _search_sharded).
+        """
+        start_time = time.perf_counter()
+        snapshot = self.snapshot # One consistent view for the whole request
+        self.searches.inc()
+        
+        # 0. Result cache, keyed like the tokenizer sees the query
+        fields = tuple(dict.fromkeys(fields)) if fields is not None else None
+        facets = tuple(dict.fromkeys(facets)) if facets else ()
+        cache_key = self._cache_key(query, k, user_id, fields, fuzzy, filters, facets, hybrid)
+        cached = self.cache.get(cache_key, snapshot.generation)
+        if cached is not None:
+            self.query_stats.record(query)
+            elapsed = time.perf_counter() - start_time
+            self.search_seconds.observe(elapsed)
+            meta = dict(cached["meta"], latency_ms=round(elapsed * 1000, 2), cached=True)
+            if timings:
+                meta["timings_ms"] = {"cache": round(elapsed * 1000, 3)}
+            return {"items": cached["items"], "meta": meta}
+        
+        # 1-3. Retrieval, ranking and the top-K items
+        run = self._search_sharded if snapshot.shards is not None else self._search_local
+        final_results, meta, facet_counts, marks, work = run(snapshot, query, k, fields, fuzzy, filters, facets, hybrid)
+        
+        # 4. Count query for real-time metrics (O(1), own lock)
+        self.query_stats.record(query)
         
+        stage_ms = {}
+        for stage, t0, t1 in zip(SEARCH_STAGES, marks, marks[1:]):
+            self.stage_seconds[stage].observe(t1 - t0)
+            stage_ms[stage] = round((t1 - t0) * 1000, 3)
+        self.postings_read.inc(work["postings"])
+        self.candidates_scored.inc(work["candidates"])
+        elapsed = time.perf_counter() - start_time
+        self.search_seconds.observe(elapsed)
+        result = {
+            "items": final_results,
+            "meta": dict(meta, latency_ms=round(elapsed * 1000, 2))
+        }
+        if facet_counts is not None:
+            result["meta"]["facets"] = facet_counts
+        # Tagged with the generation it was computed from, so a result
+        # racing with a publish can never be served as fresh.
+        self.cache.put(cache_key, snapshot.generation, result)
+        if timings:
+            result = {"items": final_results, "meta": dict(result["meta"], timings_ms=stage_ms)}
+        return result
+
+    def _search_local(self, snapshot: Snapshot, query: str, k: int, fields: Optional[Tuple[str, ...]], fuzzy: bool,
+                      filters: Optional[Dict], facets: Tuple[str, ...], hybrid: bool
+                      ) -> Tuple[List[Dict], Dict, Optional[Dict], List[float], Dict[str, int]]:
+        """
+        The uncached part of `search` on the snapshot's retriever: (items,
+        meta, facet counts, stage start times plus the end time, work).
+        """
         # 1. Retrieval (Recall)
         # Fetch more candidates for re-ranking (e.g., 5x K)
-        candidates = self.retriever.search(query, k=k*5)
+        # Stages pass doc ids; dicts are only built for the final top-K.
+        retriever = snapshot.retriever
+        marks = [time.perf_counter()]
+        terms = retriever.tokenize(query)
+        marks.append(time.perf_counter())
+        expansions = retriever.expand(terms) if fuzzy else []
+        marks.append(time.perf_counter())
+        allowed = retriever.select(filters)
+        marks.append(time.perf_counter())
+        work = {"postings": 0, "candidates": 0}
+        doc_ids, scores = retriever.retrieve_terms(terms, k=k*5, stats=work, expansions=expansions, allowed=allowed)
+        marks.append(time.perf_counter())
+        dense_ids, _ = retriever.retrieve_dense(query, k*5, allowed) if hybrid else (None, None)
+        if dense_ids is not None and len(dense_ids):
+            doc_ids, scores = fuse([doc_ids, dense_ids], k*5)
+        marks.append(time.perf_counter())
+        facet_counts = retriever.facets(terms, list(facets), allowed, expansions) if facets else None
+        marks.append(time.perf_counter())
         
         # 2. Ranking (Precision)
-        ranked_results = self.ranker.predict(candidates, query)
+        ranker = snapshot.ranker
+        X = ranker.features(retriever, doc_ids, query) if ranker.model is not None and len(doc_ids) else None
+        marks.append(time.perf_counter())
+        if X is None:
+            ranker_scores = None
+        elif self.batcher is not None:
+            ranker_scores = self.batcher.predict(ranker, X)
+        else:
+            ranker_scores = ranker.predict_features(X)
+        if ranker_scores is None:
+            order = np.arange(len(doc_ids))
+        else:
+            order = np.argsort(-ranker_scores, kind="stable")
+        marks.append(time.perf_counter())
         
         # 3. Top-K
-        final_results = ranked_results[:k]
-        
-        # 4. Log query for real-time metrics
-        with self.lock:
-            self.query_logs.append((time.time(), query))
+        final_results = self._items(retriever, doc_ids, scores, ranker_scores, order[:k], fields)
+        marks.append(time.perf_counter())
+        return final_results, self._meta(retriever, doc_ids, expansions, dense_ids), facet_counts, marks, work
+
+    def _search_sharded(self, snapshot: Snapshot, query: str, k: int, fields: Optional[Tuple[str, ...]], fuzzy: bool,
+                        filters: Optional[Dict], facets: Tuple[str, ...], hybrid: bool
+                        ) -> Tuple[List[Dict], Dict, Optional[Dict], List[float], Dict[str, int]]:
+        """
+        `_search_local` across the snapshot's shards (see ShardedSearch):
+        filtering, facet counts and ranker features run inside the shards'
+        retrieval and are timed as part of it. There is no dense index, so
+        `hybrid` has no effect.
+        """
+        shards = snapshot.shards
+        marks = [time.perf_counter()]
+        terms = query.lower().split() # As Retriever.tokenize
+        marks.append(time.perf_counter())
+        expansions = shards.expand(terms) if fuzzy else []
+        marks.append(time.perf_counter())
+        marks.append(marks[-1]) # filter
+        ranker = snapshot.ranker
+        hits, X, facet_counts = shards.retrieve(query, k*5, ranker.model is not None, expansions, filters,
+                                                list(facets) if facets else None)
+        marks.extend([time.perf_counter()] * 4) # retrieve; dense, facets, features
+        if X is None:
+            ranker_scores = None
+        elif self.batcher is not None:
+            ranker_scores = self.batcher.predict(ranker, X)
+        else:
+            ranker_scores = ranker.predict_features(X)
+        order = np.arange(len(hits)) if ranker_scores is None else np.argsort(-ranker_scores, kind="stable")
+        marks.append(time.perf_counter())
         
-        latency_ms = (time.time() - start_time) * 1000
-        return {
-            "items": final_results,
-            "meta": {
-                "total_candidates": len(candidates),
-                "latency_ms": round(latency_ms, 2)
-            }
-        }
+        top = order[:k].tolist()
+        item_fields = None if fields is None else [f for f in fields if f not in RESULT_FIELDS]
+        final_results = shards.fetch([hits[i] for i in top], item_fields)
+        if fields is None or "score" in fields:
+            for item, i in zip(final_results, top):
+                item["score"] = hits[i][2]
+        if ranker_scores is not None and (fields is None or "ranker_score" in fields):
+            for item, i in zip(final_results, top):
+                item["ranker_score"] = float(ranker_scores[i])
+        marks.append(time.perf_counter())
+        meta = self._meta(snapshot.retriever, hits, expansions, None)
+        return final_results, meta, facet_counts, marks, {"postings": 0, "candidates": 0}
 
-    def log_click(self, click_data: Dict):
+    def search_batch(self, queries: List[str], k: int = 20, user_id: Optional[str] = None,
+                     fields: Optional[List[str]] = None, fuzzy: bool = True, hybrid: bool = True) -> Dict:
         """
-        Async click logging to avoid blocking response.
+        `search` of many queries at once, with the same results (sharing
+        its cache): the BM25 retrieval of every uncached query is one
+        sparse matrix product (see InvertedIndex.top_k_batch), and all
+        their candidates are re-ranked by a single ranker call. Returns
+        {"results": [per query, in order, as search returns], "meta": ...}.
+        In sharded mode each query is a `search` of its own.
         """
-        self.click_logger.submit(self._append_click_log, click_data)
+        start_time = time.perf_counter()
+        snapshot = self.snapshot
+        if snapshot.shards is not None:
+            return self._search_batch_sharded(queries, k, user_id, fields, fuzzy, hybrid, start_time)
+        self.searches.inc(len(queries))
+        fields = tuple(dict.fromkeys(fields)) if fields is not None else None
+        keys = [self._cache_key(query, k, user_id, fields, fuzzy, None, (), hybrid) for query in queries]
+        results: List[Optional[Dict]] = []
+        for key in keys:
+            cached = self.cache.get(key, snapshot.generation)
+            if cached is not None:
+                meta = {name: value for name, value in cached["meta"].items() if name != "latency_ms"}
+                cached = {"items": cached["items"], "meta": dict(meta, cached=True)}
+            results.append(cached)
+        misses = [i for i, result in enumerate(results) if result is None]
 
-    def _append_click_log(self, data: Dict):
-        with self.lock:
-            with open(CLICKS_FILE, "a") as f:
-                f.write(json.dumps(data) + "\n")
+        retriever = snapshot.retriever
+        terms = [retriever.tokenize(queries[i]) for i in misses]
+        expansions = [retriever.expand(t) if fuzzy else [] for t in terms]
+        hits = retriever.retrieve_batch(terms, k*5, expansions)
+        dense_ids = [None] * len(misses)
+        if hybrid:
+            for j, i in enumerate(misses):
+                dense_ids[j], _ = retriever.retrieve_dense(queries[i], k*5)
+                if len(dense_ids[j]):
+                    hits[j] = fuse([hits[j][0], dense_ids[j]], k*5)
+
+        ranker = snapshot.ranker
+        ranker_scores = [None] * len(misses)
+        rows = np.concatenate([doc_ids for doc_ids, _ in hits]) if hits else np.zeros(0, dtype=np.int64)
+        if ranker.model is not None and len(rows):
+            query_of_row = np.repeat(np.arange(len(hits)), [len(doc_ids) for doc_ids, _ in hits])
+            X = ranker.features_batch(retriever, rows, [queries[i] for i in misses], query_of_row)
+            predicted = self.batcher.predict(ranker, X) if self.batcher is not None else ranker.predict_features(X)
+            ranker_scores = np.split(predicted, np.cumsum([len(doc_ids) for doc_ids, _ in hits])[:-1])
+
+        for j, i in enumerate(misses):
+            doc_ids, scores = hits[j]
+            order = np.arange(len(doc_ids)) if ranker_scores[j] is None else np.argsort(-ranker_scores[j], kind="stable")
+            result = {"items": self._items(retriever, doc_ids, scores, ranker_scores[j], order[:k], fields),
+                      "meta": self._meta(retriever, doc_ids, expansions[j], dense_ids[j])}
+            self.cache.put(keys[i], snapshot.generation, result)
+            results[i] = result
+        for query in queries:
+            self.query_stats.record(query)
+        elapsed = time.perf_counter() - start_time
+        self.batch_seconds.observe(elapsed)
+        return {"results": results,
+                "meta": {"queries": len(queries), "cached": len(queries) - len(misses),
+                         "latency_ms": round(elapsed * 1000, 2)}}
+
+    def _search_batch_sharded(self, queries: List[str], k: int, user_id: Optional[str], fields: Optional[List[str]],
+                              fuzzy: bool, hybrid: bool, start_time: float) -> Dict:
+        results = []
+        for query in queries:
+            result = self.search(query, k, user_id, fields=fields, fuzzy=fuzzy, hybrid=hybrid)
+            meta = {name: value for name, value in result["meta"].items() if name != "latency_ms"}
+            results.append({"items": result["items"], "meta": meta})
+        elapsed = time.perf_counter() - start_time
+        self.batch_seconds.observe(elapsed)
+        return {"results": results,
+                "meta": {"queries": len(queries), "cached": sum(bool(r["meta"].get("cached")) for r in results),
+                         "latency_ms": round(elapsed * 1000, 2)}}
+
+    @staticmethod
+    def _cache_key(query: str, k: int, user_id: Optional[str], fields: Optional[Tuple[str, ...]], fuzzy: bool,
+                   filters: Optional[Dict], facets: Tuple[str, ...], hybrid: bool) -> Tuple:
+        filter_key = tuple(sorted((name, tuple(value)) for name, value in filters.items() if value)) if filters else ()
+        return (" ".join(query.lower().split()), k, user_id, fields, fuzzy, filter_key, facets, hybrid)
+
+    @staticmethod
+    def _items(retriever: Retriever, doc_ids: np.ndarray, scores: np.ndarray, ranker_scores: Optional[np.ndarray],
+               top: np.ndarray, fields: Optional[Tuple[str, ...]]) -> List[Dict]:
+        """Result items of candidates `top`, projected to `fields` (see search)."""
+        item_fields = None if fields is None else [f for f in fields if f not in RESULT_FIELDS]
+        items = retriever.store.project(doc_ids[top], item_fields)
+        if fields is None or "score" in fields:
+            for item, score in zip(items, scores[top].tolist()):
+                item["score"] = score
+        if ranker_scores is not None and (fields is None or "ranker_score" in fields):
+            for item, score in zip(items, ranker_scores[top].tolist()):
+                item["ranker_score"] = score
+        return items
+
+    @staticmethod
+    def _meta(retriever: Retriever, doc_ids: np.ndarray, expansions: List[Tuple[str, str, float]],
+              dense_ids: Optional[np.ndarray]) -> Dict:
+        """Result meta of a search, besides latency and facets."""
+        meta = {"total_candidates": len(doc_ids)}
+        if expansions:
+            expanded: Dict[str, List[str]] = {}
+            for term, match, _ in expansions:
+                expanded.setdefault(term, []).append(match)
+            meta["expanded"] = expanded
+        if dense_ids is not None and retriever.dense is not None:
+            meta["dense_candidates"] = len(dense_ids)
+        return meta
+
+    def close(self):
+        """
+        Stops background work, for shutdown: pending index jobs and a
+        running retrain finish (queued ones are cancelled), the training
+        process and shard processes exit, and every queued click is
+        written and fsynced.
+        """
+        self.indexer.shutdown(wait=True, cancel_futures=True)
+        self.trainer.shutdown(wait=True, cancel_futures=True)
+        if self.training_pool is not None:
+            self.training_pool.shutdown(wait=True)
+        self.click_log.close()
+        if self.snapshot.shards is not None:
+            self.snapshot.shards.close()
+
+    def log_click(self, click_data: Dict) -> bool:
+        """
+        Queues a click for the log writer (group-committed in the
+        background); False if it was dropped under backpressure.
+        """
+        return self.click_log.log(click_data)
 
     def add_items(self, new_items: List[Dict]):
         """
-        Bulk add items. Simple implementation: Append and Re-index.
-        Real production would use incremental index.
+        Bulk add (or update, by item id) items. The batch is indexed as a
+        new segment; segments are compacted in the background.
         """
-        with self.lock:
-            with open(ITEMS_FILE, "a") as f:
-                for item in new_items:
-                    f.write(json.dumps(item) + "\n")
-            
-            self.items.extend(new_items)
-            # Full Re-index (Blocking!) - Acceptable for "Mini" system
-            self.retriever.index(self.items)
+        self.ingest_pending.inc()
+        try:
+            with self.lock:
+                # Not while another process reads the log to build a snapshot
+                with index_snapshot.exclusive(SNAPSHOT_DIR), open(ITEMS_FILE, "a") as f:
+                    for item in new_items:
+                        f.write(json.dumps(item) + "\n")
+                
+                snapshot = self.snapshot
+                # Last version wins, as in Retriever.with_items
+                new_items = list({item["id"]: item for item in new_items}.values())
+                if snapshot.shards is not None:
+                    replaced = snapshot.shards.add_items(new_items)
+                    self._publish(suggester=snapshot.suggester.with_items(new_items, replaced))
+                    return
+                replaced = snapshot.retriever.store.hydrate(
+                    [snapshot.retriever.doc_map[item["id"]] for item in new_items if item["id"] in snapshot.retriever.doc_map])
+                retriever = snapshot.retriever.with_items(new_items)
+                self._publish(retriever=retriever, suggester=snapshot.suggester.with_items(new_items, replaced))
+        finally:
+            self.ingest_pending.dec()
+        self.indexer.submit(self._merge_segments)
+
+    def delete_items(self, item_ids: List[str]) -> int:
+        """Deletes items by id (tombstones). Returns how many existed."""
+        self.ingest_pending.inc()
+        try:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot.shards is not None:
+                    # Only the shards know which ids exist: log what they deleted
+                    removed = snapshot.shards.delete_items(item_ids)
+                    item_ids = [item["id"] for item in removed]
+                else:
+                    item_ids = [i for i in dict.fromkeys(item_ids) if i in snapshot.retriever.doc_map]
+                with index_snapshot.exclusive(SNAPSHOT_DIR), open(ITEMS_FILE, "a") as f:
+                    for item_id in item_ids:
+                        f.write(json.dumps({"id": item_id, "_deleted": True}) + "\n")
+                
+                if snapshot.shards is not None:
+                    self._publish(suggester=snapshot.suggester.with_items([], removed))
+                    return len(item_ids)
+                removed = snapshot.retriever.store.hydrate([snapshot.retriever.doc_map[i] for i in item_ids])
+                retriever = snapshot.retriever.without_items(item_ids)
+                self._publish(retriever=retriever, suggester=snapshot.suggester.with_items([], removed))
+        finally:
+            self.ingest_pending.dec()
+        self.indexer.submit(self._merge_segments)
+        return len(item_ids)
+
+    def _merge_segments(self):
+        """Compacts index segments until the merge policy is satisfied."""
+        try:
+            while True:
+                retriever = self.snapshot.retriever
+                sources = retriever.bm25.plan_merge() if retriever.bm25 else None
+                if not sources:
+                    return
+                # The expensive part runs without the writer lock
+                merged = IndexSegment.merge(sources)
+                with self.lock:
+                    retriever = self.snapshot.retriever.with_merge(sources, merged)
+                    if retriever is None:
+                        return # Raced with a delete or reindex
+                    # Same live documents and statistics: results unchanged
+                    self._publish(invalidate=False, retriever=retriever)
+        except Exception as e:
+            print(f"Segment merge failed: {e}")
 
     def reindex(self):
-        """Manually trigger re-indexing and ranker training."""
+        """
+        Manually trigger re-indexing and ranker training. The rebuilt
+        snapshot is picked up by every process serving it (in sharded mode,
+        only this process's shards are rebuilt, from items.jsonl).
+        """
+        if self.snapshot.shards is not None:
+            self._reindex_shards()
+            self.retrain()
+            return
         with self.lock:
-            self.retriever.index(self.items)
-            self._train_ranker()
+            # Rebuilding also drops dead rows from the store
+            if os.path.exists(ITEMS_FILE):
+                retriever, self._snapshot_generation = self._open_snapshot(rebuild=True)
+            else:
+                retriever = Retriever()
+                retriever.index(self.snapshot.retriever.live_items())
+            retriever = retriever.with_fuzzy()
+            self._publish(retriever=retriever, suggester=self._suggester_for(retriever))
+        if self.dense:
+            self.indexer.submit(self._build_dense)
+        self.retrain()
 
-    def get_top_queries(self, window_seconds: int = 300):
-        now = time.time()
+    def _reindex_shards(self):
         with self.lock:
-            # Cleanup old logs
-            self.query_logs = [ql for ql in self.query_logs if now - ql[0] <= window_seconds]
-            
-            # Simple count
-            counts = {}
-            for _, q in self.query_logs:
-                counts[q] = counts.get(q, 0) + 1
-            
-            # Sort and return
-            sorted_q = sorted(counts.items(), key=lambda x: x[1], reverse=True)
-            return [{"query": q, "count": c} for q, c in sorted_q[:10]]
+            old = self.snapshot.shards
+            if os.path.exists(ITEMS_FILE):
+                shards, suggester = self._load_shards()
+            else:
+                shards, suggester = ShardedSearch(self.n_shards), Suggester()
+            self._publish(shards=shards, suggester=suggester)
+        # Searches that read the previous snapshot finish on its shards first
+        threading.Timer(SHARD_RETIRE_SECONDS, old.close).start()
+
+    def _open_snapshot(self, rebuild: bool = False) -> Tuple[Retriever, Optional[int]]:
+        """
+        The items of items.jsonl as a retriever mapped from the on-disk
+        snapshot, and the snapshot's generation (None if it could not be
+        written). The snapshot is built first if `rebuild`, or if it is
+        missing or stale. Holds the snapshot lock throughout: of several
+        workers starting together, one builds and the others then map
+        its files (shared memory through the page cache).
+        """
+        with index_snapshot.exclusive(SNAPSHOT_DIR):
+            retriever = None if rebuild else index_snapshot.load(SNAPSHOT_DIR, ITEMS_FILE)
+            if retriever is None:
+                # Appends wait for the lock, so the log read is exactly `source`
+                source = index_snapshot.source_state(ITEMS_FILE)
+                built = Retriever()
+                built.index(list(read_items(ITEMS_FILE).values()))
+                try:
+                    index_snapshot.write(built, SNAPSHOT_DIR, source)
+                except OSError as e:
+                    print(f"Writing index snapshot failed: {e}")
+                    return built, None
+                # Serve the mapped copy, not the private one just built
+                retriever = index_snapshot.load(SNAPSHOT_DIR, ITEMS_FILE, check=False) or built
+            return retriever, index_snapshot.generation(SNAPSHOT_DIR)
+
+    def _watch_snapshot(self):
+        """
+        Background: attaches snapshots written by other processes (their
+        reindex), which also replays whatever they appended to items.jsonl.
+        """
+        while True:
+            time.sleep(SNAPSHOT_POLL_SECONDS)
+            generation = index_snapshot.generation(SNAPSHOT_DIR)
+            if generation is None or generation == self._snapshot_generation:
+                continue
+            try:
+                with self.lock:
+                    retriever, self._snapshot_generation = self._open_snapshot()
+                    retriever = retriever.with_fuzzy()
+                    self._publish(retriever=retriever, suggester=self._suggester_for(retriever))
+                print(f"Attached index snapshot generation {self._snapshot_generation}.")
+                if self.dense:
+                    self.indexer.submit(self._build_dense)
+            except Exception as e:
+                print(f"Attaching index snapshot failed: {e}")
+
+    def _watch_ranker(self):
+        """Background: serves rankers promoted by other processes (their retrain)."""
+        seen = self.registry.current()
+        while True:
+            time.sleep(RANKER_POLL_SECONDS)
+            current = self.registry.current()
+            if current is None or current == seen:
+                continue
+            seen = current
+            if current == self.snapshot.ranker.version:
+                continue # Promoted by this process
+            try:
+                if not self.registry.compatible(self.registry.meta(current)):
+                    print(f"Not serving ranker {current}: incompatible format or features.")
+                    continue
+                ranker = self.registry.load(current)
+                with self.lock:
+                    # Not over a newer one this process promoted meanwhile
+                    if self.registry.current() != current:
+                        continue
+                    self._publish(ranker=ranker)
+                print(f"Serving ranker {current} promoted by another process.")
+            except Exception as e:
+                print(f"Loading ranker {current} failed: {e}")
+
+    @staticmethod
+    def _suggester_for(retriever: Retriever) -> Suggester:
+        rows = np.fromiter(retriever.doc_map.values(), dtype=np.int64, count=len(retriever.doc_map))
+        return Suggester.from_store(retriever.store, rows)
+
+    def _build_lookups(self):
+        """
+        Builds the suggester and fuzzy index of the served items (after
+        load). The full build runs without the writer lock; items written
+        meanwhile are applied under it, as writers apply theirs.
+        """
+        try:
+            source = self._snapshot_generation
+            base = self.snapshot.retriever.with_fuzzy()
+            live = base.bm25.live_doc_ids() if base.bm25 is not None else np.zeros(0, dtype=np.int64)
+            suggester = Suggester.from_store(base.store, live)
+            with self.lock:
+                retriever = self.snapshot.retriever
+                if self._snapshot_generation != source or retriever.fuzzy is not None:
+                    return # Raced with a reindex, which builds its own
+                if retriever.bm25 is not None:
+                    # Doc ids only grow: rows appended since, and base rows deleted since
+                    rows = np.arange(base.bm25.next_doc_id if base.bm25 is not None else 0, retriever.bm25.next_doc_id)
+                    added = retriever.store.hydrate(rows[retriever.bm25.is_live(rows)])
+                    removed = retriever.store.hydrate(live[~retriever.bm25.is_live(live)])
+                    suggester = suggester.with_items(added, removed)
+                # Searches may now expand misspelled terms: drop cached results
+                self._publish(retriever=retriever.with_fuzzy(base), suggester=suggester)
+        except Exception as e:
+            print(f"Building suggester and fuzzy index failed: {e}")
+
+    def _build_dense(self):
+        """
+        Builds the dense index of the served items. Embedding the catalog
+        runs without the writer lock; rows appended meanwhile are embedded
+        under it (rows deleted meanwhile are filtered at query time).
+        """
+        try:
+            source = self._snapshot_generation
+            built = self.snapshot.retriever.with_dense()
+            with self.lock:
+                if self._snapshot_generation != source:
+                    return # Raced with a reindex, which schedules its own build
+                retriever = self.snapshot.retriever.with_dense(built)
+                self._publish(retriever=retriever)
+            print(f"Built dense index of {len(retriever.dense or ())} items.")
+        except Exception as e:
+            print(f"Building dense index failed: {e}")
+
+    def suggest(self, text: str, n: int = 10) -> Dict:
+        """Completions of partially typed `text` (see Suggester.suggest); never runs a search."""
+        start_time = time.perf_counter()
+        expires_at, trending = self._trending
+        if time.monotonic() >= expires_at:
+            counts: Dict[str, int] = {}
+            for entry in self.query_stats.top(TRENDING_WINDOW, TRENDING_QUERIES):
+                query = " ".join(entry["query"].lower().split())
+                counts[query] = counts.get(query, 0) + entry["count"]
+            trending = list(counts.items())
+            self._trending = (time.monotonic() + TRENDING_TTL, trending)
+        suggestions = self.snapshot.suggester.suggest(text, n, trending)
+        elapsed = time.perf_counter() - start_time
+        self.suggest_seconds.observe(elapsed)
+        return {"suggestions": suggestions, "meta": {"latency_ms": round(elapsed * 1000, 3)}}
+
+    def get_top_queries(self, window_seconds: int = 300):
+        # Approximate beyond QueryStats' capacity; see its docstring
+        return self.query_stats.top(window_seconds, 10)
+
+    @staticmethod
+    def _items_count(snapshot: Snapshot) -> int:
+        if snapshot.shards is not None:
+            return len(snapshot.shards)
+        return len(snapshot.retriever.bm25 or ())
 
     def get_stats(self):
+        snapshot = self.snapshot
+        bm25 = snapshot.retriever.bm25
         return {
-            "items_count": len(self.items),
-            "has_ranker": self.ranker.model is not None
+            "items_count": self._items_count(snapshot),
+            "shards": snapshot.shards.n_shards if snapshot.shards is not None else 0,
+            "segments": len(bm25.segments) if bm25 else 0,
+            "store_bytes": snapshot.retriever.store.nbytes,
+            "filter_bytes": snapshot.retriever.filters.nbytes,
+            "dense_bytes": snapshot.retriever.dense.nbytes if snapshot.retriever.dense is not None else 0,
+            "has_ranker": snapshot.ranker.model is not None,
+            "ranker_version": snapshot.ranker.version,
+            "generation": snapshot.generation,
+            "cache": self.cache.get_stats(),
+            "click_log": self.click_log.get_stats(),
+            "batcher": self.batcher.get_stats() if self.batcher else None,
+            "query_stats": self.query_stats.get_stats()
         }
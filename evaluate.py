@@ -1,9 +1,8 @@
-import json
-import os
 import numpy as np
-import pandas as pd
 from ranker import Ranker
 from retriever import Retriever
+from engine import read_items
+from click_log import read_clicks
 from sklearn.model_selection import train_test_split
 def dcg_at_k(r, k):
     r = np.asarray(r, dtype=float)[:k]
@@ -25,14 +24,9 @@ def mrr_at_k(r, k):
 
 def evaluate_offline(clicks_path="clicks.jsonl", items_path="items.jsonl"):
     print("Loading data for evaluation...")
-    with open(items_path, "r") as f:
-        items = [json.loads(line) for line in f]
+    items = list(read_items(items_path).values())
     
-    clicks = []
-    if os.path.exists(clicks_path):
-        with open(clicks_path, "r") as f:
-            for line in f:
-                clicks.append(json.loads(line))
+    clicks = list(read_clicks(clicks_path))
     
     if not clicks:
         print("No clicks found. Use data_gen.py first.")
@@ -45,9 +39,12 @@ def evaluate_offline(clicks_path="clicks.jsonl", items_path="items.jsonl"):
     train_clicks = [c for c in clicks if c["user_id"] in train_users]
     test_clicks = [c for c in clicks if c["user_id"] in test_users]
     
+    retriever = Retriever()
+    retriever.index(items)
+    
     # Train Ranker
     ranker = Ranker()
-    ranker.train(train_clicks, items)
+    ranker.fit(train_clicks, retriever)
     
     # Evaluate
     test_groups = {}
@@ -55,53 +52,33 @@ def evaluate_offline(clicks_path="clicks.jsonl", items_path="items.jsonl"):
         if c["query"] not in test_groups:
             test_groups[c["query"]] = []
         test_groups[c["query"]].append(c["item_id"])
-        
-    retriever = Retriever()
-    retriever.index(items)
     
     metrics = {
         "baseline": {"ndcg": [], "mrr": [], "recall": []},
         "ranker": {"ndcg": [], "mrr": [], "recall": []}
     }
     
-    print("Evaluating systems...")
-    for query, clicked_ids in list(test_groups.items())[:500]: # Sample for speed
-        clicked_set = set(clicked_ids)
-        
-        # 1. Retriever-only baseline
-        candidates = retriever.search(query, k=50)
-        
-        # Position-aware implicit relevance: Clicked=2, Top5=1, others=0
-        rel_baseline = []
-        for rank, c in enumerate(candidates[:10]):
-            if c["id"] in clicked_set:
-                rel_baseline.append(2)
-            elif rank < 5:
-                rel_baseline.append(1)
-            else:
-                rel_baseline.append(0)
-                
-        metrics["baseline"]["ndcg"].append(ndcg_at_k(rel_baseline, 10))
-        metrics["baseline"]["mrr"].append(mrr_at_k(rel_baseline, 10))
-        
-        found_in_recall = any(c["id"] in clicked_set for c in candidates)
-        metrics["baseline"]["recall"].append(1 if found_in_recall else 0)
-        
-        # 2. Retriever + Ranker
-        ranked = ranker.predict(candidates, query)
+    print(f"Evaluating systems on {len(test_groups)} test queries...")
+    # Every test query is retrieved and re-ranked in one batch
+    queries = list(test_groups)
+    hits = retriever.retrieve_batch([retriever.tokenize(q) for q in queries], k=50)
+    candidates = [doc_ids for doc_ids, _ in hits]
+    ranker_scores = ranker.score_batch(retriever, candidates, queries)
+    
+    for i, query in enumerate(queries):
+        clicked_set = set(test_groups[query])
+        ids = np.array([item["id"] for item in retriever.store.project(candidates[i], ["id"])], dtype=object)
         
-        rel_ranker = []
-        for rank, c in enumerate(ranked[:10]):
-            if c["id"] in clicked_set:
-                rel_ranker.append(2)
-            elif rank < 5:
-                rel_ranker.append(1)
-            else:
-                rel_ranker.append(0)
-                
-        metrics["ranker"]["ndcg"].append(ndcg_at_k(rel_ranker, 10))
-        metrics["ranker"]["mrr"].append(mrr_at_k(rel_ranker, 10))
-        metrics["ranker"]["recall"].append(1 if found_in_recall else 0) # Recall is same as candidates
+        # 1. Retriever-only baseline, then 2. Retriever + Ranker
+        found_in_recall = bool(clicked_set.intersection(ids.tolist()))
+        ranked = ids if ranker_scores is None else ids[np.argsort(-ranker_scores[i], kind="stable")]
+        for sys_name, order in (("baseline", ids), ("ranker", ranked)):
+            # Position-aware implicit relevance: Clicked=2, Top5=1, others=0
+            rel = [2 if item_id in clicked_set else 1 if rank < 5 else 0
+                   for rank, item_id in enumerate(order[:10].tolist())]
+            metrics[sys_name]["ndcg"].append(ndcg_at_k(rel, 10))
+            metrics[sys_name]["mrr"].append(mrr_at_k(rel, 10))
+            metrics[sys_name]["recall"].append(1 if found_in_recall else 0) # Recall is same as candidates
         
     print("\nOffline Evaluation Results:")
     print("-" * 40)
@@ -2,14 +2,14 @@ import json
 import random
 import time
 import os
+from engine import read_items
 
 NUM_CLICKS = 20_000
 OUTPUT_DIR = "."
 
 def generate_fast_clicks():
     print("Loading items...")
-    with open(os.path.join(OUTPUT_DIR, "items.jsonl"), "r") as f:
-        items = [json.loads(line) for line in f]
+    items = list(read_items(os.path.join(OUTPUT_DIR, "items.jsonl")).values())
         
     print(f"Generating {NUM_CLICKS} clicks (fast mode)...")
     logs = []
@@ -0,0 +1,231 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from inverted_index import BLOCK_SHIFT
+
+# Categorical item fields that can be filtered on and faceted
+FACET_FIELDS = ("category", "brand")
+# Bitsets are padded to whole index blocks (see InvertedIndex), so they
+# can be popcounted block by block
+_BLOCK_BYTES = (1 << BLOCK_SHIFT) // 8
+# Rows kept unsorted beside the sorted price column before they are
+# merged into it
+MAX_PRICE_DELTA = 16_384
+
+
+def _padded_bytes(n_bits: int) -> int:
+    """Bytes holding n_bits, rounded up to whole blocks."""
+    return -(-n_bits // (8 * _BLOCK_BYTES)) * _BLOCK_BYTES
+
+
+class _Bitset:
+    """
+    Append-only packed bits (bit i of byte i >> 3 is row i), shared by
+    successive index versions like item_store._Buffer: `used` is the
+    high-water mark across versions, and a version only appends in place
+    if nobody appended past its end.
+    """
+
+    def __init__(self, capacity_bytes: int = 0):
+        self.data = np.zeros(capacity_bytes, dtype=np.uint8)
+        self.used = 0
+
+    @classmethod
+    def wrap(cls, data: np.ndarray, used: int) -> "_Bitset":
+        """A bitset around existing (possibly read-only, mapped) data."""
+        bits = cls.__new__(cls)
+        bits.data = data
+        bits.used = used
+        return bits
+
+    @staticmethod
+    def extend(bits: "_Bitset", n: int, values: np.ndarray) -> "_Bitset":
+        """Returns a bitset holding the first n bits of `bits` followed by `values` (bool)."""
+        end = n + len(values)
+        if bits.used != n or -(-end // 8) > len(bits.data) or not bits.data.flags.writeable:
+            grown = _Bitset(_padded_bytes(2 * end))
+            full = min(n >> 3, len(bits.data))
+            grown.data[:full] = bits.data[:full]
+            if n & 7 and (n >> 3) < len(bits.data):
+                grown.data[n >> 3] = bits.data[n >> 3] & ((1 << (n & 7)) - 1)
+            bits = grown
+        rows = n + np.flatnonzero(values)
+        np.bitwise_or.at(bits.data, rows >> 3, np.left_shift(1, rows & 7).astype(np.uint8))
+        bits.used = end
+        return bits
+
+
+class DocSet:
+    """
+    A set of doc ids as packed bits, padded to whole index blocks. Passed
+    to InvertedIndex.top_k to drop non-members before scoring, and
+    intersected and counted with vectorized popcounts for facets.
+    """
+
+    def __init__(self, bits: np.ndarray):
+        self.bits = bits
+        self._block_counts = None
+
+    @classmethod
+    def from_docs(cls, chunks: Iterable[np.ndarray], n: int) -> "DocSet":
+        """The doc ids (below n) of `chunks`, set bit by bit, e.g. straight from posting lists."""
+        bits = np.zeros(_padded_bytes(n), dtype=np.uint8)
+        for docs in chunks:
+            np.bitwise_or.at(bits, docs >> 3, np.left_shift(1, docs & 7).astype(np.uint8))
+        return cls(bits)
+
+    def __and__(self, other: "DocSet") -> "DocSet":
+        n = min(len(self.bits), len(other.bits))
+        return DocSet(self.bits[:n] & other.bits[:n])
+
+    def __len__(self):
+        return int(np.bitwise_count(self.bits.view(np.uint64)).sum())
+
+    def contains(self, docs: np.ndarray) -> np.ndarray:
+        """Membership (bool) of each of `docs` (doc ids below the set's padded size)."""
+        return (self.bits[docs >> 3] >> (docs & 7) & 1).astype(bool)
+
+    def block_counts(self) -> np.ndarray:
+        """Members per index block (1 << BLOCK_SHIFT doc ids), computed once."""
+        if self._block_counts is None:
+            words = np.bitwise_count(self.bits.view(np.uint64))
+            self._block_counts = words.reshape(-1, _BLOCK_BYTES // 8).sum(axis=1)
+        return self._block_counts
+
+    def count_in(self, bits: np.ndarray) -> int:
+        """Members also set in `bits` (another packed bitset, any length)."""
+        n = min(len(self.bits), len(bits)) & ~7
+        return int(np.bitwise_count(self.bits[:n].view(np.uint64) & bits[:n].view(np.uint64)).sum())
+
+
+class FilterIndex:
+    """
+    Structured filters over the item store: one bitset per value of each
+    categorical field (indexed by the store's interned codes) and the
+    price column sorted once, so that a range is two binary searches.
+
+    Copy-on-write like the store: `with_rows` returns a version covering
+    newly appended store rows, sharing the bitsets' storage; new prices
+    stay unsorted beside the sorted column until MAX_PRICE_DELTA of them
+    trigger a re-sort. Deleted rows are not removed here: filters are
+    always combined with the index's live postings.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.bitsets: Dict[str, Dict[int, _Bitset]] = {field: {} for field in FACET_FIELDS}
+        self.price_order = np.zeros(0, dtype=np.int64)  # rows by ascending price
+        self.prices = np.zeros(0, dtype=np.float64)  # their prices
+        self.price_delta = np.zeros(0, dtype=np.int64)  # rows appended since, unsorted
+
+    def to_state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """(arrays, JSON metadata) of this version, for persistence (see index_snapshot)."""
+        arrays = {"price_order": self.price_order, "prices": self.prices, "price_delta": self.price_delta}
+        for field, bitsets in self.bitsets.items():
+            for code, bits in bitsets.items():
+                arrays[f"{field}.{code}"] = bits.data[:_padded_bytes(self.n)]
+        return arrays, {"n": self.n}
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict) -> "FilterIndex":
+        """Inverse of `to_state`. Arrays are used as is (e.g. memory-mapped)."""
+        index = cls()
+        index.n = meta["n"]
+        index.price_order, index.prices, index.price_delta = arrays["price_order"], arrays["prices"], arrays["price_delta"]
+        for name, data in arrays.items():
+            field, _, code = name.partition(".")
+            if field in index.bitsets:
+                index.bitsets[field][int(code)] = _Bitset.wrap(data, index.n)
+        return index
+
+    @staticmethod
+    def _codes(store, field: str) -> np.ndarray:
+        return store.category_codes if field == "category" else store.brand_codes
+
+    @staticmethod
+    def _values(store, field: str):
+        return store.categories if field == "category" else store.brands
+
+    def with_rows(self, store) -> "FilterIndex":
+        """A version also covering store rows len(self)... (the store only ever appends)."""
+        n = self.n
+        if store.n == n:
+            return self
+        index = FilterIndex()
+        index.n = store.n
+        for field in FACET_FIELDS:
+            codes = self._codes(store, field)[n:]
+            bitsets = dict(self.bitsets[field])
+            # Every value is extended, with zeros if absent, so each stays
+            # appendable in place
+            for code in set(bitsets) | set(np.unique(codes[codes >= 0]).tolist()):
+                bitsets[code] = _Bitset.extend(bitsets.get(code, _Bitset()), n, codes == code)
+            index.bitsets[field] = bitsets
+
+        delta = np.concatenate([self.price_delta, np.arange(n, store.n, dtype=np.int64)])
+        if len(delta) > MAX_PRICE_DELTA or not len(self.price_order):
+            # Sort the delta only, then merge it in (linear)
+            delta = delta[np.argsort(store.price[delta], kind="stable")]
+            at = np.searchsorted(self.prices, store.price[delta], side="right")
+            index.price_order = np.insert(self.price_order, at, delta)
+            index.prices = np.insert(self.prices, at, store.price[delta])
+            index.price_delta = np.zeros(0, dtype=np.int64)
+        else:
+            index.price_order, index.prices, index.price_delta = self.price_order, self.prices, delta
+        return index
+
+    def select(self, store, filters: Dict) -> Optional[DocSet]:
+        """
+        Rows matching every given filter (None if no filter is given).
+        `filters`: field (of FACET_FIELDS) -> accepted values, and/or
+        "price" -> (min, max), either bound None for unbounded.
+        """
+        selected = None
+        for field in FACET_FIELDS:
+            values = filters.get(field)
+            if not values:
+                continue
+            bits = np.zeros(_padded_bytes(self.n), dtype=np.uint8)
+            codes = self._values(store, field).codes
+            for value in values:
+                bitset = self.bitsets[field].get(codes.get(value, -1))
+                if bitset is not None:
+                    m = min(len(bits), len(bitset.data))
+                    bits[:m] |= bitset.data[:m]
+            selected = DocSet(bits) if selected is None else selected & DocSet(bits)
+
+        low, high = filters.get("price") or (None, None)
+        if low is not None or high is not None:
+            lo = 0 if low is None else int(np.searchsorted(self.prices, low, side="left"))
+            hi = len(self.prices) if high is None else int(np.searchsorted(self.prices, high, side="right"))
+            prices = store.price[self.price_delta]
+            in_delta = np.ones(len(prices), dtype=bool)
+            if low is not None:
+                in_delta &= prices >= low
+            if high is not None:
+                in_delta &= prices <= high
+            docs = DocSet.from_docs([self.price_order[lo:hi], self.price_delta[in_delta]], self.n)
+            selected = docs if selected is None else selected & docs
+        return selected
+
+    def facets(self, store, docs: DocSet, fields: List[str]) -> Dict[str, Dict[str, int]]:
+        """For each field, the number of `docs` having each value (nonzero only, most first)."""
+        out = {}
+        for field in fields:
+            if field not in self.bitsets:
+                continue
+            names = self._values(store, field).values
+            counts: List[Tuple[str, int]] = []
+            for code, bitset in self.bitsets[field].items():
+                count = docs.count_in(bitset.data)
+                if count:
+                    counts.append((names[code], count))
+            counts.sort(key=lambda vc: (-vc[1], vc[0]))
+            out[field] = dict(counts)
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        bitsets = sum(b.data.nbytes for field in self.bitsets.values() for b in field.values())
+        return bitsets + self.price_order.nbytes + self.prices.nbytes + self.price_delta.nbytes
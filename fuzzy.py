@@ -0,0 +1,162 @@
+import copy
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Edits (insert, delete, substitute, swap adjacent) tolerated per term
+MAX_EDIT_DISTANCE = 2
+# Deletes are generated from this many leading characters only, which
+# bounds them per term (SymSpell's prefix length)
+PREFIX_LENGTH = 7
+# At most this many vocabulary terms replace one unknown query term...
+MAX_EXPANSIONS = 3
+# ...chosen among at most this many candidates sharing a delete
+MAX_CANDIDATES = 100
+# Weight of an expansion, by edit distance, applied to its idf
+DISTANCE_WEIGHTS = {1: 0.5, 2: 0.25}
+# Expansion of a whole query stops checking candidates after this long
+BUDGET_MS = 1.0
+# New terms kept beside the sorted arrays before they are rebuilt
+MAX_DELTA = 10_000
+
+
+def max_distance(term: str) -> int:
+    """Edits allowed for a query term: none for short or numeric ones, one up to 5 characters."""
+    if len(term) < 3 or term.isdigit():
+        return 0
+    return 1 if len(term) <= 5 else MAX_EDIT_DISTANCE
+
+
+def _deletes(term: str, distance: int) -> set:
+    """`term` (cut to PREFIX_LENGTH) and every string made by deleting up to `distance` characters."""
+    term = term[:PREFIX_LENGTH]
+    out = {term}
+    for d in range(1, min(distance, len(term) - 1) + 1):
+        out.update("".join(chars) for chars in itertools.combinations(term, len(term) - d))
+    return out
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (Levenshtein plus adjacent swaps); limit + 1 once above `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return prev[-1]
+
+
+class FuzzyIndex:
+    """
+    SymSpell-style deletion index over the vocabulary, for mapping
+    misspelled query terms to known terms in bounded time.
+
+    Every vocabulary term is stored under the strings obtained by deleting
+    up to MAX_EDIT_DISTANCE characters from its first PREFIX_LENGTH
+    characters (as a sorted array of string hashes with the term id of
+    each). Two terms within k edits share such a delete, so a query term's
+    candidates are found with one vectorized searchsorted over its own
+    deletes; each is then checked with the real edit distance.
+
+    Copy-on-write like the index: `with_terms` returns a new version
+    sharing the sorted arrays, with new terms in a small dict until
+    MAX_DELTA of them trigger a rebuild.
+    """
+
+    def __init__(self, terms: Optional[List[str]] = None, first_id: int = 0):
+        """Indexes `terms`, whose term ids are first_id, first_id + 1, ..."""
+        self.terms: List[str] = list(terms or [])
+        hashes, ids = [], []
+        for term_id, term in enumerate(self.terms, start=first_id):
+            for delete in _deletes(term, MAX_EDIT_DISTANCE):
+                hashes.append(hash(delete))
+                ids.append(term_id)
+        order = np.argsort(np.array(hashes, dtype=np.int64), kind="stable")
+        self.hashes = np.array(hashes, dtype=np.int64)[order]
+        self.term_ids = np.array(ids, dtype=np.int64)[order]
+        self.first_id = first_id
+        self.delta: Dict[str, List[int]] = {}  # delete -> term ids, for terms added since
+        self.delta_terms: Dict[int, str] = {}
+
+    def __len__(self):
+        return len(self.terms) + len(self.delta_terms)
+
+    def with_terms(self, new_terms: List[str]) -> "FuzzyIndex":
+        """A version also holding `new_terms`, which take the next term ids."""
+        if not new_terms:
+            return self
+        if len(self.delta_terms) + len(new_terms) > MAX_DELTA:
+            return FuzzyIndex(self.terms + list(self.delta_terms.values()) + new_terms, self.first_id)
+        index = copy.copy(self)
+        index.delta = {delete: list(ids) for delete, ids in self.delta.items()}
+        index.delta_terms = dict(self.delta_terms)
+        for term_id, term in enumerate(new_terms, start=self.first_id + len(self)):
+            index.delta_terms[term_id] = term
+            for delete in _deletes(term, MAX_EDIT_DISTANCE):
+                index.delta.setdefault(delete, []).append(term_id)
+        return index
+
+    def _term(self, term_id: int) -> str:
+        i = term_id - self.first_id
+        return self.terms[i] if i < len(self.terms) else self.delta_terms[term_id]
+
+    def candidates(self, term: str, doc_freqs: np.ndarray, deadline: Optional[float] = None) -> List[Tuple[str, int]]:
+        """
+        Up to MAX_EXPANSIONS (vocabulary term, edit distance) pairs for
+        `term`, nearest first then most frequent; only terms with live
+        documents (doc_freqs > 0) count. Stops early past `deadline`
+        (time.perf_counter()).
+        """
+        limit = max_distance(term)
+        if not limit:
+            return []
+        deletes = list(_deletes(term, limit))
+        keys = np.array([hash(d) for d in deletes], dtype=np.int64)
+        lo = np.searchsorted(self.hashes, keys, side="left")
+        hi = np.searchsorted(self.hashes, keys, side="right")
+        ids = [self.term_ids[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+        ids = np.unique(np.concatenate(ids)) if ids else np.zeros(0, dtype=np.int64)
+        extra = {t for d in deletes for t in self.delta.get(d, ())}
+        if extra:
+            ids = np.union1d(ids, np.fromiter(extra, dtype=np.int64, count=len(extra)))
+        ids = ids[ids < len(doc_freqs)]
+        ids = ids[doc_freqs[ids] > 0]
+        if len(ids) > MAX_CANDIDATES:
+            # Most frequent first: the likeliest intended terms
+            ids = ids[np.argsort(-doc_freqs[ids], kind="stable")[:MAX_CANDIDATES]]
+
+        found = []
+        for term_id in ids.tolist():
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            candidate = self._term(term_id)
+            distance = edit_distance(term, candidate, limit)
+            if 0 < distance <= limit:
+                found.append((distance, -int(doc_freqs[term_id]), candidate))
+        found.sort()
+        return [(candidate, distance) for distance, _, candidate in found[:MAX_EXPANSIONS]]
+
+    def expand(self, terms: List[str], known, doc_freqs: np.ndarray,
+               budget_ms: float = BUDGET_MS) -> List[Tuple[str, str, float]]:
+        """
+        (query term, vocabulary term, weight) expansions for the query
+        terms `known(term)` rejects, within `budget_ms` in total.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000
+        expansions = []
+        for term in dict.fromkeys(terms):
+            if known(term):
+                continue
+            for candidate, distance in self.candidates(term, doc_freqs, deadline):
+                expansions.append((term, candidate, DISTANCE_WEIGHTS[distance]))
+        return expansions
@@ -0,0 +1,225 @@
+"""
+On-disk snapshot of a Retriever (BM25 index and item store), so startup
+does not have to parse items.jsonl and rebuild the index.
+
+A snapshot is a directory with one .npy file per array, a meta.json with
+the scalar state (statistics, vocabulary, category tables, ...) and a
+manifest.json with the format version, a CRC32 of every file and the
+state of items.jsonl it was built from. Arrays are opened with
+`np.load(mmap_mode="r")`: nothing is read or copied up front and the
+pages are shared between processes through the page cache. The index and
+store never write to existing arrays (copy-on-write), so read-only maps
+are safe.
+
+items.jsonl is append-only, so a snapshot stays usable after appends as
+long as the prefix it was built from is unchanged: the appended lines are
+replayed on top of it. Anything else (older format, checksum mismatch,
+rewritten items file) means the caller rebuilds from JSONL.
+
+Several processes (uvicorn workers) can serve from one snapshot: each
+maps the same files, so the index and item columns exist once in memory.
+`exclusive` serializes building and writing across processes, so one
+loader builds while the others wait and then attach. Every write bumps
+the manifest's `generation`; processes poll `generation` and re-attach
+when it changes (e.g. after a reindex in another worker).
+"""
+
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+import zlib
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+from retriever import Retriever
+
+# Bump on any change to the layout below or to the to_state formats
+FORMAT_VERSION = 2
+MANIFEST = "manifest.json"
+META = "meta.json"
+_CHUNK = 1 << 20
+
+
+def _crc32(path: str, limit: Optional[int] = None) -> int:
+    """CRC32 of a file, or of its first `limit` bytes."""
+    crc = 0
+    remaining = limit if limit is not None else float("inf")
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(int(min(_CHUNK, remaining)))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+    return crc
+
+
+def source_state(items_path: str) -> Dict[str, Any]:
+    """Size, mtime and prefix checksum of the items log, taken together."""
+    st = os.stat(items_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "crc32": _crc32(items_path, st.st_size)}
+
+
+@contextlib.contextmanager
+def exclusive(path: str):
+    """
+    Holds an advisory lock on the snapshot at `path` across processes
+    (a `.lock` file beside it), for building or replacing it.
+    """
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def generation(path: str) -> Optional[int]:
+    """Generation of the snapshot at `path` (bumped by every `write`), None if there is none."""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f).get("generation", 0)
+    except (OSError, ValueError):
+        return None
+
+
+def write(retriever: Retriever, path: str, source: Dict[str, Any]) -> int:
+    """
+    Writes `retriever` as a snapshot at `path`, replacing any existing
+    one, and returns its generation. `source` is `source_state` of the
+    items log taken while the retriever matched it. Writers must be held
+    off (the vocabulary and side tables are shared with newer versions),
+    and other processes too if several may write (see `exclusive`).
+    """
+    start = time.time()
+    arrays, meta = retriever.to_state()
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    files = {}
+    for i, (name, array) in enumerate(arrays.items()):
+        filename = f"{i:04d}.npy"
+        np.save(os.path.join(tmp, filename), np.ascontiguousarray(array))
+        files[filename] = name
+    with open(os.path.join(tmp, META), "w") as f:
+        json.dump(meta, f)
+
+    manifest = {
+        "version": FORMAT_VERSION,
+        "generation": (generation(path) or 0) + 1,
+        "created_at": time.time(),
+        "source": source,
+        "arrays": files,
+        "checksums": {name: _crc32(os.path.join(tmp, name)) for name in [META] + list(files)},
+        "items": len(retriever.bm25) if retriever.bm25 else 0,
+    }
+    with open(os.path.join(tmp, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    # Readers may still map files of the old snapshot; unlinking is fine.
+    old = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    print(f"Wrote index snapshot {path} ({size / 1e6:.1f} MB) in {time.time() - start:.2f}s.")
+    return manifest["generation"]
+
+
+def _read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"format version {manifest.get('version')}, expected {FORMAT_VERSION}")
+    return manifest
+
+
+def verify(path: str) -> List[str]:
+    """Names of files whose checksum does not match the manifest."""
+    manifest = _read_manifest(path)
+    return [name for name, crc in manifest["checksums"].items()
+            if not os.path.exists(os.path.join(path, name)) or _crc32(os.path.join(path, name)) != crc]
+
+
+def _replay(items_path: str, offset: int) -> Tuple[List[Dict], List[str]]:
+    """(upserted items, deleted ids) logged from byte `offset` on; last line per id wins."""
+    ops: Dict[str, Optional[Dict]] = {}
+    with open(items_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            item = json.loads(line)
+            ops.pop(item["id"], None)  # keep log order of the last change
+            ops[item["id"]] = None if item.get("_deleted") else item
+    return [item for item in ops.values() if item is not None], [i for i, item in ops.items() if item is None]
+
+
+def load(path: str, items_path: str, check: bool = True) -> Optional[Retriever]:
+    """
+    Opens the snapshot at `path` for the current `items_path`, replaying
+    lines appended since it was written. Returns None if there is no
+    usable snapshot (the caller rebuilds from JSONL). With `check`, file
+    checksums are verified first, which reads every file once.
+    """
+    start = time.time()
+    if not os.path.exists(os.path.join(path, MANIFEST)):
+        print(f"No index snapshot at {path}.")
+        return None
+    try:
+        manifest = _read_manifest(path)
+        source = manifest["source"]
+        st = os.stat(items_path)
+        if (st.st_size, st.st_mtime_ns) == (source["size"], source["mtime_ns"]):
+            tail = None
+        elif st.st_size >= source["size"] and _crc32(items_path, source["size"]) == source["crc32"]:
+            tail = source["size"]
+        else:
+            print(f"Index snapshot {path} is stale: {items_path} was rewritten.")
+            return None
+        if check:
+            bad = verify(path)
+            if bad:
+                print(f"Index snapshot {path} is corrupt: checksum mismatch in {', '.join(bad)}.")
+                return None
+        with open(os.path.join(path, META)) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, filename), mmap_mode="r", allow_pickle=False)
+                  for filename, name in manifest["arrays"].items()}
+        retriever = Retriever.from_state(arrays, meta)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Index snapshot {path} unusable: {e}")
+        return None
+
+    print(f"Opened index snapshot {path} ({manifest['items']} items) in {time.time() - start:.2f}s.")
+    if tail is not None:
+        upserts, deletes = _replay(items_path, tail)
+        retriever = retriever.without_items(deletes)
+        if upserts:
+            retriever = retriever.with_items(upserts)
+        print(f"Replayed {len(upserts)} updates and {len(deletes)} deletes from {items_path}.")
+    return retriever
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or check an index snapshot.")
+    parser.add_argument("command", choices=["build", "verify"])
+    parser.add_argument("--items", default="items.jsonl")
+    parser.add_argument("--out", default="index_snapshot")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from engine import read_items
+
+        source = source_state(args.items)
+        retriever = Retriever()
+        retriever.index(list(read_items(args.items).values()))
+        write(retriever, args.out, source)
+    else:
+        bad = verify(args.out)
+        print("OK" if not bad else f"Checksum mismatch: {', '.join(bad)}")
+        raise SystemExit(1 if bad else 0)
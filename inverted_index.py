@@ -0,0 +1,759 @@
+import copy
+import itertools
+import math
+import numpy as np
+from scipy import sparse
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Documents are grouped into fixed doc-id ranges of 2**BLOCK_SHIFT for
+# block-max pruning.
+BLOCK_SHIFT = 10
+# Below this many postings a query is cheaper to score exhaustively.
+PRUNE_MIN_POSTINGS = 8192
+# Merge policy: once there are more than MAX_SEGMENTS segments, the
+# MERGE_FACTOR adjacent segments holding the fewest documents are merged.
+MAX_SEGMENTS = 8
+MERGE_FACTOR = 4
+# A segment where more than this share of documents are deleted but still
+# have postings is compacted.
+MAX_DELETED_RATIO = 0.3
+# Batched queries are scored in groups whose terms have at most this many
+# postings in total, which bounds the query-by-document score matrix.
+BATCH_MAX_POSTINGS = 1 << 22
+
+# (global term id, idf) pairs of a query, in query order
+Query = List[Tuple[int, float]]
+# bm25(idf, tf, doc_len) -> contribution
+Scorer = Callable[[float, np.ndarray, np.ndarray], np.ndarray]
+
+
+def _empty() -> Tuple[np.ndarray, np.ndarray]:
+    return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, end) for each pair, vectorized."""
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(int(lengths.sum()))
+
+
+def _accumulate(postings: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Sums per-term (docs, contrib) pairs into (sorted doc ids, scores)."""
+    if not postings:
+        return _empty()
+    if len(postings) == 1:
+        return postings[0]
+    docs = np.unique(np.concatenate([p[0] for p in postings]))
+    scores = np.zeros(len(docs), dtype=np.float64)
+    # Accumulate term by term in query order, like BM25Okapi.get_scores.
+    for term_docs, contrib in postings:
+        scores[np.searchsorted(docs, term_docs)] += contrib
+    return docs, scores
+
+
+def _select(docs: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keeps the k best positive scores with argpartition (unordered).
+    `docs` must be sorted so that ties at the cut keep the lowest ids.
+    """
+    positive = scores > 0
+    docs, scores = docs[positive], scores[positive]
+    if len(docs) <= k:
+        return docs, scores
+    kth = -np.partition(-scores, k - 1)[k - 1]
+    above = scores > kth
+    ties = np.flatnonzero(scores == kth)[:k - int(above.sum())]
+    keep = np.sort(np.concatenate([np.flatnonzero(above), ties]))
+    return docs[keep], scores[keep]
+
+
+def raw_idf(num_docs: int, freq: int) -> float:
+    """BM25Okapi's idf before the floor for very common terms (see InvertedIndex._idf)."""
+    return math.log(num_docs - freq + 0.5) - math.log(freq + 0.5)
+
+
+class IndexSegment:
+    """
+    Immutable postings for the run of documents
+    [doc_lo, doc_lo + num_docs) of the global doc id space.
+
+    Postings are stored CSR-style over the segment's own terms: the postings
+    of global term id `terms[i]` are `doc_ids[indptr[i]:indptr[i + 1]]`
+    (global doc ids, sorted) with the matching term frequencies in `tfs`.
+
+    Every term also keeps block-max metadata: for each doc-id block it
+    occurs in, the posting range, the largest tf and the shortest document
+    length. These bound the term's contribution to any document of the
+    block whatever the global idf and average length are, which lets
+    `top_k` skip blocks that cannot reach the current k-th score
+    (block-max MaxScore).
+
+    Deletes are tombstones: `with_deletes` returns a copy sharing the
+    postings with a new live mask. Merging segments drops dead postings.
+    """
+
+    def __init__(self, doc_lo: int, doc_len: np.ndarray, live: np.ndarray,
+                 posting_terms: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray):
+        # Posting arrays must be sorted by (term, doc).
+        self.doc_lo = doc_lo
+        self.doc_len = doc_len  # by doc_id - doc_lo
+        self.live = live  # by doc_id - doc_lo
+        self.num_live = int(live.sum())
+        self.doc_ids = doc_ids.astype(np.int32)
+        self.tfs = tfs.astype(np.int32)
+
+        term_starts = np.flatnonzero(np.r_[True, posting_terms[1:] != posting_terms[:-1]]) if len(posting_terms) else np.zeros(0, dtype=np.int64)
+        self.terms = posting_terms[term_starts].astype(np.int64)
+        self.indptr = np.append(term_starts, len(posting_terms)).astype(np.int64)
+
+        # Block-max metadata, CSR over terms like the postings themselves
+        blocks = (self.doc_ids >> BLOCK_SHIFT) - (doc_lo >> BLOCK_SHIFT)
+        self.num_blocks = ((doc_lo + len(live)) >> BLOCK_SHIFT) - (doc_lo >> BLOCK_SHIFT) + 1
+        key = posting_terms * self.num_blocks + blocks
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.zeros(0, dtype=np.int64)
+        self.block_ids = blocks[starts].astype(np.int32)
+        self.block_starts = np.append(starts, len(key)).astype(np.int64)  # plus end sentinel
+        self.block_indptr = np.searchsorted(starts, self.indptr).astype(np.int64)
+        if len(starts):
+            self.block_max_tf = np.maximum.reduceat(self.tfs, starts)
+            self.block_min_len = np.minimum.reduceat(doc_len[self.doc_ids - doc_lo], starts)
+        else:
+            self.block_max_tf = np.zeros(0, dtype=np.int32)
+            self.block_min_len = np.zeros(0, dtype=np.int32)
+
+        # Forward index (distinct term ids per document): undoes document
+        # frequencies on delete and gives title/query overlap.
+        order = np.argsort(self.doc_ids, kind="stable")
+        self.fwd_terms = posting_terms[order].astype(np.int32)
+        self.fwd_indptr = np.zeros(len(live) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.doc_ids - doc_lo, minlength=len(live)), out=self.fwd_indptr[1:])
+        self.num_dead = self._count_dead()
+
+    def _count_dead(self) -> int:
+        """Deleted documents whose postings are still stored (merging drops them)."""
+        return int(np.count_nonzero(~self.live & (self.fwd_indptr[1:] > self.fwd_indptr[:-1])))
+
+    # Everything a segment holds, see `arrays`
+    ARRAYS = ("doc_len", "live", "doc_ids", "tfs", "terms", "indptr", "block_ids", "block_starts",
+              "block_indptr", "block_max_tf", "block_min_len", "fwd_terms", "fwd_indptr")
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.live)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, doc_lo: int, arrays: Dict[str, np.ndarray]) -> "IndexSegment":
+        """
+        Restores a segment from `arrays()` (e.g. memory-mapped) as is,
+        without recomputing the block-max metadata or forward index.
+        """
+        seg = cls.__new__(cls)
+        seg.doc_lo = doc_lo
+        for name in cls.ARRAYS:
+            setattr(seg, name, arrays[name])
+        seg.num_live = int(seg.live.sum())
+        seg.num_dead = seg._count_dead()
+        seg.num_blocks = ((doc_lo + len(seg.live)) >> BLOCK_SHIFT) - (doc_lo >> BLOCK_SHIFT) + 1
+        return seg
+
+    @classmethod
+    def build(cls, doc_lo: int, doc_len: np.ndarray, term_ids: np.ndarray) -> "IndexSegment":
+        """
+        Builds a segment from the flattened term ids of consecutive
+        documents starting at `doc_lo`, with per-document lengths `doc_len`.
+        """
+        n = max(len(doc_len), 1)
+        docs = np.repeat(np.arange(len(doc_len), dtype=np.int64), doc_len)
+        # One posting per distinct (term, doc) pair, sorted by term then doc.
+        keys, tfs = np.unique(term_ids * n + docs, return_counts=True)
+        return cls(doc_lo, doc_len, np.ones(len(doc_len), dtype=bool),
+                   keys // n, keys % n + doc_lo, tfs)
+
+    @classmethod
+    def merge(cls, segments: List["IndexSegment"]) -> "IndexSegment":
+        """Merges adjacent segments into one, dropping deleted postings."""
+        terms, docs, tfs = [], [], []
+        for seg in segments:
+            seg_terms = np.repeat(seg.terms, np.diff(seg.indptr))
+            keep = seg.live[seg.doc_ids - seg.doc_lo]
+            terms.append(seg_terms[keep])
+            docs.append(seg.doc_ids[keep])
+            tfs.append(seg.tfs[keep])
+        terms = np.concatenate(terms)
+        # Segments are in doc order, so a stable sort by term keeps each
+        # term's doc ids sorted.
+        order = np.argsort(terms, kind="stable")
+        return cls(segments[0].doc_lo,
+                   np.concatenate([s.doc_len for s in segments]),
+                   np.concatenate([s.live for s in segments]),
+                   terms[order], np.concatenate(docs)[order], np.concatenate(tfs)[order])
+
+    def with_deletes(self, doc_ids: np.ndarray) -> Tuple["IndexSegment", np.ndarray]:
+        """
+        Returns (segment, newly deleted doc ids). The postings are shared;
+        only the live mask is copied.
+        """
+        doc_ids = doc_ids[self.live[doc_ids - self.doc_lo]]
+        seg = copy.copy(self)
+        seg.live = self.live.copy()
+        seg.live[doc_ids - self.doc_lo] = False
+        seg.num_live = self.num_live - len(doc_ids)
+        seg.num_dead = self.num_dead + int(np.count_nonzero(
+            self.fwd_indptr[doc_ids - self.doc_lo + 1] > self.fwd_indptr[doc_ids - self.doc_lo]))
+        return seg, doc_ids
+
+    def forward_terms(self, doc_ids: np.ndarray) -> np.ndarray:
+        """Distinct term ids of each of `doc_ids`, concatenated."""
+        local = doc_ids - self.doc_lo
+        return self.fwd_terms[_ranges(self.fwd_indptr[local], self.fwd_indptr[local + 1])]
+
+    def _local(self, query: Query) -> List[Tuple[int, float]]:
+        """Maps global term ids to this segment's term rows, in query order."""
+        rows = np.searchsorted(self.terms, [t for t, _ in query])
+        return [(int(i), idf) for i, (t, idf) in zip(rows, query)
+                if i < len(self.terms) and self.terms[i] == t]
+
+    def _term_scores(self, i: int, idf: float, bm25: Scorer, positions=None,
+                     allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 contribution of term row `i` to every live document it occurs
+        in, or only to the postings at `positions` (absolute offsets).
+        Documents not in `allowed` (a filters.DocSet) are dropped first.
+        """
+        if positions is None:
+            positions = slice(self.indptr[i], self.indptr[i + 1])
+        docs = self.doc_ids[positions]
+        tf = self.tfs[positions]
+        if self.num_live < self.num_docs:
+            keep = self.live[docs - self.doc_lo]
+            docs, tf = docs[keep], tf[keep]
+        if allowed is not None:
+            keep = allowed.contains(docs)
+            docs, tf = docs[keep], tf[keep]
+        return docs, bm25(idf, tf, self.doc_len[docs - self.doc_lo])
+
+    def term_matrix(self, term_ids: np.ndarray, bm25: Scorer) -> sparse.csr_matrix:
+        """
+        Sparse (len(term_ids), num_docs) matrix of the BM25 contribution
+        at idf 1 of each global term id to each live document of this
+        segment (columns are doc_id - doc_lo); terms it lacks are empty rows.
+        """
+        rows = np.searchsorted(self.terms, term_ids)
+        present = np.flatnonzero(rows < len(self.terms))
+        present = present[self.terms[rows[present]] == term_ids[present]]
+        starts = np.zeros(len(term_ids), dtype=np.int64)
+        ends = np.zeros(len(term_ids), dtype=np.int64)
+        starts[present] = self.indptr[rows[present]]
+        ends[present] = self.indptr[rows[present] + 1]
+        positions = _ranges(starts, ends)
+        term_of = np.repeat(np.arange(len(term_ids)), ends - starts)
+        docs = self.doc_ids[positions] - self.doc_lo
+        tf = self.tfs[positions]
+        if self.num_live < self.num_docs:
+            keep = self.live[docs]
+            docs, tf, term_of = docs[keep], tf[keep], term_of[keep]
+        return sparse.csr_matrix((bm25(1.0, tf, self.doc_len[docs]), (term_of, docs)),
+                                 shape=(len(term_ids), self.num_docs))
+
+    def score(self, query: Query, bm25: Scorer) -> Tuple[np.ndarray, np.ndarray]:
+        return _accumulate([self._term_scores(i, idf, bm25) for i, idf in self._local(query)])
+
+    def top_k(self, query: Query, k: int, bm25: Scorer, stats: Optional[Dict[str, int]] = None,
+              allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The k best positive (doc_ids, scores) of this segment, unordered
+        but with doc ids sorted. Broad queries go through block-max pruning;
+        selective ones (few postings) are scored exhaustively. Postings
+        read and candidate documents scored are added to `stats`. Only
+        documents in `allowed` (a filters.DocSet) are scored, if given.
+        """
+        local = self._local(query)
+        if not local:
+            return _empty()
+        n_postings = sum(int(self.indptr[i + 1] - self.indptr[i]) for i, _ in local)
+        # Upper bounds are only sound when every contribution is >= 0
+        if n_postings <= PRUNE_MIN_POSTINGS or any(idf < 0 for _, idf in local):
+            docs, scores = _accumulate([self._term_scores(i, idf, bm25, allowed=allowed) for i, idf in local])
+            if stats is not None:
+                stats["postings"] += n_postings
+                stats["candidates"] += len(docs)
+            return _select(docs, scores, k)
+        return self._top_k_pruned(local, k, bm25, stats, allowed)
+
+    def _top_k_pruned(self, local: List[Tuple[int, float]], k: int, bm25: Scorer,
+                      stats: Optional[Dict[str, int]] = None, allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        entries = [np.arange(self.block_indptr[i], self.block_indptr[i + 1]) for i, _ in local]
+
+        # Block upper bound: sum over query terms of their best possible
+        # contribution in the block (max tf, shortest doc). Summed in query
+        # order so it is never below a real score, even after rounding.
+        block_ub = np.zeros(self.num_blocks, dtype=np.float64)
+        block_postings = np.zeros(self.num_blocks, dtype=np.int64)
+        for (i, idf), e in zip(local, entries):
+            ids = self.block_ids[e]
+            block_ub[ids] += bm25(idf, self.block_max_tf[e], self.block_min_len[e])
+            block_postings[ids] += self.block_starts[e + 1] - self.block_starts[e]
+        if allowed is not None:
+            # Blocks without an allowed document are never read, and the
+            # others only yield their allowed share of postings
+            first = self.doc_lo >> BLOCK_SHIFT
+            share = np.zeros(self.num_blocks, dtype=np.float64)
+            counts = allowed.block_counts()[first:first + self.num_blocks]
+            share[:len(counts)] = counts / (1 << BLOCK_SHIFT)
+            block_ub[share == 0] = 0
+            block_postings = block_postings * share
+
+        candidates = np.flatnonzero(block_ub > 0)
+        candidates = candidates[np.lexsort((candidates, -block_ub[candidates]))]
+        block_lo = (self.doc_lo >> BLOCK_SHIFT) << BLOCK_SHIFT
+
+        # First round: just enough blocks to hold k postings, then double.
+        take = int(np.searchsorted(np.cumsum(block_postings[candidates]), k)) + 1
+        pos = 0
+        top_docs, top_scores = _empty()
+        while pos < len(candidates):
+            if len(top_docs) == k:
+                # Remaining blocks are in (ub desc, block id asc) order, so
+                # once the next block cannot beat the k-th result, no later
+                # block can either.
+                kth = np.lexsort((top_docs, -top_scores))[-1]
+                nxt = candidates[pos]
+                if block_ub[nxt] < top_scores[kth] or (
+                        block_ub[nxt] == top_scores[kth] and block_lo + (int(nxt) << BLOCK_SHIFT) > top_docs[kth]):
+                    break
+
+            selected = np.zeros(self.num_blocks, dtype=bool)
+            selected[candidates[pos:pos + take]] = True
+            pos += take
+            take *= 2
+
+            postings = []
+            for (i, idf), e in zip(local, entries):
+                e = e[selected[self.block_ids[e]]]
+                if len(e):
+                    positions = _ranges(self.block_starts[e], self.block_starts[e + 1])
+                    postings.append(self._term_scores(i, idf, bm25, positions, allowed))
+            docs, scores = _accumulate(postings)
+            if stats is not None:
+                stats["postings"] += sum(len(d) for d, _ in postings)
+                stats["candidates"] += len(docs)
+
+            # Batches cover disjoint blocks, so the union needs no dedup.
+            docs = np.concatenate([top_docs, docs])
+            scores = np.concatenate([top_scores, scores])
+            order = np.argsort(docs, kind="stable")
+            top_docs, top_scores = _select(docs[order], scores[order], k)
+
+        return top_docs, top_scores
+
+
+class InvertedIndex:
+    """
+    Segmented (LSM-style) sparse BM25 index over tokenized documents.
+
+    Each `with_docs` builds a small immutable `IndexSegment` for the new
+    batch, so ingest cost depends on the batch size only. Queries fan out
+    over all segments using global statistics (live document count,
+    average length and document frequencies), so scores do not depend on
+    how the corpus is split. Deletes are tombstones; `plan_merge` and
+    `with_merge` compact segments and drop dead postings, and are meant to
+    run in the background.
+
+    Updates are copy-on-write: `with_docs`, `with_deletes` and `with_merge`
+    return a new index sharing segments with this one and never modify
+    arrays the old one can see, so readers holding the old index are not
+    affected. The vocabulary is shared and only ever grows; ids it hands
+    out past this index's `doc_freqs` are ignored.
+
+    Scoring follows rank_bm25's BM25Okapi (same k1, b, epsilon and idf
+    floor): for an index built in one go, scores are identical to
+    `BM25Okapi.get_scores`.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.vocab: Dict[str, int] = {}  # term -> term id
+        self.doc_freqs = np.zeros(0, dtype=np.int64)  # live documents per term id
+        self.segments: List[IndexSegment] = []  # in doc id order
+        self.num_docs = 0  # live documents
+        self.total_len = 0  # tokens in live documents
+        self.next_doc_id = 0
+        self._average_idf = None
+
+    def __len__(self):
+        return self.num_docs
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.num_docs if self.num_docs else 0.0
+
+    def build(self, corpus: List[List[str]]):
+        """
+        Builds the index from scratch, in place. Document ids are positions
+        in `corpus`.
+        """
+        self.__init__(self.k1, self.b, self.epsilon)
+        self._add(corpus)
+
+    def to_state(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """
+        (arrays, JSON metadata) describing this version, for persistence.
+        Reads the shared vocabulary, so writers must be held off.
+        """
+        n_terms = len(self.doc_freqs)
+        arrays = {"doc_freqs": self.doc_freqs}
+        for i, seg in enumerate(self.segments):
+            arrays.update({f"seg{i}.{name}": a for name, a in seg.arrays().items()})
+        meta = {
+            "k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+            "num_docs": self.num_docs,
+            "total_len": self.total_len,
+            "next_doc_id": self.next_doc_id,
+            "average_idf": self._average(),
+            "segments": [seg.doc_lo for seg in self.segments],
+            "vocab": list(itertools.islice(self.vocab, n_terms)),
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict) -> "InvertedIndex":
+        """Inverse of `to_state`. Arrays are used as is (e.g. memory-mapped)."""
+        index = cls(meta["k1"], meta["b"], meta["epsilon"])
+        index.vocab = {term: i for i, term in enumerate(meta["vocab"])}
+        index.doc_freqs = arrays["doc_freqs"]
+        index.segments = [
+            IndexSegment.from_arrays(doc_lo, {name: arrays[f"seg{i}.{name}"] for name in IndexSegment.ARRAYS})
+            for i, doc_lo in enumerate(meta["segments"])
+        ]
+        index.num_docs = meta["num_docs"]
+        index.total_len = meta["total_len"]
+        index.next_doc_id = meta["next_doc_id"]
+        index._average_idf = meta["average_idf"]
+        return index
+
+    def live_doc_ids(self) -> np.ndarray:
+        """Ids of all live documents, sorted."""
+        parts = [np.flatnonzero(seg.live) + seg.doc_lo for seg in self.segments]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def is_live(self, doc_ids: np.ndarray) -> np.ndarray:
+        """Whether each of `doc_ids` is a live document (bool, same order)."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        out = np.zeros(len(doc_ids), dtype=bool)
+        if not self.segments:
+            return out
+        owner = np.searchsorted([s.doc_lo for s in self.segments], doc_ids, side="right") - 1
+        for i in np.unique(owner[owner >= 0]).tolist():
+            seg = self.segments[i]
+            sel = np.flatnonzero((owner == i) & (doc_ids < seg.doc_lo + seg.num_docs))
+            out[sel] = seg.live[doc_ids[sel] - seg.doc_lo]
+        return out
+
+    def _copy(self) -> "InvertedIndex":
+        index = copy.copy(self)
+        index._average_idf = None
+        return index
+
+    def with_docs(self, corpus: List[List[str]]) -> "InvertedIndex":
+        """
+        Returns a copy with `corpus` indexed as a new segment. Its documents
+        get consecutive doc ids starting at this index's `next_doc_id`.
+        """
+        index = self._copy()
+        index._add(corpus)
+        return index
+
+    def _add(self, corpus: List[List[str]]):
+        if not corpus:
+            return
+        vocab = self.vocab
+        doc_len = np.fromiter((len(doc) for doc in corpus), dtype=np.int32, count=len(corpus))
+        # Term ids are assigned in order of first occurrence, which is the
+        # order rank_bm25 accumulates its average idf in.
+        term_ids = np.fromiter(
+            (vocab.setdefault(t, len(vocab)) for doc in corpus for t in doc),
+            dtype=np.int64,
+            count=int(doc_len.sum()),
+        )
+        segment = IndexSegment.build(self.next_doc_id, doc_len, term_ids)
+
+        # Fresh array: the previous one may be in use by readers.
+        doc_freqs = np.zeros(len(vocab), dtype=np.int64)
+        doc_freqs[:len(self.doc_freqs)] = self.doc_freqs
+        doc_freqs[segment.terms] += np.diff(segment.indptr)
+
+        self.doc_freqs = doc_freqs
+        self.segments = self.segments + [segment]
+        self.num_docs += len(corpus)
+        self.total_len += int(doc_len.sum())
+        self.next_doc_id += len(corpus)
+
+    def with_deletes(self, doc_ids: List[int]) -> "InvertedIndex":
+        """Returns a copy with the given documents tombstoned."""
+        doc_ids = np.unique(np.asarray(doc_ids, dtype=np.int64))
+        if not len(doc_ids) or not self.segments:
+            return self
+        index = self._copy()
+        segments = list(self.segments)
+        doc_freqs = self.doc_freqs.copy()
+        owner = np.searchsorted([s.doc_lo for s in segments], doc_ids, side="right") - 1
+        for i in np.unique(owner):
+            seg = segments[i]
+            docs = doc_ids[owner == i]
+            docs = docs[(docs >= seg.doc_lo) & (docs < seg.doc_lo + seg.num_docs)]
+            segments[i], removed = seg.with_deletes(docs)
+            np.subtract.at(doc_freqs, seg.forward_terms(removed), 1)
+            index.total_len -= int(seg.doc_len[removed - seg.doc_lo].sum())
+            index.num_docs -= len(removed)
+        index.segments = segments
+        index.doc_freqs = doc_freqs
+        return index
+
+    def plan_merge(self) -> Optional[List[IndexSegment]]:
+        """
+        Picks adjacent segments to merge, or None if the index is in shape:
+        the smallest MERGE_FACTOR-wide window once there are too many
+        segments, otherwise a single segment with too many deletes.
+        """
+        segments = self.segments
+        if len(segments) > MAX_SEGMENTS:
+            sizes = np.cumsum([0] + [s.num_docs for s in segments])
+            windows = sizes[MERGE_FACTOR:] - sizes[:-MERGE_FACTOR]
+            start = int(np.argmin(windows))
+            return segments[start:start + MERGE_FACTOR]
+        for seg in segments:
+            if seg.num_docs and seg.num_dead > MAX_DELETED_RATIO * seg.num_docs:
+                return [seg]
+        return None
+
+    def with_merge(self, sources: List[IndexSegment], merged: IndexSegment) -> Optional["InvertedIndex"]:
+        """
+        Returns a copy with `sources` swapped for `merged`, or None if any
+        source was replaced in the meantime (e.g. by a delete), since
+        `merged` would miss it.
+        """
+        segments = self.segments
+        starts = [i for i, seg in enumerate(segments) if seg is sources[0]]
+        if not starts:
+            return None
+        start = starts[0]
+        current = segments[start:start + len(sources)]
+        if len(current) != len(sources) or any(a is not b for a, b in zip(current, sources)):
+            return None
+        index = self._copy()
+        index.segments = segments[:start] + [merged] + segments[start + len(sources):]
+        return index
+
+    def _idf(self, t: int) -> float:
+        idf = raw_idf(self.num_docs, int(self.doc_freqs[t]))
+        if idf < 0:
+            idf = self.epsilon * self._average()
+        return idf
+
+    def _average(self) -> float:
+        # Average raw idf over live terms, summed in term id order like
+        # BM25Okapi._calc_idf. Only needed for very common terms, so it is
+        # computed lazily.
+        if self._average_idf is None:
+            idf_sum = 0.0
+            n_terms = 0
+            for freq in self.doc_freqs.tolist():
+                if freq:
+                    idf_sum += raw_idf(self.num_docs, freq)
+                    n_terms += 1
+            self._average_idf = idf_sum / n_terms if n_terms else 0.0
+        return self._average_idf
+
+    def _query(self, terms: List[str], weights: Optional[List[float]] = None) -> Query:
+        """
+        Known query terms as (term id, idf), times `weights` if given.
+        Repeats count once per occurrence, as in BM25Okapi.
+        """
+        # Terms added to the shared vocabulary after this index was built
+        # are past the end of doc_freqs.
+        n_terms = len(self.doc_freqs)
+        term_ids = [self.vocab.get(t, n_terms) for t in terms]
+        weights = weights if weights is not None else [1.0] * len(terms)
+        return [(t, self._idf(t) * w) for t, w in zip(term_ids, weights) if t < n_terms and self.doc_freqs[t] > 0]
+
+    def _weighted_query(self, terms: List[str], weighted: Optional[List[Tuple[str, float]]] = None) -> Query:
+        query = self._query(terms)
+        if weighted:
+            query += self._query([term for term, _ in weighted], [weight for _, weight in weighted])
+        return query
+
+    def match_docs(self, terms: List[str], weighted: Optional[List[Tuple[str, float]]] = None) -> Iterator[np.ndarray]:
+        """
+        Live doc ids containing a query term, one array per posting list
+        (a doc appears once per matching term); reads every posting.
+        """
+        query = self._weighted_query(terms, weighted)
+        for seg in self.segments:
+            if not seg.num_live:
+                continue
+            for i, _ in seg._local(query):
+                docs = seg.doc_ids[seg.indptr[i]:seg.indptr[i + 1]]
+                yield docs[seg.live[docs - seg.doc_lo]]
+
+    def has_term(self, term: str) -> bool:
+        """Whether any live document contains `term`."""
+        t = self.vocab.get(term)
+        return t is not None and t < len(self.doc_freqs) and bool(self.doc_freqs[t] > 0)
+
+    def terms_from(self, first: int) -> List[str]:
+        """Vocabulary terms with ids from `first` up to this index's last one."""
+        return list(itertools.islice(self.vocab, first, len(self.doc_freqs)))
+
+    def _bm25(self, idf: float, tf: np.ndarray, dl: np.ndarray, avgdl: Optional[float] = None) -> np.ndarray:
+        avgdl = self.avgdl if avgdl is None else avgdl
+        return idf * (tf * (self.k1 + 1) /
+                      (tf + self.k1 * (1 - self.b + self.b * dl / avgdl)))
+
+    def doc_freq(self, term: str) -> int:
+        """Live documents containing `term`."""
+        t = self.vocab.get(term)
+        return int(self.doc_freqs[t]) if t is not None and t < len(self.doc_freqs) else 0
+
+    def matching_terms(self, terms: List[str], doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Number of distinct query terms each document contains, read from
+        the segments' forward indexes (pre-tokenized term ids).
+        """
+        return self.matching_terms_batch([terms], np.zeros(len(doc_ids), dtype=np.int64), doc_ids)
+
+    def matching_terms_batch(self, queries: List[List[str]], query_of_row: np.ndarray,
+                             doc_ids: np.ndarray) -> np.ndarray:
+        """
+        `matching_terms` for many (query, document) pairs at once: row i
+        counts the distinct terms of queries[query_of_row[i]] in
+        doc_ids[i]. Pairs are matched as query * n_terms + term keys.
+        """
+        n_terms = len(self.doc_freqs)
+        keys = np.unique(np.array([q * n_terms + t for q, terms in enumerate(queries)
+                                   for t in (self.vocab.get(term, n_terms) for term in terms) if t < n_terms],
+                                  dtype=np.int64))
+        counts = np.zeros(len(doc_ids), dtype=np.int64)
+        if not len(keys) or not len(doc_ids):
+            return counts
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        query_of_row = np.asarray(query_of_row, dtype=np.int64)
+        owner = np.searchsorted([s.doc_lo for s in self.segments], doc_ids, side="right") - 1
+        for i in np.unique(owner):
+            sel = np.flatnonzero(owner == i)
+            seg = self.segments[i]
+            local = doc_ids[sel] - seg.doc_lo
+            starts, ends = seg.fwd_indptr[local], seg.fwd_indptr[local + 1]
+            rows = np.repeat(np.arange(len(sel)), ends - starts)
+            pairs = query_of_row[sel][rows] * n_terms + seg.fwd_terms[_ranges(starts, ends)]
+            counts[sel] = np.bincount(rows, weights=np.isin(pairs, keys), minlength=len(sel))
+        return counts
+
+    def score(self, terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (doc_ids, scores) for every live document containing at
+        least one query term, sorted by doc id.
+        """
+        query = self._query(terms)
+        if not query:
+            return _empty()
+        parts = [seg.score(query, self._bm25) for seg in self.segments if seg.num_live]
+        if not parts:
+            return _empty()
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def top_k(self, terms: List[str], k: int, stats: Optional[Dict[str, int]] = None,
+              weighted: Optional[List[Tuple[str, float]]] = None, allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the `k` best (doc_ids, scores) with a positive score, ordered
+        by score descending and doc id ascending on ties. Each segment
+        returns its own top-k and the union is cut again. If given, `stats`
+        ("postings", "candidates") accumulates the work done. `weighted`
+        adds (term, weight) query terms whose idf is scaled by the weight
+        (e.g. fuzzy expansions). With `allowed` (a filters.DocSet), other
+        documents are dropped from the postings before scoring.
+        """
+        return self._top_k(self._weighted_query(terms, weighted), k, self._bm25, stats, allowed)
+
+    def top_k_global(self, term_idfs: List[Tuple[str, float]], k: int, avgdl: float,
+                     stats: Optional[Dict[str, int]] = None, allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `top_k` with (term, idf) and the average document length given
+        by the caller instead of computed here, for an index that holds
+        one shard of a larger corpus (see sharding.GlobalStats).
+        """
+        n_terms = len(self.doc_freqs)
+        query = [(t, idf) for t, idf in ((self.vocab.get(term, n_terms), idf) for term, idf in term_idfs)
+                 if t < n_terms and self.doc_freqs[t] > 0]
+        return self._top_k(query, k, lambda idf, tf, dl: self._bm25(idf, tf, dl, avgdl), stats, allowed)
+
+    def top_k_batch(self, queries: List[List[str]], k: int,
+                    weighted: Optional[List[List[Tuple[str, float]]]] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        `top_k` of many tokenized queries (with their `weighted` terms, if
+        given) at once: per segment, a sparse query-by-term matrix of idfs
+        times the term-by-document matrix of the terms the batch uses.
+        Scores are exhaustive (no pruning), so results are the same up to
+        float summation order.
+        """
+        parsed = [self._weighted_query(terms, weighted[i] if weighted else None) for i, terms in enumerate(queries)]
+        results = [_empty() for _ in parsed]
+        if k <= 0:
+            return results
+        group, postings = [], 0
+        for i, query in enumerate(parsed):
+            if not query:
+                continue
+            group.append(i)
+            postings += sum(int(self.doc_freqs[t]) for t, _ in query)
+            if postings >= BATCH_MAX_POSTINGS:
+                self._top_k_group(parsed, group, k, results)
+                group, postings = [], 0
+        if group:
+            self._top_k_group(parsed, group, k, results)
+        return results
+
+    def _top_k_group(self, parsed: List[Query], group: List[int], k: int,
+                     results: List[Tuple[np.ndarray, np.ndarray]]):
+        """Fills results[i] for each query index i of `group` (see top_k_batch)."""
+        term_ids, columns = np.unique(np.array([t for i in group for t, _ in parsed[i]], dtype=np.int64),
+                                      return_inverse=True)
+        rows = np.repeat(np.arange(len(group)), [len(parsed[i]) for i in group])
+        idfs = np.array([idf for i in group for _, idf in parsed[i]], dtype=np.float64)
+        # Repeated terms are summed, counting once per occurrence as in _query
+        Q = sparse.csr_matrix((idfs, (rows, columns)), shape=(len(group), len(term_ids)))
+        parts: List[List[Tuple[np.ndarray, np.ndarray]]] = [[] for _ in group]
+        for seg in self.segments:
+            if not seg.num_live:
+                continue
+            S = (Q @ seg.term_matrix(term_ids, self._bm25)).tocsr()
+            S.sort_indices()
+            for r in range(len(group)):
+                lo, hi = S.indptr[r], S.indptr[r + 1]
+                if hi > lo:
+                    parts[r].append(_select(S.indices[lo:hi].astype(np.int64) + seg.doc_lo, S.data[lo:hi], k))
+        for r, i in enumerate(group):
+            if parts[r]:
+                docs, scores = _select(np.concatenate([p[0] for p in parts[r]]),
+                                       np.concatenate([p[1] for p in parts[r]]), k)
+                order = np.lexsort((docs, -scores))
+                results[i] = docs[order], scores[order]
+
+    def _top_k(self, query: Query, k: int, bm25: Scorer, stats: Optional[Dict[str, int]] = None,
+               allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        if not query or k <= 0:
+            return _empty()
+        parts = [seg.top_k(query, k, bm25, stats, allowed) for seg in self.segments if seg.num_live]
+        if not parts:
+            return _empty()
+        # Segments are in doc order, so the concatenation is sorted.
+        docs, scores = _select(np.concatenate([p[0] for p in parts]),
+                               np.concatenate([p[1] for p in parts]), k)
+        order = np.lexsort((docs, -scores))
+        return docs[order], scores[order]
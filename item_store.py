@@ -0,0 +1,329 @@
+import copy
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+ITEM_KEYS = ("id", "title", "category", "brand", "price", "description", "features")
+FEATURE_KEYS = ("popularity", "quality_score")
+# Item-static ranker features, in Ranker.feature_cols order
+STATIC_FEATURES = ("price", "popularity", "quality")
+
+
+class _Buffer:
+    """
+    Append-only NumPy buffer with spare capacity, shared by successive
+    store versions. `used` is the high-water mark across all versions: a
+    version may only append in place if nobody appended past its end.
+    """
+
+    def __init__(self, dtype, capacity: int = 0, width: Optional[int] = None):
+        shape = (capacity,) if width is None else (capacity, width)
+        self.data = np.zeros(shape, dtype=dtype)
+        self.used = 0
+
+    @classmethod
+    def wrap(cls, data: np.ndarray) -> "_Buffer":
+        """A full buffer around existing (possibly read-only, mapped) data."""
+        buf = cls.__new__(cls)
+        buf.data = data
+        buf.used = len(data)
+        return buf
+
+    @staticmethod
+    def extend(buf: "_Buffer", n: int, values: np.ndarray) -> "_Buffer":
+        """Returns a buffer holding buf.data[:n] followed by `values`."""
+        end = n + len(values)
+        if buf.used != n or end > len(buf.data) or not buf.data.flags.writeable:
+            width = buf.data.shape[1] if buf.data.ndim == 2 else None
+            grown = _Buffer(buf.data.dtype, max(2 * end, 1024), width)
+            grown.data[:n] = buf.data[:n]
+            buf = grown
+        buf.data[n:end] = values
+        buf.used = end
+        return buf
+
+
+class _Strings:
+    """String table: UTF-8 bytes of all rows plus row offsets."""
+
+    def __init__(self):
+        self.blob = _Buffer(np.uint8)
+        self.offsets = _Buffer(np.int64, 1)
+        self.offsets.used = 1
+
+    def extended(self, n: int, values: List[str]) -> "_Strings":
+        encoded = [v.encode("utf-8") for v in values]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        size = int(self.offsets.data[n])
+        strings = copy.copy(self)
+        strings.blob = _Buffer.extend(self.blob, size, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        strings.offsets = _Buffer.extend(self.offsets, n + 1, size + np.cumsum(lengths))
+        return strings
+
+    @classmethod
+    def wrap(cls, blob: np.ndarray, offsets: np.ndarray) -> "_Strings":
+        strings = cls.__new__(cls)
+        strings.blob = _Buffer.wrap(blob)
+        strings.offsets = _Buffer.wrap(offsets)
+        return strings
+
+    def arrays(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(blob, offsets) of the first n rows."""
+        return self.blob.data[:int(self.offsets.data[n])], self.offsets.data[:n + 1]
+
+    def get(self, row: int) -> str:
+        start, end = self.offsets.data[row], self.offsets.data[row + 1]
+        return self.blob.data[start:end].tobytes().decode("utf-8")
+
+    def get_many(self, rows: np.ndarray) -> List[str]:
+        """`get` for many rows, without per-row NumPy indexing."""
+        blob = memoryview(self.blob.data)
+        starts = self.offsets.data[rows].tolist()
+        ends = self.offsets.data[rows + 1].tolist()
+        return [str(blob[start:end], "utf-8") for start, end in zip(starts, ends)]
+
+    def nbytes(self, n: int) -> int:
+        return int(self.offsets.data[n]) + 8 * (n + 1)
+
+
+class _Categories:
+    """Interned values of a categorical column; append-only and shared."""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = list(values or [])
+        self.codes: Dict[str, int] = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ItemStore:
+    """
+    Columnar, append-only item storage. Rows are doc ids.
+
+    Numeric fields live in float64 arrays, brand and category as int32
+    codes into interned value tables, and ids, titles and descriptions in
+    UTF-8 string tables. Item dicts are only rebuilt (`item`, `hydrate`)
+    for the rows that are returned to clients. The item-static ranker
+    features are also precomputed into a float32 matrix at insert time.
+
+    Items that do not fit the data_gen schema are still stored in the
+    columns the ranker needs, with the original dict kept aside so they
+    hydrate unchanged. Extra keys on schema items are kept the same way.
+
+    Like the index, the store is copy-on-write: `with_items` returns a new
+    version and never changes a row visible to an older one.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self._ids = _Strings()
+        self._titles = _Strings()
+        self._descriptions = _Strings()
+        self._price = _Buffer(np.float64)
+        self._popularity = _Buffer(np.float64)
+        self._quality = _Buffer(np.float64)
+        self._category = _Buffer(np.int32)
+        self._brand = _Buffer(np.int32)
+        self._features = _Buffer(np.float32, 0, len(STATIC_FEATURES))
+        self.categories = _Categories()
+        self.brands = _Categories()
+        # row -> (extra item keys, extra feature keys), shared
+        self._extras: Dict[int, Tuple[Dict, Dict]] = {}
+        # row -> original dict for items outside the schema, shared
+        self._raw: Dict[int, Dict] = {}
+
+    def __len__(self):
+        return self.n
+
+    @classmethod
+    def from_items(cls, items: List[Dict[str, Any]]) -> "ItemStore":
+        return cls().with_items(items)
+
+    def with_items(self, items: List[Dict[str, Any]]) -> "ItemStore":
+        """Returns a store with `items` appended as rows len(self)..."""
+        n = self.n
+        features = [item.get("features") or {} for item in items]
+        store = copy.copy(self)
+        store._ids = self._ids.extended(n, [item["id"] for item in items])
+        store._titles = self._titles.extended(n, [item["title"] for item in items])
+        store._descriptions = self._descriptions.extended(
+            n, [item.get("description") if isinstance(item.get("description"), str) else "" for item in items])
+        # Same defaults as the ranker's features always had
+        store._price = _Buffer.extend(self._price, n, np.array([_number(item.get("price", 0.0)) for item in items]))
+        store._popularity = _Buffer.extend(self._popularity, n, np.array([_number(f.get("popularity", 0.0)) for f in features]))
+        store._quality = _Buffer.extend(self._quality, n, np.array([_number(f.get("quality_score", 0.0)) for f in features]))
+        store._features = _Buffer.extend(self._features, n, np.column_stack([
+            store._price.data[n:n + len(items)],
+            store._popularity.data[n:n + len(items)],
+            store._quality.data[n:n + len(items)],
+        ]).astype(np.float32))
+        store._category = _Buffer.extend(self._category, n, np.array(
+            [self.categories.encode(item["category"]) if isinstance(item.get("category"), str) else -1 for item in items]))
+        store._brand = _Buffer.extend(self._brand, n, np.array(
+            [self.brands.encode(item["brand"]) if isinstance(item.get("brand"), str) else -1 for item in items]))
+
+        for row, (item, feats) in enumerate(zip(items, features), start=n):
+            if not self._fits_schema(item):
+                self._raw[row] = copy.deepcopy(item)
+                continue
+            extra = {key: value for key, value in item.items() if key not in ITEM_KEYS}
+            extra_features = {key: value for key, value in feats.items() if key not in FEATURE_KEYS}
+            if extra or extra_features:
+                self._extras[row] = (copy.deepcopy(extra), copy.deepcopy(extra_features))
+        store.n = n + len(items)
+        return store
+
+    # Column names of `to_state`, mapped to their buffers
+    _COLUMNS = {"price": "_price", "popularity": "_popularity", "quality": "_quality",
+                "category": "_category", "brand": "_brand", "features": "_features"}
+    _STRINGS = {"ids": "_ids", "titles": "_titles", "descriptions": "_descriptions"}
+
+    def to_state(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """(arrays, JSON metadata) describing this version, for persistence."""
+        n = self.n
+        arrays = {name: getattr(self, attr).data[:n] for name, attr in self._COLUMNS.items()}
+        for name, attr in self._STRINGS.items():
+            arrays[f"{name}.blob"], arrays[f"{name}.offsets"] = getattr(self, attr).arrays(n)
+        meta = {
+            "n": n,
+            "categories": self.categories.values[:],
+            "brands": self.brands.values[:],
+            "extras": {str(row): list(extra) for row, extra in self._extras.items() if row < n},
+            "raw": {str(row): item for row, item in self._raw.items() if row < n},
+        }
+        return arrays, meta
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> "ItemStore":
+        """Inverse of `to_state`. Arrays are used as is (e.g. memory-mapped)."""
+        store = cls()
+        store.n = meta["n"]
+        for name, attr in cls._COLUMNS.items():
+            setattr(store, attr, _Buffer.wrap(arrays[name]))
+        for name, attr in cls._STRINGS.items():
+            setattr(store, attr, _Strings.wrap(arrays[f"{name}.blob"], arrays[f"{name}.offsets"]))
+        store.categories = _Categories(meta["categories"])
+        store.brands = _Categories(meta["brands"])
+        store._extras = {int(row): tuple(extra) for row, extra in meta["extras"].items()}
+        store._raw = {int(row): item for row, item in meta["raw"].items()}
+        return store
+
+    @staticmethod
+    def _fits_schema(item: Dict[str, Any]) -> bool:
+        features = item.get("features")
+        return (all(isinstance(item.get(key), str) for key in ("id", "title", "category", "brand", "description"))
+                and type(item.get("price")) is float
+                and isinstance(features, dict)
+                and all(type(features.get(key)) is float for key in FEATURE_KEYS))
+
+    # Columns, one entry per row
+    @property
+    def price(self) -> np.ndarray:
+        return self._price.data[:self.n]
+
+    @property
+    def popularity(self) -> np.ndarray:
+        return self._popularity.data[:self.n]
+
+    @property
+    def quality_score(self) -> np.ndarray:
+        return self._quality.data[:self.n]
+
+    @property
+    def static_features(self) -> np.ndarray:
+        """float32 matrix of STATIC_FEATURES, one row per item."""
+        return self._features.data[:self.n]
+
+    @property
+    def category_codes(self) -> np.ndarray:
+        return self._category.data[:self.n]
+
+    @property
+    def brand_codes(self) -> np.ndarray:
+        return self._brand.data[:self.n]
+
+    def item_id(self, row: int) -> str:
+        return self._ids.get(row)
+
+    def title(self, row: int) -> str:
+        return self._titles.get(row)
+
+    def item(self, row: int) -> Dict[str, Any]:
+        """Rebuilds the item dict of a row (a fresh copy)."""
+        raw = self._raw.get(row)
+        if raw is not None:
+            return copy.deepcopy(raw)
+        item = {
+            "id": self._ids.get(row),
+            "title": self._titles.get(row),
+            "category": self.categories.values[self._category.data[row]],
+            "brand": self.brands.values[self._brand.data[row]],
+            "price": float(self._price.data[row]),
+            "description": self._descriptions.get(row),
+            "features": {
+                "popularity": float(self._popularity.data[row]),
+                "quality_score": float(self._quality.data[row]),
+            },
+        }
+        extras = self._extras.get(row)
+        if extras is not None:
+            item.update(copy.deepcopy(extras[0]))
+            item["features"].update(copy.deepcopy(extras[1]))
+        return item
+
+    def hydrate(self, rows: np.ndarray) -> List[Dict[str, Any]]:
+        return self.project(rows)
+
+    def _column(self, field: str, rows: np.ndarray) -> List[Any]:
+        """Values of item key `field` for schema rows, read column-wise."""
+        if field in ("id", "title", "description"):
+            return {"id": self._ids, "title": self._titles, "description": self._descriptions}[field].get_many(rows)
+        if field == "price":
+            return self._price.data[rows].tolist()
+        if field in ("category", "brand"):
+            table, codes = (self.categories, self._category) if field == "category" else (self.brands, self._brand)
+            values = table.values
+            return [values[code] for code in codes.data[rows].tolist()]
+        if field == "features":
+            return [{"popularity": p, "quality_score": q}
+                    for p, q in zip(self._popularity.data[rows].tolist(), self._quality.data[rows].tolist())]
+        return [None] * len(rows)
+
+    def project(self, rows: np.ndarray, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Item dicts of `rows` (fresh copies) restricted to the keys in
+        `fields`, in that order; every key if None (same dicts as `item`).
+        Schema rows are read a column at a time, so only the requested
+        columns are touched. Keys an item does not have are left out.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        keys = list(ITEM_KEYS) if fields is None else list(dict.fromkeys(fields))
+        columns = [self._column(key, rows) if key in ITEM_KEYS else None for key in keys]
+        present = [(key, column) for key, column in zip(keys, columns) if column is not None]
+        names = [key for key, _ in present]
+        items = [dict(zip(names, values)) for values in zip(*[column for _, column in present])] \
+            if present else [{} for _ in range(len(rows))]
+        if self._raw or self._extras:
+            for i, row in enumerate(rows.tolist()):
+                if row in self._raw or row in self._extras:
+                    item = self.item(row)
+                    items[i] = item if fields is None else {key: item[key] for key in keys if key in item}
+        return items
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size of the columns (excluding spare capacity)."""
+        n = self.n
+        return (self._ids.nbytes(n) + self._titles.nbytes(n) + self._descriptions.nbytes(n)
+                + 8 * 3 * n + 4 * 2 * n + 4 * len(STATIC_FEATURES) * n)
@@ -0,0 +1,367 @@
+"""
+Open-loop HTTP load generator for the search API.
+
+Requests are scheduled at fixed-rate or Poisson arrival times, decided up
+front and independent of how fast the server answers, and sent over a
+pool of keep-alive connections (plain asyncio streams, HTTP/1.1). The
+workload mixes searches, click feedback and bulk ingest.
+
+Latency is measured from each request's *intended* send time, so time
+spent waiting for a free connection or behind a slow response counts
+against the server. This is the coordinated-omission correction: a
+closed-loop client (like benchmark.py) stops sending while the server
+stalls, so exactly the slow periods go unrecorded. The uncorrected
+service time (from the actual send) is reported next to it. A request
+with no complete response within the client timeout is abandoned (its
+connection closed) and counted as an error, and as a timeout.
+
+    python loadgen.py --rate 200 --duration 30
+    python loadgen.py --find-max --slo-p99-ms 100 --mix search=1
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import data_gen
+
+DEFAULT_MIX = {"search": 0.9, "click": 0.08, "bulk": 0.02}
+BULK_SIZE = 10
+CONNECTIONS = 64
+# Requests still waiting for a connection beyond this are counted as
+# dropped instead of queueing without bound in the generator
+MAX_BACKLOG = 10_000
+# Seconds from the actual send to a complete response before a request is
+# abandoned; without it a stalled server would hold connections forever
+REQUEST_TIMEOUT = 10.0
+# find-max: a rate passes if at most this share of requests fails
+MAX_ERROR_RATE = 0.01
+
+
+class Histogram:
+    """
+    HDR-style latency histogram over integer microseconds: exact below
+    2 * SUB_BUCKETS, then SUB_BUCKETS linear sub-buckets per power of two
+    (relative error below 1 / SUB_BUCKETS). Fixed memory, O(1) record.
+    """
+
+    SUB_BUCKETS = 64
+    MAX_EXPONENT = 32  # ~70 minutes
+
+    def __init__(self):
+        self.counts = [0] * (2 * self.SUB_BUCKETS + self.MAX_EXPONENT * self.SUB_BUCKETS)
+        self.total = 0
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, value: int) -> int:
+        if value < 2 * self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.SUB_BUCKETS.bit_length()
+        return min(shift * self.SUB_BUCKETS + (value >> shift), len(self.counts) - 1)
+
+    def _value(self, index: int) -> int:
+        """Highest value that maps to bucket `index`."""
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return (((index - shift * self.SUB_BUCKETS) + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value = max(0, int(seconds * 1_000_000))
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> float:
+        """Value (ms) at percentile `p` (0-100), within the bucket precision."""
+        if not self.total:
+            return 0.0
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self._value(i), self.max) / 1000
+        return self.max / 1000
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.total,
+            "mean": round(self.sum / self.total / 1000, 3) if self.total else 0.0,
+            **{f"p{p:g}": round(self.percentile(p), 3) for p in (50, 90, 99, 99.9)},
+            "max": round(self.max / 1000, 3),
+        }
+
+
+class _Connection:
+    """One keep-alive HTTP/1.1 connection; reconnects after errors."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + (body or b""))
+        await self.writer.drain()
+
+        header = await self.reader.readuntil(b"\r\n\r\n")
+        lines = header.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                data += chunk[:-2]
+        else:
+            data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Workload:
+    """Builds the requests of the mix from data_gen's synthetic queries and items."""
+
+    def __init__(self, mix: Dict[str, float], n_items: int, seed: int = 42):
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.n_items = n_items
+        self.rng = random.Random(seed)
+        random.seed(seed)
+        self.queries = data_gen.generate_queries(10_000)
+        self.bulk_seq = 0
+
+    def next(self) -> Tuple[str, str, str, Optional[bytes]]:
+        """(op, method, path, body) of the next request."""
+        op = self.rng.choices(self.ops, self.weights)[0]
+        if op == "search":
+            query = self.rng.choice(self.queries)
+            return op, "GET", "/search?" + urlencode({"q": query, "k": 20}), None
+        if op == "click":
+            click = {
+                "user_id": f"user_{self.rng.randint(1, 1000)}",
+                "query": self.rng.choice(self.queries),
+                "item_id": f"item_{self.rng.randrange(self.n_items)}",
+                "position": self.rng.randint(0, 9),
+            }
+            return op, "POST", "/feedback/click", json.dumps(click).encode()
+        if op == "bulk":
+            items = data_gen.generate_items(BULK_SIZE)
+            for item in items:
+                item["id"] = f"loadgen_{self.bulk_seq}"
+                self.bulk_seq += 1
+            return op, "POST", "/items/bulk", json.dumps(items).encode()
+        raise ValueError(f"Unknown operation: {op}")
+
+
+async def run(url: str, rate: float, duration: float, mix: Dict[str, float], arrival: str = "poisson",
+              connections: int = CONNECTIONS, n_items: int = data_gen.NUM_ITEMS, seed: int = 42,
+              timeout: float = REQUEST_TIMEOUT) -> Dict:
+    """
+    Offers `rate` requests/s for `duration` seconds; returns per-operation
+    latency summaries. Requests taking over `timeout` seconds are errors.
+    """
+    parts = urlsplit(url)
+    pool: "asyncio.Queue[_Connection]" = asyncio.Queue()
+    for _ in range(connections):
+        pool.put_nowait(_Connection(parts.hostname, parts.port or 80))
+    workload = Workload(mix, n_items, seed)
+    rng = random.Random(seed + 1)
+
+    corrected = {op: Histogram() for op in mix}
+    service = {op: Histogram() for op in mix}
+    errors = {op: 0 for op in mix}
+    timeouts = {op: 0 for op in mix}
+    dropped = 0
+    backlog = 0
+    max_send_lag = 0.0
+
+    async def send(op: str, method: str, path: str, body: Optional[bytes], intended: float):
+        nonlocal backlog, max_send_lag
+        conn = await pool.get()
+        backlog -= 1
+        sent = time.perf_counter()
+        max_send_lag = max(max_send_lag, sent - intended)
+        try:
+            status, _ = await asyncio.wait_for(conn.request(method, path, body), timeout)
+            ok = status < 400
+        except asyncio.TimeoutError:
+            # The response may still arrive: the connection cannot be reused
+            conn.close()
+            timeouts[op] += 1
+            ok = False
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            conn.close()
+            ok = False
+        finally:
+            pool.put_nowait(conn)
+        done = time.perf_counter()
+        if ok:
+            corrected[op].record(done - intended)
+            service[op].record(done - sent)
+        else:
+            errors[op] += 1
+
+    tasks = set()
+    start = time.perf_counter()
+    intended = start
+    while True:
+        intended += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+        if intended - start >= duration:
+            break
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if backlog >= MAX_BACKLOG:
+            dropped += 1
+            continue
+        backlog += 1
+        task = asyncio.ensure_future(send(*workload.next(), intended))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    while not pool.empty():
+        pool.get_nowait().close()
+
+    completed = sum(h.total for h in corrected.values())
+    return {
+        "offered_rate": rate,
+        "achieved_rate": round(completed / elapsed, 1),
+        "arrival": arrival,
+        "duration": round(elapsed, 2),
+        "connections": connections,
+        "timeout_s": timeout,
+        "errors": errors,
+        "timeouts": timeouts,
+        "dropped": dropped,
+        "max_send_lag_ms": round(max_send_lag * 1000, 3),
+        "latency_ms": {op: corrected[op].summary() for op in mix},
+        "service_time_ms": {op: service[op].summary() for op in mix},
+    }
+
+
+def passes(result: Dict, slo_p99_ms: float, op: str = "search") -> bool:
+    sent = result["latency_ms"][op]["count"] + result["errors"][op]
+    failed = result["errors"][op] + result["dropped"]
+    return (result["latency_ms"][op]["p99"] <= slo_p99_ms
+            and failed <= MAX_ERROR_RATE * max(sent, 1))
+
+
+async def find_max_rate(url: str, slo_p99_ms: float, duration: float, mix: Dict[str, float],
+                        start_rate: float = 50, max_rate: float = 20_000, steps: int = 5, **kwargs) -> Dict:
+    """
+    Highest offered rate whose search p99 (corrected) meets the SLO with
+    under MAX_ERROR_RATE failures: doubles the rate until it fails, then
+    bisects `steps` times between the last pass and the first failure.
+    """
+    runs = []
+
+    async def attempt(rate: float) -> bool:
+        result = await run(url, rate, duration, mix, **kwargs)
+        ok = passes(result, slo_p99_ms)
+        runs.append(dict(result, passed=ok))
+        print(f"{rate:>9.1f}/s  p99 {result['latency_ms']['search']['p99']:>9.2f} ms  "
+              f"errors {sum(result['errors'].values())}  "
+              f"timeouts {sum(result['timeouts'].values())}  dropped {result['dropped']}  {'ok' if ok else 'FAIL'}")
+        return ok
+
+    good, bad = 0.0, None
+    rate = start_rate
+    while rate <= max_rate:
+        if not await attempt(rate):
+            bad = rate
+            break
+        good, rate = rate, rate * 2
+    if bad is not None:
+        for _ in range(steps):
+            rate = (good + bad) / 2
+            if await attempt(rate):
+                good = rate
+            else:
+                bad = rate
+    return {"slo_p99_ms": slo_p99_ms, "max_rate": good, "runs": runs}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        op, weight = part.split("=")
+        mix[op.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the search API.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--rate", type=float, default=100, help="offered requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per run")
+    parser.add_argument("--arrival", choices=["poisson", "fixed"], default="poisson")
+    parser.add_argument("--connections", type=int, default=CONNECTIONS)
+    parser.add_argument("--mix", default=",".join(f"{op}={w}" for op, w in DEFAULT_MIX.items()),
+                        help="operation weights, e.g. search=0.9,click=0.08,bulk=0.02")
+    parser.add_argument("--items", type=int, default=data_gen.NUM_ITEMS, help="item ids clicks refer to")
+    parser.add_argument("--find-max", action="store_true", help="search for the max rate meeting --slo-p99-ms")
+    parser.add_argument("--slo-p99-ms", type=float, default=100)
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT,
+                        help="seconds before a request is abandoned and counted as an error")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="loadgen_results.json")
+    args = parser.parse_args()
+
+    options = dict(arrival=args.arrival, connections=args.connections, n_items=args.items, seed=args.seed,
+                   timeout=args.timeout)
+    mix = parse_mix(args.mix)
+    if args.find_max:
+        result = asyncio.run(find_max_rate(args.url, args.slo_p99_ms, args.duration, mix,
+                                           start_rate=args.rate, **options))
+        print(f"\nMax rate with search p99 <= {args.slo_p99_ms} ms: {result['max_rate']:.1f}/s")
+    else:
+        result = asyncio.run(run(args.url, args.rate, args.duration, mix, **options))
+        print(f"Offered {result['offered_rate']}/s, achieved {result['achieved_rate']}/s, "
+              f"dropped {result['dropped']}, max send lag {result['max_send_lag_ms']} ms")
+        for op in mix:
+            lat, svc = result["latency_ms"][op], result["service_time_ms"][op]
+            print(f"  {op:<7} n={lat['count']:<7} p50 {lat['p50']:.2f}  p99 {lat['p99']:.2f}  "
+                  f"max {lat['max']:.2f} ms  (service p99 {svc['p99']:.2f} ms)  errors {result['errors'][op]} "
+                  f"(timeouts {result['timeouts'][op]})")
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,38 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Query, Response
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+import os
 import time
 from engine import SearchEngine
+from serialize import dumps
+from suggest import MAX_SUGGESTIONS
 
 app = FastAPI(title="Mini Search System")
-engine = SearchEngine()
+# Set BATCH_WINDOW_MS (e.g. 1-2) to micro-batch ranker inference, and
+# DENSE_RETRIEVAL=1 to add embedding (ANN) candidates to BM25's;
+# SEARCH_SHARDS=N serves searches from N shard processes (not with dense)
+engine = SearchEngine(
+    batch_window_ms=float(os.environ["BATCH_WINDOW_MS"]) if os.environ.get("BATCH_WINDOW_MS") else None,
+    dense=os.environ.get("DENSE_RETRIEVAL", "") not in ("", "0"),
+    shards=int(os.environ.get("SEARCH_SHARDS") or 0)
+)
 
 class SearchRequest(BaseModel):
     q: str
     k: int = 20
     user_id: Optional[str] = None
 
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = 20
+    user_id: Optional[str] = None
+    fields: Optional[List[str]] = None
+    fuzzy: bool = True
+    hybrid: bool = True
+
+# Largest accepted /search/batch request
+MAX_BATCH_QUERIES = 1000
+
 class ClickFeedback(BaseModel):
     user_id: str
     query: str
@@ -23,28 +44,75 @@ class ClickFeedback(BaseModel):
 def startup_event():
     engine.load()
 
+@app.on_event("shutdown")
+def shutdown_event():
+    engine.close()
+
 @app.get("/")
 def read_root():
     return {"status": "ok", "stats": engine.get_stats()}
 
+def _split(values: Optional[str]) -> Optional[List[str]]:
+    """Comma-separated query parameter as a list (None if absent)."""
+    return [v.strip() for v in values.split(",") if v.strip()] if values else None
+
 @app.get("/search")
-def search(q: str, k: int = 20, user_id: Optional[str] = None):
-    results = engine.search(q, k, user_id)
-    return results
+def search(q: str, k: int = 20, user_id: Optional[str] = None, timings: bool = False,
+           fields: Optional[str] = None, fuzzy: bool = True, category: Optional[str] = None,
+           brand: Optional[str] = None, min_price: Optional[float] = None, max_price: Optional[float] = None,
+           facets: Optional[str] = None, hybrid: bool = True):
+    # fields: comma-separated item keys and/or score, ranker_score (e.g. "id,score")
+    # category, brand: comma-separated accepted values; facets: e.g. "category,brand"
+    filters = {"category": _split(category), "brand": _split(brand)}
+    if min_price is not None or max_price is not None:
+        filters["price"] = (min_price, max_price)
+    results = engine.search(q, k, user_id, timings=timings, fields=_split(fields), fuzzy=fuzzy,
+                            filters=filters, facets=_split(facets), hybrid=hybrid)
+    # Serialized here (results are plain JSON types) so it can be timed
+    start = time.perf_counter()
+    body = dumps(results)
+    engine.stage_seconds["serialize"].observe(time.perf_counter() - start)
+    return Response(content=body, media_type="application/json")
+
+@app.post("/search/batch")
+def search_batch(request: BatchSearchRequest):
+    # Several searches in one call (e.g. every widget of a page), scored together
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    results = engine.search_batch(request.queries, request.k, request.user_id, fields=request.fields,
+                                  fuzzy=request.fuzzy, hybrid=request.hybrid)
+    start = time.perf_counter()
+    body = dumps(results)
+    engine.stage_seconds["serialize"].observe(time.perf_counter() - start)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/suggest")
+def suggest(q: str, n: int = Query(10, ge=1, le=MAX_SUGGESTIONS)):
+    return engine.suggest(q, n)
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=engine.metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/feedback/click")
 def report_click(feedback: ClickFeedback):
     if feedback.ts is None:
         feedback.ts = int(time.time())
     
-    engine.log_click(feedback.dict())
-    return {"status": "accepted"}
+    # Never blocks: dropped only if the click log writer is saturated
+    accepted = engine.log_click(feedback.dict())
+    return {"status": "accepted" if accepted else "dropped"}
 
 @app.post("/items/bulk")
 def add_items(items: List[Dict[str, Any]]):
     engine.add_items(items)
     return {"status": "indexed", "count": len(items)}
 
+@app.post("/items/delete")
+def delete_items(item_ids: List[str]):
+    deleted = engine.delete_items(item_ids)
+    return {"status": "deleted", "count": deleted}
+
 @app.get("/top_queries")
 def get_top_queries(window: str = "5m"):
     # Parse window like '5m', '10s', '1h'
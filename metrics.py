@@ -0,0 +1,152 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds (seconds) of latency buckets: powers of two from ~1 us to
+# 16 s, then +Inf
+LATENCY_BUCKETS = [2.0 ** e for e in range(-20, 5)]
+
+
+class _Sharded:
+    """
+    Cells written by one thread each and summed on read, so hot-path
+    updates never take a lock and never lose an increment (a shared
+    `x += 1` can, when the interpreter switches threads mid-update). The
+    lock is only taken when a thread writes for the first time and when
+    reading.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._shards: List[list] = []
+        self._lock = threading.Lock()
+
+    def _cells(self) -> list:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = [0] * self._size
+            with self._lock:
+                self._shards.append(cells)
+            self._local.cells = cells
+            return cells
+
+    def _totals(self) -> list:
+        with self._lock:
+            shards = list(self._shards)
+        return [sum(cells) for cells in zip(*shards)] if shards else [0] * self._size
+
+
+class Counter(_Sharded):
+    """Monotonic count; `fn` reads the value from elsewhere instead."""
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        super().__init__(1)
+        self._fn = fn
+
+    def inc(self, n: float = 1):
+        self._cells()[0] += n
+
+    def value(self) -> float:
+        return self._fn() if self._fn is not None else self._totals()[0]
+
+
+class Gauge:
+    """Current value: read from `fn` at scrape time, or set with inc/dec (not for hot paths)."""
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        self._fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1):
+        with self._lock:
+            self._value += n
+
+    def dec(self, n: float = 1):
+        self.inc(-n)
+
+    def value(self) -> float:
+        return self._fn() if self._fn is not None else self._value
+
+
+class Histogram(_Sharded):
+    """Bucketed observations (bucket upper bounds `bounds`, plus +Inf) with their sum."""
+
+    def __init__(self, bounds: List[float] = LATENCY_BUCKETS):
+        super().__init__(len(bounds) + 2)  # buckets, +Inf, sum
+        self.bounds = bounds
+
+    def observe(self, value: float):
+        cells = self._cells()
+        cells[bisect.bisect_left(self.bounds, value)] += 1
+        cells[-1] += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """(per-bucket counts, sum)."""
+        totals = self._totals()
+        return totals[:-1], totals[-1]
+
+
+def _labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels.items()) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Metrics of one engine, rendered in the Prometheus text format. A
+    metric name may be registered several times with different labels
+    (e.g. one histogram per search stage).
+    """
+
+    def __init__(self):
+        # name -> (type, help, [(labels, metric)]), in registration order
+        self._families: Dict[str, Tuple[str, str, list]] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, kind: str, name: str, help: str, labels: Dict[str, str], metric):
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help, []))
+            if family[0] != kind:
+                raise ValueError(f"Metric {name} already registered as a {family[0]}")
+            family[2].append((labels, metric))
+        return metric
+
+    def counter(self, name: str, help: str, fn: Optional[Callable[[], float]] = None, **labels) -> Counter:
+        return self._add("counter", name, help, labels, Counter(fn))
+
+    def gauge(self, name: str, help: str, fn: Optional[Callable[[], float]] = None, **labels) -> Gauge:
+        return self._add("gauge", name, help, labels, Gauge(fn))
+
+    def histogram(self, name: str, help: str, bounds: List[float] = LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._add("histogram", name, help, labels, Histogram(bounds))
+
+    def render(self) -> str:
+        with self._lock:
+            families = [(name, kind, help, list(metrics)) for name, (kind, help, metrics) in self._families.items()]
+        lines = []
+        for name, kind, help, metrics in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(metric.value())}")
+                    continue
+                counts, total = metric.snapshot()
+                cumulative = 0
+                for bound, c in zip(metric.bounds + [float("inf")], counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{_labels(labels, ('le', _number(bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(float(total))}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,238 @@
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+import zlib
+import numpy as np
+import lightgbm as lgb
+from typing import Any, Dict, List, Optional, Tuple
+
+from ranker import Ranker
+
+# Bump when the saved files or their meaning change
+MODEL_FORMAT = 1
+CURRENT = "current"
+# Share of users whose clicks are held out for the validation gate
+VALIDATION_SHARE = 0.2
+MAX_VALIDATION_QUERIES = 1000
+# A candidate may not score more than this below the served model...
+MAX_NDCG_DROP = 0.005
+# ...or more than this below plain BM25 order (catches broken models; the
+# ranker also weighs popularity and quality, which clicks alone may not
+# reward)
+MAX_BASELINE_DROP = 0.05
+
+
+class ModelRegistry:
+    """
+    Trained ranker models on disk, one directory per version:
+
+        models/v0003/model.txt    LightGBM booster (text format)
+        models/v0003/sample.npy   training rows the compiled predictor is checked on
+        models/v0003/meta.json    feature schema, training window, click count,
+                                  validation NDCG, promotion time
+        models/current            name of the served version
+
+    Versions are written to a temporary directory and renamed into place,
+    and `current` is replaced atomically, so a crash never leaves a
+    half-written model behind it. Several server processes may share a
+    registry: they train, save and promote while holding `exclusive`.
+    """
+
+    def __init__(self, root: str = "models"):
+        self.root = root
+
+    def versions(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if name.startswith("v") and os.path.exists(os.path.join(self.root, name, "meta.json")))
+
+    def meta(self, version: str) -> Dict[str, Any]:
+        with open(os.path.join(self.root, version, "meta.json")) as f:
+            return json.load(f)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Holds an advisory lock on the registry across processes (a
+        `.lock` file beside it), for training, saving and promoting.
+        """
+        with open(f"{self.root}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_meta(self, version: str, meta: Dict[str, Any]):
+        path = os.path.join(self.root, version, "meta.json")
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, path)
+
+    def save(self, ranker: Ranker, meta: Dict[str, Any]) -> str:
+        """
+        Stores a trained ranker as a new (not yet served) version. Call
+        with `exclusive` held (by this or the calling process), so that
+        version numbers are unique.
+        """
+        versions = self.versions()
+        version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+        tmp = os.path.join(self.root, f".{version}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        ranker.booster.save_model(os.path.join(tmp, "model.txt"))
+        np.save(os.path.join(tmp, "sample.npy"), ranker.compile_sample)
+        meta = dict(meta, version=version, format=MODEL_FORMAT, feature_cols=ranker.feature_cols,
+                    created_at=time.time(), promoted_at=None)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+        os.rename(tmp, os.path.join(self.root, version))
+        ranker.version = version
+        return version
+
+    def load(self, version: str) -> Ranker:
+        path = os.path.join(self.root, version)
+        booster = lgb.Booster(model_file=os.path.join(path, "model.txt"))
+        ranker = Ranker.from_booster(booster, np.load(os.path.join(path, "sample.npy")))
+        ranker.version = version
+        return ranker
+
+    def compatible(self, meta: Dict[str, Any]) -> bool:
+        """Whether a model was saved in this format for the current features."""
+        return meta.get("format") == MODEL_FORMAT and meta.get("feature_cols") == Ranker().feature_cols
+
+    def current(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, CURRENT)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def promote(self, version: str):
+        """Makes `version` the served model. Call with `exclusive` held."""
+        meta = self.meta(version)
+        meta["promoted_at"] = time.time()
+        self._write_meta(version, meta)
+        path = os.path.join(self.root, CURRENT)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, path)
+
+    def load_latest(self) -> Optional[Tuple[Ranker, Dict[str, Any]]]:
+        """
+        The served model if it is compatible, else the newest compatible
+        model that was ever promoted; None if there is none.
+        """
+        current = self.current()
+        candidates = ([current] if current else []) + [
+            v for v in reversed(self.versions()) if v != current]
+        for version in candidates:
+            try:
+                meta = self.meta(version)
+                if not self.compatible(meta) or (version != current and not meta.get("promoted_at")):
+                    continue
+                return self.load(version), meta
+            except (OSError, ValueError, lgb.basic.LightGBMError) as e:
+                print(f"Skipping model {version}: {e}")
+        return None
+
+
+def passes_gate(meta: Dict[str, Any]) -> bool:
+    """
+    Validation gate for a candidate model, on held-out users: NDCG@10 at
+    most MAX_NDCG_DROP below the served model and MAX_BASELINE_DROP below
+    BM25 order. Without validation data only a first model is accepted.
+    """
+    if not meta["validation_queries"]:
+        return meta["served_ndcg"] is None
+    if meta["ndcg"] < meta["baseline_ndcg"] - MAX_BASELINE_DROP:
+        return False
+    return meta["served_ndcg"] is None or meta["ndcg"] >= meta["served_ndcg"] - MAX_NDCG_DROP
+
+
+def _held_out(click: Dict) -> bool:
+    user = str(click.get("user_id", ""))
+    return zlib.crc32(user.encode("utf-8")) % 100 < VALIDATION_SHARE * 100
+
+
+def _validation_ndcg(retriever, ranker: Optional[Ranker], clicked: Dict[str, set]) -> Tuple[float, int]:
+    """
+    Mean NDCG@10 (clicked = relevant) over held-out queries (query ->
+    clicked item ids), re-ranking the top 50 BM25 candidates with `ranker`
+    (BM25 order if None).
+    """
+    from evaluate import ndcg_at_k
+
+    scores = []
+    for query, item_ids in clicked.items():
+        doc_ids, _ = retriever.retrieve(query, k=50)
+        if ranker is not None and len(doc_ids):
+            doc_ids = doc_ids[np.argsort(-ranker.score(retriever, doc_ids, query), kind="stable")]
+        rel = [1 if retriever.store.item_id(doc) in item_ids else 0 for doc in doc_ids[:10].tolist()]
+        scores.append(ndcg_at_k(rel, 10))
+    return (float(np.mean(scores)) if scores else 0.0), len(scores)
+
+
+def train_candidate(items_path: str, clicks_path: str, snapshot_dir: str, registry_root: str) -> Optional[str]:
+    """
+    Trains a ranker on the click log and saves it as a candidate version
+    with its validation metrics; returns the version (None without
+    training data). Meant to run in a separate process: it only talks to
+    the engine through the files. The caller holds the registry's
+    `exclusive` lock. The click log is streamed; only the
+    held-out clicks of up to MAX_VALIDATION_QUERIES queries are kept.
+    """
+    import click_log
+    import index_snapshot
+    from engine import read_items
+    from retriever import Retriever
+
+    retriever = index_snapshot.load(snapshot_dir, items_path)
+    if retriever is None:
+        retriever = Retriever()
+        retriever.index(list(read_items(items_path).values()))
+
+    validation: Dict[str, set] = {}
+    window = [None, None]
+
+    def training_clicks():
+        for c in click_log.read_clicks(clicks_path):
+            if _held_out(c):
+                if c["query"] in validation or len(validation) < MAX_VALIDATION_QUERIES:
+                    validation.setdefault(c["query"], set()).add(c["item_id"])
+                continue
+            t = c.get("timestamp", c.get("ts"))
+            if isinstance(t, (int, float)):
+                window[0] = t if window[0] is None else min(window[0], t)
+                window[1] = t if window[1] is None else max(window[1], t)
+            yield c
+
+    ranker = Ranker()
+    ranker.fit(training_clicks(), retriever)
+    if ranker.model is None:
+        return None
+
+    registry = ModelRegistry(registry_root)
+    served = registry.load_latest()
+    ndcg, n_queries = _validation_ndcg(retriever, ranker, validation)
+    meta = {
+        "click_count": ranker.clicks_seen,
+        "click_log_bytes": sum(os.path.getsize(name) for name in click_log.files(clicks_path)),
+        "training_window": window if window[0] is not None else None,
+        "items": len(retriever.bm25) if retriever.bm25 else 0,
+        "validation_queries": n_queries,
+        "ndcg": ndcg,
+        "baseline_ndcg": _validation_ndcg(retriever, None, validation)[0],
+        "served_version": served[1]["version"] if served else None,
+        "served_ndcg": _validation_ndcg(retriever, served[0], validation)[0] if served else None,
+    }
+    version = registry.save(ranker, meta)
+    print(f"Trained ranker {version}: NDCG@10 {ndcg:.4f} (BM25 {meta['baseline_ndcg']:.4f}, "
+          f"served {meta['served_ndcg']}) on {n_queries} held-out queries.")
+    return version
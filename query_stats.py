@@ -0,0 +1,127 @@
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# (bucket width in seconds, number of buckets) per resolution, finest first
+RESOLUTIONS = [(1, 60), (60, 60), (3600, 24)]
+# Counters per Space-Saving summary
+CAPACITY = 200
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters summary (Metwally et al.) with at most
+    `capacity` counters and O(1) updates.
+
+    Counters are grouped by count value. An update moves the key from
+    group c to c + 1; a new key takes a free counter, or evicts a key of
+    the smallest count m and starts at m + 1. Since counts only grow by
+    one, the smallest count is tracked without any search.
+
+    For a stream of N items, every count overestimates the true frequency
+    by at most min count <= N / capacity, and every item with frequency
+    above N / capacity is in the summary.
+    """
+
+    def __init__(self, capacity: int = CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.groups: Dict[int, set] = {}  # count -> keys with that count
+        self.min_count = 0
+        self.total = 0
+
+    def add(self, key: str):
+        self.total += 1
+        count = self.counts.get(key)
+        if count is None:
+            if len(self.counts) < self.capacity:
+                count = 0
+                self.min_count = 0
+            else:
+                # Evict any key with the smallest count and inherit it
+                count = self.min_count
+                evicted = self.groups[count].pop()
+                del self.counts[evicted]
+                if not self.groups[count]:
+                    del self.groups[count]
+        else:
+            group = self.groups[count]
+            group.discard(key)
+            if not group:
+                del self.groups[count]
+        self.counts[key] = count + 1
+        self.groups.setdefault(count + 1, set()).add(key)
+        # The key left the last group of the smallest count (or was new)
+        if count == self.min_count and count not in self.groups:
+            self.min_count = count + 1
+
+    def clear(self):
+        self.counts.clear()
+        self.groups.clear()
+        self.min_count = 0
+        self.total = 0
+
+
+class QueryStats:
+    """
+    Fixed-memory query counts over sliding windows, for top queries.
+
+    Each resolution is a ring of time buckets (1 s x 60, 1 min x 60,
+    1 h x 24 by default); every bucket is a Space-Saving summary of the
+    queries seen in it, reset when its slot is reused. A search updates
+    the current bucket of each ring: O(1), under this object's own lock
+    only. Memory is bounded by (buckets x CAPACITY) keys whatever the
+    traffic.
+
+    `top(window)` merges the buckets of the finest ring that spans the
+    window. Error bounds, for N searches in the merged buckets and
+    capacity k: each reported count is off by at most N / k, and every
+    query seen more than N / k times in the window is reported (as long
+    as `n` is large enough). The window is rounded up to whole buckets of
+    the chosen ring, so it may include up to one bucket width of older
+    searches. Windows longer than the coarsest ring are capped to it.
+    """
+
+    def __init__(self, resolutions: List[Tuple[int, int]] = RESOLUTIONS, capacity: int = CAPACITY):
+        self.resolutions = resolutions
+        # Per ring: epoch (time // width) each slot holds, and its summary
+        self.epochs = [[-1] * n for _, n in resolutions]
+        self.buckets = [[SpaceSaving(capacity) for _ in range(n)] for _, n in resolutions]
+        self.lock = threading.Lock()
+
+    def record(self, query: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for ring, (width, n) in enumerate(self.resolutions):
+                epoch = int(now // width)
+                slot = epoch % n
+                bucket = self.buckets[ring][slot]
+                if self.epochs[ring][slot] != epoch:
+                    bucket.clear()
+                    self.epochs[ring][slot] = epoch
+                bucket.add(query)
+
+    def top(self, window_seconds: float, n: int = 10, now: Optional[float] = None) -> List[Dict]:
+        """The `n` most frequent queries of the last `window_seconds`, most frequent first."""
+        now = time.time() if now is None else now
+        ring = next((i for i, (width, size) in enumerate(self.resolutions) if width * size >= window_seconds),
+                    len(self.resolutions) - 1)
+        width, size = self.resolutions[ring]
+        epoch = int(now // width)
+        span = min(size, max(1, math.ceil(window_seconds / width)))
+        counts: Counter = Counter()
+        with self.lock:
+            for e in range(epoch - span + 1, epoch + 1):
+                slot = e % size
+                if self.epochs[ring][slot] == e:
+                    counts.update(self.buckets[ring][slot].counts)
+        return [{"query": q, "count": c} for q, c in counts.most_common(n)]
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                "keys": sum(len(b.counts) for ring in self.buckets for b in ring),
+                "capacity": sum(b.capacity for ring in self.buckets for b in ring),
+            }
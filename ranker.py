@@ -1,88 +1,232 @@
+import itertools
 import lightgbm as lgb
 import numpy as np
 import pandas as pd
-import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional
+
+from retriever import Retriever
+from tree_predictor import TreeEnsemble
+
+# Training data: negatives sampled per click, clicks parsed per chunk, and
+# the most training rows kept (the oldest groups are dropped beyond it)
+NEGATIVES_PER_CLICK = 5
+CHUNK_SIZE = 100_000
+MAX_TRAINING_ROWS = 10_000_000
+
+
+class _TrainingRows:
+    """
+    Preallocated X / y / weight / group-size buffers. They grow
+    geometrically up to `max_rows`; past that, the oldest groups are
+    dropped (at least a quarter of the window at a time, so shifting the
+    buffers stays amortized).
+    """
+
+    def __init__(self, n_features: int, max_rows: int, capacity: int):
+        capacity = min(capacity, max_rows)
+        self.max_rows = max_rows
+        self.X = np.empty((capacity, n_features), dtype=np.float32)
+        self.y = np.empty(capacity, dtype=np.int32)
+        self.weights = np.empty(capacity, dtype=np.float64)
+        self.groups = np.empty(capacity, dtype=np.int64)  # never more groups than rows
+        self.n = 0
+        self.n_groups = 0
+        self.dropped = 0
+
+    def append(self, X: np.ndarray, y: np.ndarray, weights: np.ndarray, groups: np.ndarray):
+        if self.n + len(X) > self.max_rows:
+            self._drop(self.n + len(X) - self.max_rows)
+        end = self.n + len(X)
+        if end > len(self.X):
+            self._grow(min(max(2 * len(self.X), end), self.max_rows))
+        self.X[self.n:end] = X
+        self.y[self.n:end] = y
+        self.weights[self.n:end] = weights
+        self.groups[self.n_groups:self.n_groups + len(groups)] = groups
+        self.n = end
+        self.n_groups += len(groups)
+
+    def _grow(self, capacity: int):
+        for name in ("X", "y", "weights", "groups"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _drop(self, rows: int):
+        sizes = np.cumsum(self.groups[:self.n_groups])
+        k = min(int(np.searchsorted(sizes, max(rows, self.max_rows // 4))) + 1, self.n_groups)
+        drop = int(sizes[k - 1]) if k else 0
+        for a in (self.X, self.y, self.weights):
+            a[:self.n - drop] = a[drop:self.n]
+        self.groups[:self.n_groups - k] = self.groups[k:self.n_groups]
+        self.n -= drop
+        self.n_groups -= k
+        self.dropped += drop
+
+    def arrays(self):
+        return self.X[:self.n], self.y[:self.n], self.groups[:self.n_groups], self.weights[:self.n]
+
 
 class Ranker:
     def __init__(self):
         self.model = None
+        self.predictor = None # Compiled TreeEnsemble of self.model, if it matches it
+        self.compile_sample = None # Rows the compiled predictor was checked on
+        self.version = None # Model registry version, once saved
+        self.clicks_seen = 0 # Clicks read by the last prepare_stream
         self.feature_cols = ["price", "popularity", "quality", "title_overlap"]
         
-    def _extract_features(self, item: Dict[str, Any], query: str) -> List[float]:
-        q_tokens = set(query.lower().split())
-        t_tokens = set(item["title"].lower().split())
-        overlap = len(q_tokens.intersection(t_tokens))
-        
-        return [
-            float(item.get("price", 0.0)),
-            float(item.get("features", {}).get("popularity", 0.0)),
-            float(item.get("features", {}).get("quality_score", 0.0)),
-            float(overlap)
-        ]
-
-    def prepare_data(self, clicks: List[Dict], items_map: Dict[str, Dict]):
+    def features(self, retriever, rows: np.ndarray, query: str) -> np.ndarray:
         """
-        Prepare X, y, group, and weights for LightGBM LambdaRank.
-        Includes propensity weighting for position bias.
+        float32 feature matrix for candidate doc ids: the item-static
+        columns precomputed in the store plus title overlap from the
+        index's pre-tokenized titles (price, popularity, quality score,
+        distinct query tokens in the title).
         """
-        X = []
-        y = []
-        groups = []
-        weights = []
-        
-        # Group clicks by query
-        query_groups = {}
-        for c in clicks:
-            q = c["query"]
-            if q not in query_groups:
-                query_groups[q] = []
-            query_groups[q].append(c)
-            
-        all_item_ids = list(items_map.keys())
-        
-        for q, query_clicks in query_groups.items():
-            current_group_size = 0
-            pos_item_ids = set([c["item_id"] for c in query_clicks])
-            
-            # Positives
-            for click in query_clicks:
-                pid = click["item_id"]
-                if pid not in items_map: continue
-                feat = self._extract_features(items_map[pid], q)
-                X.append(feat)
-                y.append(1)
-                
-                # Propensity Weighting: w = 1 / P(examine | position)
-                # Using simple 1 / log2(pos + 2) as inverse propensity
-                pos = click.get("position", 0)
-                propensity = 1.0 / np.log2(pos + 2)
-                weights.append(1.0 / propensity) # Inverse propensity weight
-                
-                current_group_size += 1
-                
-            # Negatives (Sample 5x query sessions)
-            num_neg = len(query_clicks) * 5
-            neg_ids = random.sample(all_item_ids, min(len(all_item_ids), num_neg))
-            
-            for nid in neg_ids:
-                if nid in pos_item_ids: continue
-                if nid not in items_map: continue
-                feat = self._extract_features(items_map[nid], q)
-                X.append(feat)
-                y.append(0)
-                weights.append(1.0) # Assume uniform propensity for negatives (or baseline)
-                current_group_size += 1
-                
-            groups.append(current_group_size)
-            
-        return np.array(X), np.array(y), np.array(groups), np.array(weights)
+        X = np.empty((len(rows), len(self.feature_cols)), dtype=np.float32)
+        X[:, :3] = retriever.store.static_features[rows]
+        X[:, 3] = retriever.title_overlap(query, rows)
+        return X
+
+    def features_batch(self, retriever, rows: np.ndarray, queries: List[str], query_of_row: np.ndarray) -> np.ndarray:
+        """`features` of rows[i] for queries[query_of_row[i]], for many queries' candidates at once."""
+        X = np.empty((len(rows), len(self.feature_cols)), dtype=np.float32)
+        X[:, :3] = retriever.store.static_features[rows]
+        X[:, 3] = retriever.title_overlap_batch(queries, query_of_row, rows)
+        return X
+
+    def score(self, retriever, rows: np.ndarray, query: str) -> Optional[np.ndarray]:
+        """Ranker scores for candidate doc ids, or None without a trained model."""
+        if not self.model or not len(rows):
+            return None
+        return self.predict_features(self.features(retriever, rows, query))
+
+    def score_batch(self, retriever, candidates: List[np.ndarray], queries: List[str]) -> Optional[List[np.ndarray]]:
+        """`score` of each query's candidate doc ids, with a single model call; None without a model."""
+        if not self.model:
+            return None
+        rows = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+        if not len(rows):
+            return [np.zeros(0, dtype=np.float64) for _ in candidates]
+        query_of_row = np.repeat(np.arange(len(candidates)), [len(c) for c in candidates])
+        scores = self.predict_features(self.features_batch(retriever, rows, queries, query_of_row))
+        return np.split(scores, np.cumsum([len(c) for c in candidates])[:-1])
+
+    def predict_features(self, X: np.ndarray) -> np.ndarray:
+        """Model scores for a feature matrix (compiled predictor when available)."""
+        if self.predictor is not None:
+            return self.predictor.predict(X)
+        return self.model.predict(X)
+
+    @property
+    def booster(self) -> lgb.Booster:
+        # Freshly trained models are LGBMRanker, loaded ones plain Boosters
+        return getattr(self.model, "booster_", self.model)
+
+    @classmethod
+    def from_booster(cls, booster: lgb.Booster, sample: np.ndarray) -> "Ranker":
+        """A ranker serving a saved booster; `sample` rows check the compiled predictor."""
+        ranker = cls()
+        ranker.model = booster
+        ranker._compile(sample)
+        return ranker
+
+    def _compile(self, X: np.ndarray):
+        """
+        Exports the trained booster to a TreeEnsemble, keeping it only if it
+        reproduces LightGBM's scores on (a sample of) the training rows.
+        """
+        self.predictor = None
+        self.compile_sample = X[:1000]
+        try:
+            predictor = TreeEnsemble.from_booster(self.booster)
+        except ValueError as e:
+            print(f"Ranker not compiled: {e}")
+            return
+        sample = self.compile_sample
+        if np.allclose(predictor.predict(sample), self.model.predict(sample), rtol=1e-6, atol=1e-9):
+            self.predictor = predictor
+        else:
+            print("Ranker not compiled: compiled scores differ from LightGBM.")
+
+    def prepare_stream(self, clicks: Iterable[Dict], retriever: Retriever, chunk_size: int = CHUNK_SIZE,
+                       max_rows: int = MAX_TRAINING_ROWS, seed: Optional[int] = None):
+        """
+        X, y, group sizes and weights for LightGBM LambdaRank over the live
+        items of `retriever`, built chunk by chunk from an iterator of
+        clicks (e.g. click_log.read_clicks) into preallocated buffers.
+        Clicks are positives weighted by inverse propensity for position
+        bias, 1 / (1 / log2(position + 2)); NEGATIVES_PER_CLICK random
+        live items per click are negatives of weight 1. Memory is bounded
+        by `max_rows` (the newest groups are kept) and `chunk_size`.
+
+        Each chunk groups its clicks by query (a frequent query gets a
+        group per chunk). Negatives are drawn with replacement from the
+        live doc ids with one randint call, and dropped if they are a
+        positive of their group. Title overlap for all rows of a chunk is
+        computed in one pass over the forward index.
+        """
+        rng = np.random.default_rng(seed)
+        live = retriever.bm25.live_doc_ids() if retriever.bm25 else np.zeros(0, dtype=np.int64)
+        doc_map = retriever.doc_map
+        chunk_size = max(1, min(chunk_size, max_rows // (1 + NEGATIVES_PER_CLICK)))
+        rows = _TrainingRows(len(self.feature_cols), max_rows, chunk_size * (1 + NEGATIVES_PER_CLICK))
+        self.clicks_seen = 0
+
+        clicks = iter(clicks)
+        while True:
+            chunk = list(itertools.islice(clicks, chunk_size))
+            if not chunk:
+                break
+            self.clicks_seen += len(chunk)
+            codes, queries = pd.factorize(pd.Series([c["query"] for c in chunk], dtype=object))
+            n_groups = len(queries)
+            # Item ids repeat a lot: look each one up once
+            item_codes, item_ids = pd.factorize(pd.Series([c["item_id"] for c in chunk], dtype=object))
+            docs = np.fromiter((doc_map.get(i, -1) for i in item_ids), dtype=np.int64, count=len(item_ids))[item_codes]
+            positions = np.array([c.get("position") or 0 for c in chunk], dtype=np.float64)
+
+            # Positives, weighted by inverse propensity 1 / (1 / log2(pos + 2))
+            found = docs >= 0
+            pos_group, pos_docs = codes[found], docs[found]
+            pos_weights = np.log2(positions[found] + 2)
+
+            # Negatives: NEGATIVES_PER_CLICK per click of the query
+            n_neg = np.minimum(np.bincount(codes, minlength=n_groups) * NEGATIVES_PER_CLICK, len(live))
+            neg_group = np.repeat(np.arange(n_groups), n_neg)
+            neg_docs = live[rng.integers(0, len(live), len(neg_group))] if len(live) else np.zeros(0, dtype=np.int64)
+            span = retriever.store.n + 1
+            keep = ~np.isin(neg_group * span + neg_docs, pos_group * span + pos_docs)
+            neg_group, neg_docs = neg_group[keep], neg_docs[keep]
+
+            # Positives then negatives within each group
+            group = np.concatenate([pos_group, neg_group])
+            order = np.argsort(group, kind="stable")
+            group = group[order]
+            docs = np.concatenate([pos_docs, neg_docs])[order]
+            X = np.empty((len(docs), len(self.feature_cols)), dtype=np.float32)
+            X[:, :3] = retriever.store.static_features[docs]
+            X[:, 3] = retriever.title_overlap_batch(list(queries), group, docs)
+            y = np.concatenate([np.ones(len(pos_docs), dtype=np.int32), np.zeros(len(neg_docs), dtype=np.int32)])[order]
+            weights = np.concatenate([pos_weights, np.ones(len(neg_docs))])[order]
+            sizes = np.bincount(group, minlength=n_groups)
+            rows.append(X, y, weights, sizes[sizes > 0])
+
+        if rows.dropped:
+            print(f"Training window full: dropped the oldest {rows.dropped} rows.")
+        return rows.arrays()
 
     def train(self, clicks: List[Dict], items: List[Dict]):
-        print(f"Training Ranker with {len(clicks)} clicks...")
-        items_map = {i["id"]: i for i in items}
-        
-        X, y, group, sample_weight = self.prepare_data(clicks, items_map)
+        """Trains on a list of clicks against `items` (indexed for the occasion)."""
+        retriever = Retriever()
+        retriever.index(items)
+        self.fit(clicks, retriever)
+
+    def fit(self, clicks: Iterable[Dict], retriever: Retriever, max_rows: int = MAX_TRAINING_ROWS):
+        """Trains on a stream of clicks against the live items of `retriever`."""
+        X, y, group, sample_weight = self.prepare_stream(clicks, retriever, max_rows=max_rows)
+        print(f"Training Ranker with {self.clicks_seen} clicks ({len(X)} rows)...")
         
         if len(X) == 0:
             print("No training data found.")
@@ -97,22 +241,18 @@ class Ranker:
         
         gbm.fit(X, y, group=group, sample_weight=sample_weight)
         self.model = gbm
+        self._compile(X)
         print("Ranker training complete.")
 
-    def predict(self, candidates: List[Dict], query: str) -> List[Dict]:
+    def predict(self, retriever, candidates: List[Dict], query: str) -> List[Dict]:
         """
-        Re-rank candidates.
+        Re-ranks candidate items (indexed in `retriever`) by ranker score,
+        which is attached to each as "ranker_score". Features are read from
+        the store's columns, as for `score`.
         """
         if not self.model or not candidates:
             return candidates
-            
-        X_pred = [self._extract_features(item, query) for item in candidates]
-        scores = self.model.predict(X_pred)
-        
-        # Attach scores and sort
-        for i, item in enumerate(candidates):
-            item["ranker_score"] = float(scores[i])
-            
-        # Sort by ranker_score descending
-        ranked = sorted(candidates, key=lambda x: x["ranker_score"], reverse=True)
-        return ranked
+        rows = np.fromiter((retriever.doc_map[item["id"]] for item in candidates), dtype=np.int64, count=len(candidates))
+        for item, score in zip(candidates, self.score(retriever, rows, query).tolist()):
+            item["ranker_score"] = score
+        return sorted(candidates, key=lambda x: x["ranker_score"], reverse=True)
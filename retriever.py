@@ -1,49 +1,261 @@
+import copy
 import numpy as np
-from rank_bm25 import BM25Okapi
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+from dense import DenseIndex
+from filters import DocSet, FilterIndex
+from fuzzy import FuzzyIndex
+from inverted_index import InvertedIndex, IndexSegment
+from item_store import ItemStore
 
 class Retriever:
     def __init__(self):
         self.bm25 = None
-        self.items = [] # Keep reference to items to map index back to ID
-        self.id_map = {} # index -> item_id
+        self.store = ItemStore() # doc id -> item row; replaced and deleted items stay as dead rows
+        self._doc_map = {} # see doc_map
+        self.fuzzy = None # Optional FuzzyIndex over the vocabulary, see with_fuzzy
+        self.filters = FilterIndex() # Over the store's rows
+        self.dense = None # Optional DenseIndex over the titles, see with_dense
+
+    @property
+    def doc_map(self) -> Dict[str, int]:
+        """
+        item_id -> doc id of its live version (writer side, shared by
+        copies). Built on first use for retrievers restored with
+        `from_state`, which only writers need.
+        """
+        if self._doc_map is None:
+            live = self.bm25.live_doc_ids() if self.bm25 else []
+            self._doc_map = {self.store.item_id(doc): doc for doc in np.asarray(live).tolist()}
+        return self._doc_map
+
+    def to_state(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """(arrays, JSON metadata) of the index, the store and its filters; hold off writers."""
+        arrays, meta = {}, {}
+        for name, part in (("index", self.bm25 or InvertedIndex()), ("store", self.store), ("filters", self.filters)):
+            part_arrays, meta[name] = part.to_state()
+            arrays.update({f"{name}.{key}": a for key, a in part_arrays.items()})
+        return arrays, meta
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> "Retriever":
+        """Inverse of `to_state`."""
+        def part(name: str) -> Dict[str, np.ndarray]:
+            prefix = name + "."
+            return {key[len(prefix):]: a for key, a in arrays.items() if key.startswith(prefix)}
+
+        retriever = cls()
+        retriever.bm25 = InvertedIndex.from_state(part("index"), meta["index"])
+        retriever.store = ItemStore.from_state(part("store"), meta["store"])
+        retriever.filters = FilterIndex.from_state(part("filters"), meta["filters"])
+        retriever._doc_map = None
+        return retriever
         
-    def _tokenize(self, text: str) -> List[str]:
+    def tokenize(self, text: str) -> List[str]:
         return text.lower().split()
 
     def index(self, items: List[Dict[str, Any]]):
         """
         Builds the BM25 index from valid items.
         """
-        self.items = items
-        self.id_map = {i: item["id"] for i, item in enumerate(items)}
+        self.store = ItemStore.from_items(items)
+        self.filters = FilterIndex().with_rows(self.store)
+        self._doc_map = {item["id"]: i for i, item in enumerate(items)}
         
-        corpus = [self._tokenize(item["title"]) for item in items]
-        self.bm25 = BM25Okapi(corpus)
+        corpus = [self.tokenize(item["title"]) for item in items]
+        self.bm25 = InvertedIndex()
+        self.bm25.build(corpus)
         print(f"Retriever indexed {len(items)} items.")
 
-    def search(self, query: str, k: int = 100) -> List[Dict[str, Any]]:
+    def with_items(self, items: List[Dict[str, Any]]) -> "Retriever":
         """
-        Returns top-K items matching the query.
+        Returns a retriever with items indexed as a new segment; cost
+        depends on the batch only. Items whose id is already indexed replace
+        the old version, which is tombstoned. This retriever keeps serving
+        its own view: index and store are copy-on-write.
+        """
+        # Last version wins within a batch too
+        items = list({item["id"]: item for item in items}.values())
+        retriever = self.without_items([item["id"] for item in items])
+        if retriever is self:
+            retriever = copy.copy(self)
+        
+        bm25 = retriever.bm25 or InvertedIndex()
+        first = bm25.next_doc_id
+        retriever.bm25 = bm25.with_docs([self.tokenize(item["title"]) for item in items])
+        if self.fuzzy is not None:
+            retriever.fuzzy = self.fuzzy.with_terms(retriever.bm25.terms_from(len(self.fuzzy)))
+        retriever.store = self.store.with_items(items)
+        retriever.filters = self.filters.with_rows(retriever.store)
+        if self.dense is not None:
+            retriever.dense = self.dense.with_docs([item["title"] for item in items],
+                                                   np.arange(first, first + len(items)))
+        for offset, item in enumerate(items):
+            self.doc_map[item["id"]] = first + offset
+        print(f"Retriever added {len(items)} items ({len(retriever.bm25.segments)} segments).")
+        return retriever
+
+    def without_items(self, item_ids: List[str]) -> "Retriever":
+        """Returns a retriever with the live version of each item id tombstoned."""
+        docs = [self.doc_map.pop(item_id) for item_id in item_ids if item_id in self.doc_map]
+        if not docs:
+            return self
+        retriever = copy.copy(self)
+        retriever.bm25 = self.bm25.with_deletes(docs)
+        return retriever
+
+    def with_merge(self, sources: List[IndexSegment], merged: IndexSegment) -> Optional["Retriever"]:
+        """
+        Returns a retriever whose index has `sources` replaced by `merged`
+        (built with `IndexSegment.merge`), or None if the merge is stale.
+        """
+        bm25 = self.bm25.with_merge(sources, merged) if self.bm25 else None
+        if bm25 is None:
+            return None
+        retriever = copy.copy(self)
+        retriever.bm25 = bm25
+        return retriever
+
+    def live_items(self) -> List[Dict[str, Any]]:
+        """Hydrates every live item, in doc id order."""
+        return self.store.hydrate(np.sort(np.fromiter(self.doc_map.values(), dtype=np.int64)))
+
+    def retrieve(self, query: str, k: int = 100) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (doc_ids, scores) of the top-K documents; doc ids are rows
+        of `self.store`.
+        """
+        return self.retrieve_terms(self.tokenize(query), k)
+
+    def retrieve_terms(self, terms: List[str], k: int = 100, stats: Optional[Dict[str, int]] = None,
+                       expansions: Optional[List[Tuple[str, str, float]]] = None,
+                       allowed: Optional[DocSet] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `retrieve` for an already tokenized query, plus the weighted terms
+        of `expansions` (from `expand`), restricted to `allowed` (from
+        `select`) if given; `stats` as in InvertedIndex.top_k.
+        """
+        if not self.bm25:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        # Only documents sharing a term with the query are scored
+        return self.bm25.top_k(terms, k, stats, [(term, weight) for _, term, weight in expansions or []], allowed)
+
+    def retrieve_batch(self, queries: List[List[str]], k: int = 100,
+                       expansions: Optional[List[List[Tuple[str, str, float]]]] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        `retrieve_terms` of many tokenized queries (with their fuzzy
+        `expansions`, if given), scored together (see InvertedIndex.top_k_batch).
+        """
+        if not self.bm25:
+            return [(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)) for _ in queries]
+        weighted = [[(term, weight) for _, term, weight in e] for e in expansions] if expansions else None
+        return self.bm25.top_k_batch(queries, k, weighted)
+
+    def select(self, filters: Optional[Dict]) -> Optional[DocSet]:
+        """Doc ids passing `filters` (see FilterIndex.select); None if there are none to apply."""
+        return self.filters.select(self.store, filters) if filters else None
+
+    def facets(self, terms: List[str], fields: List[str], allowed: Optional[DocSet] = None,
+               expansions: Optional[List[Tuple[str, str, float]]] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Value counts of each of `fields` over every live document matching
+        the query (as retrieve_terms would, before the top-k cut).
         """
         if not self.bm25:
+            return {field: {} for field in fields}
+        matches = self.bm25.match_docs(terms, [(term, weight) for _, term, weight in expansions or []])
+        docs = DocSet.from_docs(matches, self.bm25.next_doc_id)
+        return self.filters.facets(self.store, docs & allowed if allowed is not None else docs, fields)
+
+    def with_fuzzy(self, base: Optional["Retriever"] = None) -> "Retriever":
+        """
+        A retriever with a fuzzy index over its vocabulary (kept up to date
+        by with_items). With `base`, an earlier version of this retriever
+        that has one, only the terms added since are indexed.
+        """
+        retriever = copy.copy(self)
+        if base is not None and base.fuzzy is not None:
+            retriever.fuzzy = base.fuzzy.with_terms(self.bm25.terms_from(len(base.fuzzy)) if self.bm25 else [])
+            return retriever
+        retriever.fuzzy = FuzzyIndex(self.bm25.terms_from(0) if self.bm25 else [])
+        return retriever
+
+    def with_dense(self, base: Optional["Retriever"] = None) -> "Retriever":
+        """
+        A retriever with a dense index over its live titles (kept up to
+        date by with_items). With `base`, an earlier version of this
+        retriever that has one, only the rows appended since are embedded.
+        """
+        retriever = copy.copy(self)
+        if base is not None and base.dense is not None:
+            rows = np.arange(base.store.n, self.store.n)
+            titles = [item["title"] for item in self.store.project(rows, ["title"])]
+            retriever.dense = base.dense.with_docs(titles, rows)
+            return retriever
+        rows = self.bm25.live_doc_ids() if self.bm25 else np.zeros(0, dtype=np.int64)
+        titles = [item["title"] for item in self.store.project(rows, ["title"])]
+        retriever.dense = DenseIndex.build(titles, rows) if titles else None
+        return retriever
+
+    def retrieve_dense(self, query: str, k: int = 100, allowed: Optional[DocSet] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k (doc ids, cosine similarity) of live documents
+        by embedding, restricted to `allowed` if given; none without a
+        dense index.
+        """
+        if self.dense is None or not self.bm25:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        def keep(docs: np.ndarray) -> np.ndarray:
+            mask = self.bm25.is_live(docs)
+            if allowed is not None:
+                inside = docs < len(allowed.bits) * 8
+                mask &= inside
+                mask[inside] &= allowed.contains(docs[inside])
+            return mask
+
+        return self.dense.search(self.dense.embedder.embed([query])[0], k, keep=keep)
+
+    def expand(self, terms: List[str]) -> List[Tuple[str, str, float]]:
+        """
+        (query term, vocabulary term, weight) fuzzy matches of the query
+        terms no live document contains; none without a fuzzy index.
+        """
+        if self.fuzzy is None or not self.bm25:
             return []
-            
-        tokenized_query = self._tokenize(query)
-        # BM25Okapi get_top_n returns the documents (items)
-        # But we stored tokenized docs in BM25? No, BM25 stores stats.
-        # We need to get scores and sort manually to be efficient or use get_top_n
-        
-        scores = self.bm25.get_scores(tokenized_query)
-        # Get top K indices
-        top_n_indices = np.argsort(scores)[::-1][:k]
-        
+        return self.fuzzy.expand(terms, self.bm25.has_term, self.bm25.doc_freqs)
+
+    def title_overlap(self, query: str, doc_ids: np.ndarray) -> np.ndarray:
+        """Distinct query tokens found in each document's title."""
+        if not self.bm25:
+            return np.zeros(len(doc_ids), dtype=np.int64)
+        return self.bm25.matching_terms(self.tokenize(query), doc_ids)
+
+    def title_overlap_batch(self, queries: List[str], query_of_row: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+        """title_overlap of doc_ids[i] with queries[query_of_row[i]], for all rows at once."""
+        if not self.bm25:
+            return np.zeros(len(doc_ids), dtype=np.int64)
+        return self.bm25.matching_terms_batch([self.tokenize(q) for q in queries], query_of_row, doc_ids)
+
+    def search_batch(self, queries: List[str], k: int = 100) -> List[List[Dict[str, Any]]]:
+        """`search` of many queries at once."""
+        hits = self.retrieve_batch([self.tokenize(q) for q in queries], k)
         results = []
-        for idx in top_n_indices:
-            # Filter zero scores if wanted, but BM25 can be negative? No, usually positive.
-            if scores[idx] > 0:
-                item = self.items[idx].copy()
-                item["score"] = float(scores[idx]) # Add retrieval score
-                results.append(item)
+        for doc_ids, scores in hits:
+            items = self.store.hydrate(doc_ids)
+            for item, score in zip(items, scores.tolist()):
+                item["score"] = score
+            results.append(items)
+        return results
+
+    def search(self, query: str, k: int = 100) -> List[Dict[str, Any]]:
+        """
+        Returns top-K items matching the query.
+        """
+        top_n_indices, scores = self.retrieve(query, k)
+        
+        results = self.store.hydrate(top_n_indices)
+        for item, score in zip(results, scores.tolist()):
+            item["score"] = score # Add retrieval score
                 
         return results
@@ -0,0 +1,15 @@
+"""
+JSON encoding of API responses, shared by main.py and the benchmarks.
+Importing it has no side effects (unlike main, which starts an engine).
+"""
+import json
+from typing import Any
+
+# orjson is optional: a few times faster than the json module
+try:
+    import orjson
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+except ImportError:
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
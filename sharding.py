@@ -0,0 +1,395 @@
+"""
+Scatter-gather retrieval over catalog shards held by worker processes.
+
+Items are partitioned by a stable hash of their id into N shards, each
+with its own Retriever (index and item store) in a separate process, so
+BM25 scoring and feature extraction for one query run on N cores instead
+of sharing one interpreter lock.
+
+Scores are the same as a single index over the whole catalog: the
+coordinator keeps the global statistics (live documents, total length,
+document frequency of every term) and sends each shard the query's
+global idfs and average length. Writes only ship the change of those
+statistics over the terms of the batch, so ingest cost stays
+proportional to the batch, not to the vocabulary. Shards return their own top-k with the
+ranker features of those candidates; the coordinator merges the sorted
+lists with a heap, runs the ranker on the merged candidates, then fetches
+the final items from the shards that own them.
+
+Fuzzy expansion runs on the coordinator, over the global vocabulary;
+filters and facet counts run inside each shard (facet counts are then
+summed). SearchEngine(shards=N) serves its searches this way.
+"""
+import heapq
+import itertools
+import multiprocessing
+import threading
+import traceback
+import zlib
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from fuzzy import FuzzyIndex
+from inverted_index import IndexSegment, raw_idf
+
+# Candidates re-ranked per final result, as in SearchEngine.search
+CANDIDATES_PER_RESULT = 5
+
+# Change of a shard's statistics: (live documents, total length,
+# term -> document frequency), zero changes omitted
+StatsDelta = Tuple[int, int, Dict[str, int]]
+
+
+def shard_of(item_id: str, n_shards: int) -> int:
+    """Shard owning an item id; stable across processes and runs (unlike hash())."""
+    return zlib.crc32(item_id.encode("utf-8")) % n_shards
+
+
+def _merge_all(retriever):
+    """Compacts segments until the merge policy is satisfied (see SearchEngine._merge_segments)."""
+    while retriever.bm25 is not None:
+        sources = retriever.bm25.plan_merge()
+        if not sources:
+            return retriever
+        retriever = retriever.with_merge(sources, IndexSegment.merge(sources))
+    return retriever
+
+
+class _Shard:
+    """Worker-side state of one shard; each request is a method call."""
+
+    def __init__(self):
+        from ranker import Ranker
+        from retriever import Retriever
+
+        self.retriever = Retriever()
+        self.features = Ranker().features  # Uses no model, only the shard's columns
+
+    def _items(self, item_ids: Iterable[str]) -> List[Dict]:
+        """Live versions of those item ids that are indexed."""
+        doc_map = self.retriever.doc_map
+        return self.retriever.store.hydrate([doc_map[i] for i in item_ids if i in doc_map])
+
+    def _delta(self, before, titles: List[str]) -> StatsDelta:
+        """
+        Statistics of the current index minus those of `before`, over the
+        terms of `titles` (every title added or removed since).
+        """
+        after = self.retriever.bm25
+        terms = {term for title in titles for term in self.retriever.tokenize(title)}
+        freqs = {}
+        for term in terms:
+            change = after.doc_freq(term) - (before.doc_freq(term) if before else 0)
+            if change:
+                freqs[term] = change
+        return (after.num_docs - (before.num_docs if before else 0),
+                after.total_len - (before.total_len if before else 0), freqs)
+
+    def add(self, items: List[Dict]) -> Tuple[List[Dict], StatsDelta]:
+        """(replaced old versions, statistics change)."""
+        before = self.retriever.bm25
+        replaced = self._items(item["id"] for item in items)
+        self.retriever = _merge_all(self.retriever.with_items(items))
+        return replaced, self._delta(before, [item["title"] for item in replaced + items])
+
+    def delete(self, item_ids: List[str]) -> Tuple[List[Dict], StatsDelta]:
+        """(deleted items, statistics change)."""
+        before = self.retriever.bm25
+        removed = self._items(item_ids)
+        if not removed:
+            return [], (0, 0, {})
+        self.retriever = self.retriever.without_items([item["id"] for item in removed])
+        return removed, self._delta(before, [item["title"] for item in removed])
+
+    def search(self, query: str, term_idfs: List[Tuple[str, float]], k: int, avgdl: float, features: bool,
+               terms: List[str], expansions: List[Tuple[str, str, float]], filters: Optional[Dict],
+               facets: Optional[List[str]]) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], Optional[Dict]]:
+        """
+        Top-k (doc ids, scores) under the global statistics among the
+        items passing `filters`, their ranker features if asked, and the
+        shard's counts of `facets` if given (see Retriever.facets).
+        """
+        if self.retriever.bm25 is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64), None, {} if facets else None
+        allowed = self.retriever.select(filters)
+        doc_ids, scores = self.retriever.bm25.top_k_global(term_idfs, k, avgdl, allowed=allowed)
+        X = self.features(self.retriever, doc_ids, query) if features and len(doc_ids) else None
+        counts = self.retriever.facets(terms, facets, allowed, expansions) if facets else None
+        return doc_ids, scores, X, counts
+
+    def fetch(self, doc_ids: List[int], fields: Optional[List[str]]) -> List[Dict]:
+        return self.retriever.store.project(np.asarray(doc_ids, dtype=np.int64), fields)
+
+
+def _shard_main(conn):
+    """Worker process loop: (request id, method, args) in, (request id, ok, result or error) out."""
+    shard = _Shard()
+    while True:
+        try:
+            request_id, method, args = conn.recv()
+        except EOFError:
+            return
+        if method == "stop":
+            conn.send((request_id, True, None))
+            return
+        try:
+            conn.send((request_id, True, getattr(shard, method)(*args)))
+        except Exception:
+            conn.send((request_id, False, traceback.format_exc()))
+
+
+class _ShardClient:
+    """
+    Coordinator-side handle of one worker. Requests from any thread are
+    tagged and answered through futures, resolved by a reader thread, so
+    concurrent queries pipeline through the worker instead of taking
+    turns on the pipe.
+    """
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_shard_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Shard request failed:\n{result}"))
+        for future in list(self._pending.values()):
+            future.set_exception(RuntimeError("Shard process exited"))
+
+    def call(self, method: str, *args) -> Future:
+        future = Future()
+        with self._send_lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self.conn.send((request_id, method, args))
+        return future
+
+
+class GlobalStats:
+    """
+    Corpus-wide BM25 statistics kept up to date from the shards' deltas,
+    so that a shard scores exactly like one index over the whole catalog
+    would (same idf, idf floor and average length as InvertedIndex).
+    Like InvertedIndex, the average idf behind the floor is only computed
+    when a query needs it, once per version of the statistics.
+
+    Terms get ids in order of first occurrence, with their document
+    frequencies in a growable array, so the global vocabulary also backs
+    a fuzzy index (see FuzzyIndex) for query expansion.
+    """
+
+    def __init__(self, epsilon: float = 0.25):
+        self.num_docs = 0
+        self.total_len = 0
+        self.term_ids: Dict[str, int] = {}
+        self._freqs = np.zeros(1024, dtype=np.int64)  # By term id; capacity doubles
+        self.fuzzy = FuzzyIndex()
+        self.epsilon = epsilon
+        self._average_idf = None
+        self._lock = threading.Lock() # A query never sees half of a delta
+
+    @property
+    def doc_freqs(self) -> np.ndarray:
+        """Live documents containing each term, by term id."""
+        return self._freqs[:len(self.term_ids)]
+
+    def apply(self, delta: StatsDelta):
+        num_docs, total_len, freqs = delta
+        with self._lock:
+            self.num_docs += num_docs
+            self.total_len += total_len
+            new_terms = [term for term in freqs if term not in self.term_ids]
+            n_terms = len(self.term_ids) + len(new_terms)
+            if n_terms > len(self._freqs):
+                grown = np.zeros(2 * n_terms, dtype=np.int64)
+                grown[:len(self.term_ids)] = self.doc_freqs
+                self._freqs = grown
+            for term in new_terms:
+                self.term_ids[term] = len(self.term_ids)
+            for term, change in freqs.items():
+                self._freqs[self.term_ids[term]] += change
+            self.fuzzy = self.fuzzy.with_terms(new_terms)
+            self._average_idf = None
+
+    def _average(self) -> float:
+        if self._average_idf is None:
+            freqs = self.doc_freqs[self.doc_freqs > 0].tolist()
+            idfs = [raw_idf(self.num_docs, freq) for freq in freqs]
+            self._average_idf = sum(idfs) / len(idfs) if idfs else 0.0
+        return self._average_idf
+
+    def _freq(self, term: str) -> int:
+        t = self.term_ids.get(term)
+        return int(self._freqs[t]) if t is not None else 0
+
+    def query(self, terms: List[str], expansions: Optional[List[Tuple[str, str, float]]] = None
+              ) -> Tuple[List[Tuple[str, float]], float]:
+        """
+        (term, global idf) of the known query terms, repeats kept, then
+        of the `expansions` (from `expand`) with their idf scaled by the
+        weight, as InvertedIndex._weighted_query; and the average
+        document length.
+        """
+        weighted = [(term, 1.0) for term in terms] + [(match, weight) for _, match, weight in expansions or []]
+        out = []
+        with self._lock:
+            for term, weight in weighted:
+                freq = self._freq(term)
+                if freq:
+                    idf = raw_idf(self.num_docs, freq)
+                    out.append((term, (idf if idf >= 0 else self.epsilon * self._average()) * weight))
+            avgdl = self.total_len / self.num_docs if self.num_docs else 0.0
+        return out, avgdl
+
+    def expand(self, terms: List[str]) -> List[Tuple[str, str, float]]:
+        """Fuzzy matches of the query terms no live document contains (as Retriever.expand)."""
+        with self._lock:
+            return self.fuzzy.expand(terms, lambda term: self._freq(term) > 0, self.doc_freqs)
+
+
+class ShardedSearch:
+    """
+    Coordinator over `n_shards` worker processes. Writes (`add_items`,
+    `delete_items`) refresh the global statistics before returning;
+    `retrieve`, `fetch` and `search` may run from many threads at once.
+    """
+
+    def __init__(self, n_shards: int):
+        context = multiprocessing.get_context("spawn")
+        self.n_shards = n_shards
+        self.shards = [_ShardClient(context) for _ in range(n_shards)]
+        self.stats = GlobalStats()
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        return self.stats.num_docs
+
+    def _gather(self, futures: List[Future]) -> List[Any]:
+        return [future.result() for future in futures]
+
+    def _write(self, method: str, parts: List[List]) -> List[Dict]:
+        """Runs a write on every shard with a part; returns the old item versions they report."""
+        old = []
+        with self._write_lock:
+            for items, delta in self._gather([shard.call(method, part) for shard, part in zip(self.shards, parts) if part]):
+                old.extend(items)
+                self.stats.apply(delta)
+        return old
+
+    def add_items(self, items: List[Dict]) -> List[Dict]:
+        """
+        Indexes items on their shards; an id already indexed is replaced
+        (as Retriever.with_items). Returns the replaced old versions.
+        """
+        parts: List[List[Dict]] = [[] for _ in self.shards]
+        for item in items:
+            parts[shard_of(item["id"], self.n_shards)].append(item)
+        return self._write("add", parts)
+
+    def delete_items(self, item_ids: List[str]) -> List[Dict]:
+        """Deletes items by id; returns the deleted items."""
+        parts: List[List[str]] = [[] for _ in self.shards]
+        for item_id in dict.fromkeys(item_ids):
+            parts[shard_of(item_id, self.n_shards)].append(item_id)
+        return self._write("delete", parts)
+
+    def expand(self, terms: List[str]) -> List[Tuple[str, str, float]]:
+        return self.stats.expand(terms)
+
+    def retrieve(self, query: str, k: int = 100, features: bool = False,
+                 expansions: Optional[List[Tuple[str, str, float]]] = None, filters: Optional[Dict] = None,
+                 facets: Optional[List[str]] = None
+                 ) -> Tuple[List[Tuple[int, int, float]], Optional[np.ndarray], Optional[Dict[str, Dict[str, int]]]]:
+        """
+        Global top-k as (shard, doc id, score), by score descending, then
+        shard and doc id, among the items passing `filters` (see
+        FilterIndex.select), plus the weighted `expansions` (from
+        `expand`); with their ranker features (rows in the same order)
+        if `features`, and the value counts of `facets` over every
+        matching item (as Retriever.facets) if given.
+        """
+        terms = query.lower().split() # As Retriever.tokenize
+        term_idfs, avgdl = self.stats.query(terms, expansions)
+        if not term_idfs or k <= 0:
+            return [], None, {field: {} for field in facets} if facets else None
+        replies = self._gather([shard.call("search", query, term_idfs, k, avgdl, features, terms, expansions or [],
+                                           filters, facets) for shard in self.shards])
+        # Each shard's list is already sorted: a k-way heap merge
+        streams = [[(-score, shard, doc, i) for i, (doc, score) in enumerate(zip(docs.tolist(), scores.tolist()))]
+                   for shard, (docs, scores, _, _) in enumerate(replies)]
+        top = list(itertools.islice(heapq.merge(*streams), k))
+        hits = [(shard, doc, -neg_score) for neg_score, shard, doc, _ in top]
+        facet_counts = self._sum_facets(facets, [counts for _, _, _, counts in replies]) if facets else None
+        if not features or not top:
+            return hits, None, facet_counts
+        X = np.stack([replies[shard][2][i] for _, shard, _, i in top])
+        return hits, X, facet_counts
+
+    @staticmethod
+    def _sum_facets(fields: List[str], parts: List[Dict[str, Dict[str, int]]]) -> Dict[str, Dict[str, int]]:
+        """Per-shard facet counts added up, most first (as FilterIndex.facets)."""
+        out = {}
+        for field in fields:
+            if not any(field in part for part in parts):
+                continue
+            totals: Dict[str, int] = {}
+            for part in parts:
+                for value, count in part.get(field, {}).items():
+                    totals[value] = totals.get(value, 0) + count
+            out[field] = dict(sorted(totals.items(), key=lambda vc: (-vc[1], vc[0])))
+        return out
+
+    def fetch(self, hits: List[Tuple[int, int, float]], fields: Optional[List[str]] = None) -> List[Dict]:
+        """Items of `hits` (from `retrieve`), in order, projected to `fields` (see ItemStore.project)."""
+        by_shard: Dict[int, List[int]] = {}
+        for i, (shard, _, _) in enumerate(hits):
+            by_shard.setdefault(shard, []).append(i)
+        fetched = self._gather([self.shards[shard].call("fetch", [hits[i][1] for i in rows], fields)
+                                for shard, rows in by_shard.items()])
+        items: Dict[int, Dict] = {}
+        for rows, part in zip(by_shard.values(), fetched):
+            items.update(zip(rows, part))
+        return [items[i] for i in range(len(hits))]
+
+    def search(self, query: str, k: int = 20, ranker=None, fields: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Top-k items: k * CANDIDATES_PER_RESULT candidates retrieved across
+        the shards, re-ranked by `ranker` if it has a model, then fetched
+        (projected to `fields`, see ItemStore.project) from their shards.
+        """
+        rank = ranker is not None and ranker.model is not None
+        hits, X, _ = self.retrieve(query, k * CANDIDATES_PER_RESULT, features=rank)
+        ranker_scores = ranker.predict_features(X) if rank and hits else None
+        order = np.argsort(-ranker_scores, kind="stable")[:k] if ranker_scores is not None else np.arange(min(k, len(hits)))
+        results = self.fetch([hits[i] for i in order.tolist()], fields)
+        for item, i in zip(results, order.tolist()):
+            item["score"] = hits[i][2]
+            if ranker_scores is not None:
+                item["ranker_score"] = float(ranker_scores[i])
+        return results
+
+    def close(self):
+        for shard in self.shards:
+            try:
+                shard.call("stop").result(timeout=10)
+            except Exception:
+                pass
+            shard.process.join(timeout=10)
+            shard.conn.close()
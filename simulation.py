@@ -4,6 +4,7 @@ import random
 import time
 import numpy as np
 from data_gen import generate_queries, simulate_relevance, generate_items
+from engine import read_items
 
 API_URL = "http://localhost:8000"
 
@@ -12,9 +13,7 @@ def run_simulation(steps=1000):
     
     # We need ground truth items to simulate user relevance
     # Load items locally to know what the user "wants"
-    with open("items.jsonl", "r") as f:
-        items = [json.loads(line) for line in f]
-    items_map = {i["id"]: i for i in items}
+    items_map = read_items("items.jsonl")
     
     queries = generate_queries(n=100) # Small set of queries to repeat
     
@@ -0,0 +1,159 @@
+import bisect
+import copy
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Top suggestions are precomputed for every prefix up to this length
+# (short prefixes match most of the vocabulary)...
+PRECOMPUTED_PREFIX = 2
+# ...keeping this many per prefix (the most a lookup can return)
+MAX_SUGGESTIONS = 20
+# Pending changes kept beside the sorted arrays before they are rebuilt
+MAX_DELTA = 2000
+# Weight of one recent search of a query, against one item (1 + its
+# popularity) containing a term
+QUERY_WEIGHT = 1.0
+
+_END = "\U0010ffff"
+# Weights are sums of floats: a key whose items are all gone may be left
+# with rounding noise instead of 0
+_EPSILON = 1e-9
+
+
+def _terms(title: str, brand: Optional[str], category: Optional[str]) -> List[str]:
+    """Suggestion keys of an item: distinct title tokens (as the retriever tokenizes), brand, category."""
+    keys = title.lower().split()
+    keys += [value.lower() for value in (brand, category) if isinstance(value, str) and value]
+    return list(dict.fromkeys(keys))
+
+
+def _item_weights(items: Iterable[Dict], sign: float, weights: Dict[str, float]):
+    for item in items:
+        popularity = (item.get("features") or {}).get("popularity", 0.0)
+        weight = sign * (1.0 + (popularity if isinstance(popularity, (int, float)) else 0.0))
+        for key in _terms(str(item.get("title", "")), item.get("brand"), item.get("category")):
+            weights[key] = weights.get(key, 0.0) + weight
+
+
+class Suggester:
+    """
+    Prefix suggestions over title terms, brands and categories, weighted
+    by the items they occur in (each item counts 1 + its popularity).
+
+    Keys are kept in one sorted list with a parallel weight array, so the
+    keys starting with a prefix are the range found by two binary
+    searches. Top entries are precomputed for prefixes of up to
+    PRECOMPUTED_PREFIX characters; longer prefixes select from their
+    (short) range directly.
+
+    Like the index, a Suggester is never modified once built:
+    `with_items` returns a new one sharing the sorted arrays, with the
+    weight changes in a small sorted delta; beyond MAX_DELTA changed keys
+    everything is rebuilt. A lookup merges both, exactly.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        weights = {key: w for key, w in (weights or {}).items() if w > _EPSILON}
+        self.keys: List[str] = sorted(weights)
+        self.weights = np.array([weights[key] for key in self.keys], dtype=np.float64)
+        self.positions: Dict[str, int] = {key: i for i, key in enumerate(self.keys)}
+        self.top: Dict[str, np.ndarray] = {}
+        if len(self.keys):
+            order = np.argsort(-self.weights, kind="stable")
+            for i in order.tolist():
+                key = self.keys[i]
+                for length in range(1, min(PRECOMPUTED_PREFIX, len(key)) + 1):
+                    best = self.top.setdefault(key[:length], [])
+                    if len(best) < MAX_SUGGESTIONS:
+                        best.append(i)
+            self.top = {prefix: np.array(best, dtype=np.int64) for prefix, best in self.top.items()}
+        self.delta_keys: List[str] = []
+        self.delta: Dict[str, float] = {}
+
+    @classmethod
+    def from_store(cls, store, rows: np.ndarray) -> "Suggester":
+        """Built from the given rows (live doc ids) of an ItemStore, reading its columns."""
+        rows = np.asarray(rows, dtype=np.int64)
+        titles = store.project(rows, ["title", "brand", "category"])
+        popularity = store.popularity[rows].tolist()
+        weights: Dict[str, float] = {}
+        for item, pop in zip(titles, popularity):
+            for key in _terms(str(item.get("title", "")), item.get("brand"), item.get("category")):
+                weights[key] = weights.get(key, 0.0) + 1.0 + pop
+        return cls(weights)
+
+    def __len__(self):
+        return len(self.keys) + sum(1 for key in self.delta if key not in self.positions)
+
+    def with_items(self, added: List[Dict], removed: Optional[List[Dict]] = None) -> "Suggester":
+        """A suggester with `added` items counted and `removed` ones (old versions) discounted."""
+        changes: Dict[str, float] = {}
+        _item_weights(added, 1.0, changes)
+        _item_weights(removed or [], -1.0, changes)
+        if not changes:
+            return self
+        delta = dict(self.delta)
+        for key, change in changes.items():
+            delta[key] = delta.get(key, 0.0) + change
+        if len(delta) > MAX_DELTA:
+            weights = dict(zip(self.keys, self.weights.tolist()))
+            for key, change in delta.items():
+                weights[key] = weights.get(key, 0.0) + change
+            return Suggester(weights)
+        suggester = copy.copy(self)
+        suggester.delta = delta
+        suggester.delta_keys = sorted(delta)
+        return suggester
+
+    def _weight(self, key: str) -> float:
+        i = self.positions.get(key)
+        return (float(self.weights[i]) if i is not None else 0.0) + self.delta.get(key, 0.0)
+
+    def complete(self, prefix: str, n: int = 10) -> List[Tuple[str, float]]:
+        """Up to n (key, weight) starting with `prefix`, heaviest first."""
+        n = min(n, MAX_SUGGESTIONS)
+        if n <= 0:
+            return []
+        # Keys the delta touches are all scored below. The n best of the
+        # others are among the n + (touched keys) best of the sorted arrays.
+        lo = bisect.bisect_left(self.delta_keys, prefix)
+        hi = bisect.bisect_left(self.delta_keys, prefix + _END, lo)
+        touched = self.delta_keys[lo:hi]
+        m = n + len(touched)
+        if len(prefix) <= PRECOMPUTED_PREFIX and m <= MAX_SUGGESTIONS:
+            best = self.top.get(prefix, np.zeros(0, dtype=np.int64))[:m]
+        else:
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_left(self.keys, prefix + _END, lo)
+            if hi - lo > m:
+                best = lo + np.argpartition(-self.weights[lo:hi], m - 1)[:m]
+            else:
+                best = np.arange(lo, hi)
+        candidates = {self.keys[i]: w for i, w in zip(best.tolist(), self.weights[best].tolist())}
+        for key in touched:
+            candidates[key] = self._weight(key)
+        ranked = sorted(((key, w) for key, w in candidates.items() if w > _EPSILON), key=lambda kw: (-kw[1], kw[0]))
+        return ranked[:n]
+
+    def suggest(self, text: str, n: int = 10, queries: Optional[List[Tuple[str, int]]] = None) -> List[Dict]:
+        """
+        Suggestions for partially typed `text`: its last word completed
+        from the keys (earlier words kept as typed), plus recent queries
+        (`queries`: (normalized query, count), see QueryStats.top) that
+        start with it. A text found both ways adds up both weights.
+        """
+        text = " ".join(text.lower().split()) + (" " if text[-1:].isspace() else "")
+        if not text.strip():
+            return []
+        head, _, last = text.rpartition(" ")
+        scores: Dict[str, float] = {}
+        if last:
+            for key, weight in self.complete(last, n):
+                completion = f"{head} {key}" if head else key
+                scores[completion] = scores.get(completion, 0.0) + weight
+        for query, count in queries or []:
+            if query.startswith(text):
+                scores[query] = scores.get(query, 0.0) + QUERY_WEIGHT * count
+        ranked = sorted(scores.items(), key=lambda kw: (-kw[1], kw[0]))[:n]
+        return [{"text": completion, "score": round(score, 4)} for completion, score in ranked]
@@ -0,0 +1,51 @@
+"""
+Shared fixtures: small catalogs shaped like data_gen's items, and a
+SearchEngine serving one from a temporary data directory.
+"""
+import json
+import random
+from typing import Dict, List
+
+import pytest
+
+from data_gen import ADJECTIVES, BRANDS, CATEGORIES, NOUNS
+from engine import SearchEngine
+
+
+def generate_items(n: int, seed: int = 0, start: int = 0) -> List[Dict]:
+    """`n` items with ids item_{start}..., as data_gen.generate_items but seeded."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(start, start + n):
+        brand, adj, noun = rng.choice(BRANDS), rng.choice(ADJECTIVES), rng.choice(NOUNS)
+        title = f"{brand} {adj} {noun}"
+        if rng.random() > 0.5:
+            title += f" {rng.randint(100, 999)}"
+        items.append({
+            "id": f"item_{i}",
+            "title": title,
+            "category": rng.choice(CATEGORIES),
+            "brand": brand,
+            "price": round(rng.uniform(10.0, 1000.0), 2),
+            "features": {"popularity": round(rng.random(), 4), "quality_score": round(rng.uniform(0.5, 1.0), 4)},
+        })
+    return items
+
+
+@pytest.fixture(scope="session")
+def make_items():
+    return generate_items
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """A loaded engine over 500 items; its data paths are relative, so it runs in tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    with open("items.jsonl", "w") as f:
+        for item in generate_items(500):
+            f.write(json.dumps(item) + "\n")
+    search_engine = SearchEngine()
+    search_engine.load()
+    search_engine.indexer.submit(lambda: None).result()  # Lookups built
+    yield search_engine
+    search_engine.close()
@@ -0,0 +1,124 @@
+"""
+Batch paths against their per-query counterparts: Retriever.search_batch
+and retrieve_batch, Ranker.features_batch and score_batch, and
+SearchEngine.search_batch, including empty and no-match queries.
+"""
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+import inverted_index
+from ranker import Ranker
+from retriever import Retriever
+
+EXTRA_QUERIES = ["", "   ", "unknown", "unknown nothing", "softsoft softsoft laptop", "SoftSoft LAPTOP"]
+
+
+def make_queries(rng: random.Random, items: List[Dict], n: int) -> List[str]:
+    words = sorted({word for item in items for word in item["title"].lower().split()})
+    queries = [" ".join(rng.sample(words, rng.randint(1, 3))) for _ in range(n)]
+    return queries + EXTRA_QUERIES
+
+
+def assert_same_hits(ids, scores, expected_ids, expected_scores):
+    """Same scores in order, and the same ids except among ties at the cut."""
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-9)
+    if len(scores):
+        cut = scores[-1] + 1e-9
+        above = lambda ids_, scores_: {i for i, s in zip(ids_, scores_) if s > cut}
+        assert above(ids, scores) == above(expected_ids, expected_scores)
+
+
+@pytest.fixture(scope="module")
+def retriever(make_items):
+    """Several segments, with deletes, and a fuzzy index."""
+    rng = random.Random(0)
+    retriever = Retriever()
+    retriever.index(make_items(1500))
+    retriever = retriever.with_fuzzy()
+    for batch in range(3):
+        retriever = retriever.with_items(make_items(300, seed=batch + 1, start=10_000 * (batch + 1)))
+        retriever = retriever.without_items([item["id"] for item in rng.sample(retriever.live_items(), 200)])
+    return retriever
+
+
+@pytest.fixture(scope="module")
+def ranker(retriever):
+    """A ranker trained on clicks on the top results of title-word queries."""
+    rng = random.Random(1)
+    clicks = []
+    for query in make_queries(rng, retriever.live_items(), 300)[:300]:
+        results = retriever.search(query, 10)
+        if results:
+            position = rng.randrange(len(results))
+            clicks.append({"query": query, "item_id": results[position]["id"], "position": position})
+    ranker = Ranker()
+    ranker.fit(clicks, retriever)
+    assert ranker.model is not None
+    return ranker
+
+
+@pytest.mark.parametrize("split", ["one_product", "many_products"])
+def test_search_batch_matches_search(retriever, monkeypatch, split):
+    if split == "many_products":
+        monkeypatch.setattr(inverted_index, "BATCH_MAX_POSTINGS", 2000)
+    queries = make_queries(random.Random(2), retriever.live_items(), 100)
+    results = retriever.search_batch(queries, 20)
+    assert len(results) == len(queries)
+    for query, batch in zip(queries, results):
+        single = retriever.search(query, 20)
+        assert_same_hits([item["id"] for item in batch], [item["score"] for item in batch],
+                         [item["id"] for item in single], [item["score"] for item in single])
+    assert all(results[queries.index(query)] == [] for query in ["", "   ", "unknown", "unknown nothing"])
+
+
+def test_retrieve_batch_with_expansions(retriever):
+    queries = [retriever.tokenize(q) for q in ["softsoft lapotp", "cabel", "luxury chiar 123", "zzzzzz", ""]]
+    expansions = [retriever.expand(terms) for terms in queries]
+    assert any(expansions)
+    for terms, expanded, (ids, scores) in zip(queries, expansions, retriever.retrieve_batch(queries, 50, expansions)):
+        expected_ids, expected_scores = retriever.retrieve_terms(terms, 50, expansions=expanded)
+        assert_same_hits(ids.tolist(), scores, expected_ids.tolist(), expected_scores)
+
+
+def test_features_and_score_batch_match_per_query(retriever, ranker):
+    queries = make_queries(random.Random(3), retriever.live_items(), 40)
+    candidates = [retriever.retrieve(query, 30)[0] for query in queries]
+    assert any(len(c) == 0 for c in candidates) and any(len(c) for c in candidates)
+    rows = np.concatenate(candidates)
+    query_of_row = np.repeat(np.arange(len(queries)), [len(c) for c in candidates])
+    X = ranker.features_batch(retriever, rows, queries, query_of_row)
+    np.testing.assert_array_equal(X, np.concatenate([ranker.features(retriever, c, q)
+                                                     for c, q in zip(candidates, queries)]))
+    scores = ranker.score_batch(retriever, candidates, queries)
+    assert len(scores) == len(queries)
+    for c, q, batch in zip(candidates, queries, scores):
+        single = ranker.score(retriever, c, q)
+        assert len(batch) == len(c)
+        if len(c):
+            np.testing.assert_allclose(batch, single, rtol=1e-12)
+    # Only queries without candidates; and none at all
+    assert [len(s) for s in ranker.score_batch(retriever, [candidates[0][:0]] * 3, ["a", "b", "c"])] == [0, 0, 0]
+    assert ranker.score_batch(retriever, [], []) == []
+    assert Ranker().score_batch(retriever, candidates, queries) is None
+
+
+def test_engine_search_batch_matches_search(engine, ranker):
+    queries = make_queries(random.Random(4), engine.snapshot.retriever.live_items(), 30)
+    queries += ["softsoft lapotp"]  # Fuzzy expansion
+    with engine.lock:
+        engine._publish(ranker=ranker)
+    batch = engine.search_batch(queries, 10)
+    assert batch["meta"] == dict(batch["meta"], queries=len(queries), cached=0)
+    engine.cache.clear()
+    for query, result in zip(queries, batch["results"]):
+        single = engine.search(query, 10)
+        # (Repeats of a normalized query are cached by the single searches)
+        assert result["meta"] == {key: value for key, value in single["meta"].items()
+                                  if key not in ("latency_ms", "cached")}
+        assert [item["ranker_score"] for item in result["items"]] == \
+            pytest.approx([item["ranker_score"] for item in single["items"]], rel=1e-12)
+        assert sorted(item["score"] for item in result["items"]) == \
+            pytest.approx(sorted(item["score"] for item in single["items"]), rel=1e-9)
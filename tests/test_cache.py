@@ -0,0 +1,118 @@
+"""
+ResultCache on its own (LRU, byte limit, TTL, counters), and the engine's
+use of it: keys normalized like the tokenizer, invalidated by every
+publish that can change results.
+"""
+import pytest
+
+import cache
+from cache import ResultCache, estimate_size
+from ranker import Ranker
+
+
+def result(n_items: int, fields: int = 3):
+    return {"items": [{f"f{j}": j for j in range(fields)} for _ in range(n_items)], "meta": {}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A manual clock for TTL expiry: advance with clock[0] += seconds."""
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_miss_and_generation():
+    c = ResultCache()
+    assert c.get("q", 0) is None
+    c.put("q", 0, result(1))
+    assert c.get("q", 0) == result(1)
+    assert c.get("q", 1) is None  # Newer generation: stale, and dropped
+    assert c.get("q", 0) is None
+    assert (c.hits, c.misses, c.invalidations) == (1, 3, 1)
+
+
+def test_lru_eviction_by_entries():
+    c = ResultCache(max_entries=3)
+    for key in "abc":
+        c.put(key, 0, result(1))
+    c.get("a", 0)  # Most recently used: "b" goes first
+    c.put("d", 0, result(1))
+    assert c.get("b", 0) is None
+    assert all(c.get(key, 0) is not None for key in "acd")
+    assert c.evictions == 1 and c.get_stats()["entries"] == 3
+
+
+def test_lru_eviction_by_bytes():
+    size = estimate_size(result(2))
+    c = ResultCache(max_bytes=3 * size)
+    for key in "abc":
+        c.put(key, 0, result(2))
+    assert c.get_stats()["bytes"] == 3 * size
+    c.get("a", 0)
+    c.put("d", 0, result(4))  # Twice the size: evicts "b" and "c"
+    assert c.get("b", 0) is None and c.get("c", 0) is None
+    assert c.get("a", 0) is not None and c.get("d", 0) is not None
+    assert c.evictions == 2 and c.get_stats()["bytes"] == size + estimate_size(result(4))
+    c.put("e", 0, result(100))  # Larger than the whole cache: not cached
+    assert c.get("e", 0) is None and c.get("a", 0) is not None
+
+
+def test_replacing_a_key_keeps_the_byte_count():
+    c = ResultCache()
+    c.put("a", 0, result(5))
+    c.put("a", 1, result(1))
+    assert c.get_stats()["bytes"] == estimate_size(result(1)) and c.get_stats()["entries"] == 1
+
+
+def test_ttl_expiry(clock):
+    c = ResultCache(ttl_seconds=10)
+    c.put("a", 0, result(1))
+    clock[0] += 9.9
+    assert c.get("a", 0) is not None
+    clock[0] += 0.2
+    assert c.get("a", 0) is None
+    assert c.expirations == 1 and c.get_stats()["entries"] == 0
+
+
+def test_estimate_size_counts_fields_and_facets():
+    value = {"items": [{"id": 1, "score": 2.0}], "meta": {"facets": {"brand": {"a": 1, "b": 2}}}}
+    assert estimate_size(value) == cache.ENTRY_BYTES + 4 * cache.FIELD_BYTES
+
+
+def test_engine_hits_on_normalized_query(engine):
+    first = engine.search("SoftSoft  laptop", 5, user_id="u1")
+    assert not first["meta"].get("cached")
+    again = engine.search(" softsoft LAPTOP ", 5, user_id="u1")
+    assert again["meta"]["cached"] and again["items"] == first["items"]
+    # Any other k or user is a different entry
+    assert not engine.search("softsoft laptop", 6, user_id="u1")["meta"].get("cached")
+    assert not engine.search("softsoft laptop", 5, user_id="u2")["meta"].get("cached")
+    stats = engine.get_stats()["cache"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 3)
+
+
+@pytest.mark.parametrize("change", ["add_items", "delete_items", "reindex", "ranker"])
+def test_engine_misses_after_publish(engine, make_items, change):
+    query = "megacorp phone"
+    before = engine.search(query, 5)
+    generation = engine.snapshot.generation
+    if change == "add_items":
+        engine.add_items([dict(item, title="MegaCorp Phone Phone") for item in make_items(3, seed=1, start=1000)])
+    elif change == "delete_items":
+        engine.delete_items([item["id"] for item in before["items"][:1]])
+    elif change == "reindex":
+        engine.reindex()
+    else:
+        with engine.lock:
+            engine._publish(ranker=Ranker())
+    assert engine.snapshot.generation > generation
+    after = engine.search(query, 5)
+    assert not after["meta"].get("cached")
+    if change == "add_items":
+        assert {item["id"] for item in after["items"][:3]} == {"item_1000", "item_1001", "item_1002"}
+    elif change == "delete_items":
+        assert before["items"][0]["id"] not in {item["id"] for item in after["items"]}
+    stats = engine.get_stats()["cache"]
+    assert stats["invalidations"] == 1 and stats["hits"] == 0
+    assert engine.search(query, 5)["meta"]["cached"]
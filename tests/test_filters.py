@@ -0,0 +1,116 @@
+"""
+FilterIndex selections and facet counts against a plain Python filter
+over the items, through appends (with_rows) and deletes.
+"""
+import random
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytest
+
+from filters import DocSet, _padded_bytes
+from inverted_index import BLOCK_SHIFT
+from retriever import Retriever
+
+
+def matches(item: Dict, filters: Dict) -> bool:
+    for field in ("category", "brand"):
+        if filters.get(field) and item[field] not in filters[field]:
+            return False
+    low, high = filters.get("price") or (None, None)
+    return (low is None or item["price"] >= low) and (high is None or item["price"] <= high)
+
+
+def make_filters(rng: random.Random, items: List[Dict]) -> List[Dict]:
+    """Random filters, with price bounds exactly at item prices and unknown values."""
+    categories = sorted({item["category"] for item in items})
+    brands = sorted({item["brand"] for item in items})
+    prices = sorted(item["price"] for item in items)
+    out = [{}, {"category": ["Unknown"]}, {"brand": ["Unknown", brands[0]]}, {"category": []},
+           {"price": (prices[0], prices[0])}, {"price": (prices[-1], None)}, {"price": (None, prices[0] - 0.01)},
+           {"price": (5000.0, None)}, {"price": (None, None)}]
+    for _ in range(40):
+        filters: Dict = {}
+        if rng.random() < 0.6:
+            filters["category"] = rng.sample(categories, rng.randint(1, 3))
+        if rng.random() < 0.6:
+            filters["brand"] = rng.sample(brands, rng.randint(1, 3))
+        if rng.random() < 0.6:
+            low, high = sorted(rng.sample(prices, 2))
+            filters["price"] = rng.choice([(low, high), (low, None), (None, high)])
+        out.append(filters)
+    return out
+
+
+def build(make_items, rng: random.Random) -> Retriever:
+    """A retriever grown by appends, replacements and deletes, over an odd number of rows."""
+    items = make_items(1100)
+    retriever = Retriever()
+    retriever.index(items)
+    for batch in range(3):
+        live = retriever.live_items()
+        retriever = retriever.without_items([item["id"] for item in rng.sample(live, 150)])
+        replaced = [dict(item, category=rng.choice(["Books", "Toys"]), price=round(item["price"] / 2, 2))
+                    for item in rng.sample(retriever.live_items(), 50)]
+        retriever = retriever.with_items(replaced + make_items(333, seed=batch + 1, start=10_000 * (batch + 1)))
+    assert retriever.store.n % (1 << BLOCK_SHIFT)
+    return retriever
+
+
+@pytest.fixture(params=["price_delta", "price_merged"])
+def retriever(request, make_items, monkeypatch):
+    """Appended prices kept beside the sorted column, or merged into it on every append."""
+    if request.param == "price_merged":
+        monkeypatch.setattr("filters.MAX_PRICE_DELTA", 0)
+    return build(make_items, random.Random(0))
+
+
+def test_select_matches_python_filter(retriever):
+    rows = np.arange(retriever.store.n)
+    all_items = retriever.store.project(rows, ["category", "brand", "price"])
+    live = retriever.bm25.live_doc_ids()
+    for filters in make_filters(random.Random(1), retriever.live_items()):
+        selected: Optional[DocSet] = retriever.select(filters)
+        expected = np.array([matches(item, filters) for item in all_items])
+        if selected is None:  # No restriction given
+            assert expected.all() and not any(filters.get(field) for field in ("category", "brand"))
+            continue
+        # Dead rows are kept in the bitsets (searches drop them): compare every row
+        np.testing.assert_array_equal(selected.contains(rows), expected, err_msg=str(filters))
+        assert len(selected) == expected.sum()
+        block_counts = np.add.reduceat(np.append(expected, np.zeros(len(selected.bits) * 8 - len(expected), bool)),
+                                       np.arange(0, len(selected.bits) * 8, 1 << BLOCK_SHIFT))
+        np.testing.assert_array_equal(selected.block_counts(), block_counts)
+        selected_live = live[selected.contains(live)]
+        assert {retriever.store.item_id(doc) for doc in selected_live.tolist()} == \
+            {item["id"] for item in retriever.live_items() if matches(item, filters)}
+
+
+def test_facets_match_python_counts(retriever):
+    rng = random.Random(2)
+    items = retriever.live_items()
+    words = sorted({word for item in items for word in retriever.tokenize(item["title"])})
+    for filters in make_filters(rng, items)[:25]:
+        terms = rng.sample(words, rng.randint(1, 2)) + (["unknown"] if rng.random() < 0.2 else [])
+        counts = retriever.facets(terms, ["category", "brand", "color"], retriever.select(filters))
+        matching = [item for item in items
+                    if set(terms) & set(retriever.tokenize(item["title"])) and matches(item, filters)]
+        for field in ("category", "brand"):
+            expected = Counter(item[field] for item in matching)
+            # Most first, ties by value
+            assert list(counts[field].items()) == sorted(expected.items(), key=lambda vc: (-vc[1], vc[0]))
+        assert "color" not in counts
+
+
+def test_count_in_and_intersection_across_lengths():
+    rng = np.random.default_rng(3)
+    for n, m in [(1, 1), (100, 5000), (1024, 1025), (5000, 100), (4097, 3000)]:
+        a, b = rng.random(n) < 0.3, rng.random(m) < 0.5
+        docs_a = DocSet.from_docs([np.flatnonzero(a)], n)
+        docs_b = DocSet.from_docs([np.flatnonzero(b)], m)
+        assert len(docs_a.bits) == _padded_bytes(n)
+        both = a[:min(n, m)] & b[:min(n, m)]
+        assert docs_a.count_in(docs_b.bits) == docs_b.count_in(docs_a.bits) == both.sum()
+        assert len(docs_a & docs_b) == both.sum()
+        np.testing.assert_array_equal(docs_a.contains(np.arange(n)), a)
@@ -0,0 +1,113 @@
+"""
+FuzzyIndex expansions and the OSA edit distance behind them, and the
+engine's build of its lookups (fuzzy index and suggester) after load.
+"""
+import copy
+import threading
+
+import numpy as np
+import pytest
+
+import fuzzy
+from fuzzy import FuzzyIndex, edit_distance
+from suggest import Suggester
+
+VOCABULARY = ["laptop", "lapdog", "headphones", "keyboard", "keyboards", "chair", "chairs", "cable", "ab", "123"]
+
+
+def expand(terms, vocabulary=VOCABULARY):
+    index = FuzzyIndex(vocabulary)
+    doc_freqs = np.arange(len(vocabulary), 0, -1)  # Earlier terms are more frequent
+    return index.expand(terms, set(vocabulary).__contains__, doc_freqs, budget_ms=1000)
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("laptop", "laptop", 0),
+    ("lapotp", "laptop", 1),  # Adjacent swap: one edit, not two
+    ("laptpo", "laptop", 1),
+    ("latop", "laptop", 1),
+    ("lapttop", "laptop", 1),
+    ("lbptop", "laptop", 1),
+    ("ca", "abc", 3),  # OSA, not Damerau: no edit of a swapped pair
+    ("kitten", "sitting", 3),
+    ("", "abc", 3),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b, 3) == distance
+    assert edit_distance(b, a, 3) == distance
+    if distance:
+        assert edit_distance(a, b, distance - 1) == distance  # limit + 1 past the limit
+
+
+def test_transposition_expands():
+    assert expand(["lapotp"]) == [("lapotp", "laptop", fuzzy.DISTANCE_WEIGHTS[1])]
+    assert expand(["keybaord"]) == [("keybaord", "keyboard", fuzzy.DISTANCE_WEIGHTS[1]),
+                                    ("keybaord", "keyboards", fuzzy.DISTANCE_WEIGHTS[2])]
+
+
+def test_known_terms_are_not_expanded():
+    assert expand(["laptop", "chair", "keyboards"]) == []
+    # Only the unknown term of a query
+    assert [match for term, match, _ in expand(["chair", "cabel"])] == ["cable"]
+
+
+def test_short_and_numeric_terms_are_not_expanded():
+    assert expand(["ac", "124", "1234"]) == []
+    assert fuzzy.max_distance("cabel") == 1 and fuzzy.max_distance("headphnoes") == fuzzy.MAX_EDIT_DISTANCE
+
+
+def test_prefix_length_cutoff():
+    assert all(len(delete) <= fuzzy.PREFIX_LENGTH for delete in fuzzy._deletes("headphones", 2))
+    # Past the prefix, deletes are not generated but the distance is still checked
+    assert [match for _, match, _ in expand(["headphonse"])] == ["headphones"]
+    assert expand(["headphonesxyz"]) == []
+    # Within the prefix, at most MAX_EDIT_DISTANCE edits
+    assert expand(["hxxdphones"]) == [("hxxdphones", "headphones", fuzzy.DISTANCE_WEIGHTS[2])]
+    assert expand(["hxxxphones"]) == []
+
+
+def test_with_terms_matches_full_build(monkeypatch):
+    monkeypatch.setattr(fuzzy, "MAX_DELTA", 3)
+    doc_freqs = np.ones(len(VOCABULARY), dtype=np.int64)
+    index = FuzzyIndex(VOCABULARY[:4])
+    for start in range(4, len(VOCABULARY), 2):  # Through the delta, then a rebuild
+        index = index.with_terms(VOCABULARY[start:start + 2])
+    full = FuzzyIndex(VOCABULARY)
+    for term in ["lapotp", "keybaord", "chiar", "cabel", "headphonse"]:
+        assert index.candidates(term, doc_freqs) == full.candidates(term, doc_freqs)
+
+
+def test_build_lookups_does_not_block_writers(engine, make_items, monkeypatch):
+    """Items written while the lookups are built are in them, and writers never wait for the build."""
+    with engine.lock:
+        retriever = copy.copy(engine.snapshot.retriever)
+        retriever.fuzzy = None
+        engine._publish(retriever=retriever, suggester=Suggester())
+    added = [dict(item, title=f"Quokkaphone {item['title']}") for item in make_items(20, seed=1, start=1000)]
+    deleted = [item["id"] for item in engine.snapshot.retriever.live_items()[:30]]
+
+    def write():
+        engine.add_items(added)
+        engine.delete_items(deleted + [added[0]["id"]])
+
+    from_store = Suggester.from_store
+    blocked = []
+
+    def build_while_writing(store, rows):
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(timeout=10)
+        blocked.append(writer.is_alive())
+        return from_store(store, rows)
+
+    monkeypatch.setattr(Suggester, "from_store", staticmethod(build_while_writing))
+    engine._build_lookups()
+    assert blocked == [False]
+
+    snapshot = engine.snapshot
+    assert snapshot.retriever.expand(["quokkaphnoe"]) == [("quokkaphnoe", "quokkaphone", fuzzy.DISTANCE_WEIGHTS[1])]
+    expected = from_store(snapshot.retriever.store, snapshot.retriever.bm25.live_doc_ids())
+    for prefix in ["q", "quo", "s", "b", "la", "chair"]:
+        got, want = snapshot.suggester.complete(prefix, 20), expected.complete(prefix, 20)
+        assert [key for key, _ in got] == [key for key, _ in want]
+        np.testing.assert_allclose([w for _, w in got], [w for _, w in want], rtol=1e-9)
@@ -0,0 +1,133 @@
+"""
+Index snapshots: the round trip through Retriever.to_state / from_state
+and the on-disk files, checksum verification, and the fallback to
+items.jsonl when a snapshot cannot be used.
+"""
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+import index_snapshot
+from engine import SearchEngine, read_items
+from retriever import Retriever
+
+QUERIES = ["softsoft laptop", "luxury", "cable charger 123", "unknown", "brandb brandb shoes"]
+
+
+def write_items(path, items, mode="w"):
+    with open(path, mode) as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+
+
+def assert_same_top_k(retriever: Retriever, expected: Retriever):
+    assert len(retriever.bm25) == len(expected.bm25)
+    for query in QUERIES:
+        terms = retriever.tokenize(query)
+        for k in (1, 10, 100):
+            ids, scores = retriever.bm25.top_k(terms, k)
+            expected_ids, expected_scores = expected.bm25.top_k(terms, k)
+            np.testing.assert_array_equal(ids, expected_ids)
+            np.testing.assert_array_equal(scores, expected_scores)
+            assert retriever.store.project(ids) == expected.store.project(expected_ids)
+
+
+@pytest.fixture
+def built(tmp_path, make_items):
+    """(items path, snapshot path, retriever) with a snapshot written from a retriever with deletes."""
+    items_path, path = str(tmp_path / "items.jsonl"), str(tmp_path / "index_snapshot")
+    items = make_items(1200)
+    write_items(items_path, items)
+    deleted = [item["id"] for item in random.Random(0).sample(items, 100)]
+    write_items(items_path, [{"id": item_id, "_deleted": True} for item_id in deleted], "a")
+    retriever = Retriever()
+    retriever.index(list(read_items(items_path).values()))
+    index_snapshot.write(retriever, path, index_snapshot.source_state(items_path))
+    return items_path, path, retriever
+
+
+def test_state_round_trip(make_items):
+    retriever = Retriever()
+    retriever.index(make_items(800))
+    retriever = retriever.with_items(make_items(200, seed=1, start=5000)).without_items(["item_1", "item_5001"])
+    arrays, meta = retriever.to_state()
+    restored = Retriever.from_state(arrays, json.loads(json.dumps(meta)))
+    assert_same_top_k(restored, retriever)
+    assert restored.doc_map == retriever.doc_map
+
+
+def test_snapshot_round_trip(built):
+    items_path, path, retriever = built
+    assert index_snapshot.verify(path) == []
+    assert index_snapshot.generation(path) == 1
+    loaded = index_snapshot.load(path, items_path)
+    assert loaded is not None
+    assert_same_top_k(loaded, retriever)
+    # Arrays are mapped read-only, not copied
+    assert isinstance(loaded.bm25.segments[0].doc_ids, np.memmap)
+    index_snapshot.write(loaded, path, index_snapshot.source_state(items_path))
+    assert index_snapshot.generation(path) == 2
+
+
+def test_corrupt_checksum_is_rejected(built):
+    items_path, path, _ = built
+    manifest_path = os.path.join(path, index_snapshot.MANIFEST)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    name = next(iter(manifest["arrays"]))
+    manifest["checksums"][name] ^= 1
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    assert index_snapshot.verify(path) == [name]
+    assert index_snapshot.load(path, items_path) is None
+    assert index_snapshot.load(path, items_path, check=False) is not None  # Checksums only read with check
+
+
+def test_corrupt_file_is_rejected(built):
+    items_path, path, _ = built
+    with open(os.path.join(path, index_snapshot.META), "r+b") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(b"[" if first != b"[" else b"{")
+    assert index_snapshot.verify(path) == [index_snapshot.META]
+    assert index_snapshot.load(path, items_path) is None
+
+
+def test_appended_lines_are_replayed(built, make_items):
+    items_path, path, retriever = built
+    added = make_items(50, seed=2, start=9000)
+    write_items(items_path, added + [{"id": "item_3", "_deleted": True}, dict(added[0], title="Zzyzx Phone")], "a")
+    loaded = index_snapshot.load(path, items_path)
+    expected = Retriever()
+    expected.index(list(read_items(items_path).values()))
+    assert sorted(loaded.doc_map) == sorted(expected.doc_map)
+    ids, _ = loaded.bm25.top_k(["zzyzx"], 5)
+    assert [item["id"] for item in loaded.store.project(ids, ["id"])] == [added[0]["id"]]
+
+
+def test_stale_snapshot_falls_back_to_jsonl(built, make_items):
+    items_path, path, _ = built
+    write_items(items_path, make_items(300, seed=3, start=7000))  # Rewritten, not appended
+    assert index_snapshot.load(path, items_path) is None
+
+
+def test_engine_rebuilds_stale_snapshot(tmp_path, monkeypatch, make_items):
+    monkeypatch.chdir(tmp_path)
+    write_items("items.jsonl", make_items(300))
+    first = SearchEngine()
+    first.load()
+    first.close()
+    generation = index_snapshot.generation("index_snapshot")
+    write_items("items.jsonl", [dict(item, title=item["title"] + " Zzyzx") for item in make_items(200, seed=4)])
+    engine = SearchEngine()
+    engine.load()
+    try:
+        assert engine.get_stats()["items_count"] == 200
+        assert len(engine.search("zzyzx", 500)["items"]) == 200
+        assert index_snapshot.generation("index_snapshot") == generation + 1
+        assert index_snapshot.load("index_snapshot", "items.jsonl") is not None  # Rebuilt for the new log
+    finally:
+        engine.close()
@@ -0,0 +1,186 @@
+"""
+InvertedIndex against a brute-force BM25Okapi: every live document scored
+from scratch for every query, through each way the index can change.
+"""
+import math
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+import inverted_index
+from inverted_index import IndexSegment, InvertedIndex
+
+K1, B, EPSILON = 1.5, 0.75, 0.25
+
+
+def reference_scores(docs: Dict[int, List[str]], query: List[str]) -> Dict[int, float]:
+    """
+    BM25Okapi scores of the live documents `docs` (doc id -> tokens): idf
+    log((N - df + 0.5) / (df + 0.5)), floored at EPSILON times the average
+    idf over terms with live documents; repeated query terms count twice.
+    """
+    n = len(docs)
+    avgdl = sum(len(tokens) for tokens in docs.values()) / n
+    df: Dict[str, int] = {}
+    for tokens in docs.values():
+        for term in set(tokens):
+            df[term] = df.get(term, 0) + 1
+    idf = {term: math.log(n - f + 0.5) - math.log(f + 0.5) for term, f in df.items()}
+    average = sum(idf.values()) / len(idf)
+    idf = {term: value if value >= 0 else EPSILON * average for term, value in idf.items()}
+    scores = {}
+    for doc, tokens in docs.items():
+        score = 0.0
+        for term in query:
+            tf = tokens.count(term)
+            if tf:
+                score += idf[term] * tf * (K1 + 1) / (tf + K1 * (1 - B + B * len(tokens) / avgdl))
+        scores[doc] = score
+    return scores
+
+
+def assert_top_k(index: InvertedIndex, docs: Dict[int, List[str]], query: List[str], k: int, result=None):
+    """`index.top_k` (or `result`) is a top-k of the reference: same scores, best first, positive only."""
+    doc_ids, scores = result if result is not None else index.top_k(query, k)
+    expected = reference_scores(docs, query)
+    best = sorted((s for s in expected.values() if s > 0), reverse=True)[:k]
+    np.testing.assert_allclose(scores, best, rtol=1e-9)
+    np.testing.assert_allclose(scores, [expected[doc] for doc in doc_ids.tolist()], rtol=1e-9)
+    assert len(set(doc_ids.tolist())) == len(doc_ids)
+
+
+def make_corpus(rng: random.Random, n_docs: int) -> List[List[str]]:
+    """Zipf-like term frequencies, so that the most common terms get negative raw idf."""
+    vocab = [f"t{i}" for i in range(300)]
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    return [rng.choices(vocab, weights, k=rng.randint(1, 12)) for _ in range(n_docs)]
+
+
+def make_queries(rng: random.Random, n: int) -> List[List[str]]:
+    queries = []
+    for _ in range(n):
+        query = [f"t{(int(rng.paretovariate(0.8)) - 1) % 300}" for _ in range(rng.randint(1, 4))]
+        if rng.random() < 0.2:
+            query.append(query[0])  # Repeated term
+        if rng.random() < 0.1:
+            query.append("unknown")
+        queries.append(query)
+    return queries
+
+
+@pytest.fixture(params=["exhaustive", "pruned"])
+def scoring(request, monkeypatch):
+    """Runs a test with the exhaustive path, then with block-max pruning for every query."""
+    if request.param == "pruned":
+        monkeypatch.setattr(inverted_index, "PRUNE_MIN_POSTINGS", 0)
+    return request.param
+
+
+def test_common_terms_hit_idf_floor():
+    corpus = make_corpus(random.Random(0), 2000)
+    df = sum("t0" in doc for doc in corpus)
+    assert df > len(corpus) / 2  # The tests below cover floored idf
+
+
+def test_top_k_matches_reference(scoring):
+    rng = random.Random(1)
+    corpus = make_corpus(rng, 3000)
+    index = InvertedIndex(K1, B, EPSILON)
+    index.build(corpus)
+    docs = dict(enumerate(corpus))
+    for query in make_queries(rng, 100):
+        for k in (1, 10, 100):
+            assert_top_k(index, docs, query, k)
+
+
+def test_top_k_after_with_docs(scoring):
+    rng = random.Random(2)
+    index = InvertedIndex(K1, B, EPSILON)
+    docs: Dict[int, List[str]] = {}
+    for _ in range(5):
+        batch = make_corpus(rng, rng.randint(100, 800))
+        docs.update(zip(range(index.next_doc_id, index.next_doc_id + len(batch)), batch))
+        index = index.with_docs(batch)
+    assert len(index.segments) == 5
+    for query in make_queries(rng, 100):
+        assert_top_k(index, docs, query, 20)
+
+
+def test_top_k_after_with_deletes(scoring):
+    rng = random.Random(3)
+    index = InvertedIndex(K1, B, EPSILON)
+    docs: Dict[int, List[str]] = {}
+    for _ in range(3):
+        batch = make_corpus(rng, 1000)
+        docs.update(zip(range(index.next_doc_id, index.next_doc_id + len(batch)), batch))
+        index = index.with_docs(batch)
+    before = index
+    deleted = rng.sample(sorted(docs), 1200)
+    index = index.with_deletes(deleted + [10**6])  # Unknown ids are ignored
+    full = dict(docs)
+    for doc in deleted:
+        del docs[doc]
+    assert len(index) == len(docs)
+    assert not index.is_live(np.array(deleted)).any()
+    for query in make_queries(rng, 100):
+        assert_top_k(index, docs, query, 20)
+        assert_top_k(before, full, query, 20)  # Copy-on-write: the old version is unchanged
+
+
+def test_top_k_after_with_merge(scoring):
+    rng = random.Random(4)
+    index = InvertedIndex(K1, B, EPSILON)
+    docs: Dict[int, List[str]] = {}
+    for _ in range(inverted_index.MAX_SEGMENTS + 4):
+        batch = make_corpus(rng, rng.randint(50, 400))
+        docs.update(zip(range(index.next_doc_id, index.next_doc_id + len(batch)), batch))
+        index = index.with_docs(batch)
+    deleted = rng.sample(sorted(docs), len(docs) // 2)
+    index = index.with_deletes(deleted)
+    for doc in deleted:
+        del docs[doc]
+    merges = 0
+    while True:
+        sources = index.plan_merge()
+        if not sources:
+            break
+        index = index.with_merge(sources, IndexSegment.merge(sources))
+        merges += 1
+    assert merges and len(index.segments) <= inverted_index.MAX_SEGMENTS
+    for query in make_queries(rng, 100):
+        assert_top_k(index, docs, query, 20)
+
+
+def test_with_merge_refuses_replaced_sources():
+    rng = random.Random(5)
+    index = InvertedIndex(K1, B, EPSILON)
+    for _ in range(inverted_index.MAX_SEGMENTS + 1):
+        index = index.with_docs(make_corpus(rng, 50))
+    sources = index.plan_merge()
+    merged = IndexSegment.merge(sources)
+    deleted = index.with_deletes([sources[0].doc_lo])
+    assert deleted.with_merge(sources, merged) is None
+
+
+def test_top_k_batch_matches_reference(monkeypatch):
+    rng = random.Random(6)
+    index = InvertedIndex(K1, B, EPSILON)
+    docs: Dict[int, List[str]] = {}
+    for _ in range(3):
+        batch = make_corpus(rng, 1000)
+        docs.update(zip(range(index.next_doc_id, index.next_doc_id + len(batch)), batch))
+        index = index.with_docs(batch)
+    deleted = rng.sample(sorted(docs), 300)
+    index = index.with_deletes(deleted)
+    for doc in deleted:
+        del docs[doc]
+    queries = make_queries(rng, 200) + [[], ["unknown"]]
+    # Small groups, so that a batch is split across several matrix products
+    monkeypatch.setattr(inverted_index, "BATCH_MAX_POSTINGS", 5000)
+    results = index.top_k_batch(queries, 20)
+    assert len(results) == len(queries)
+    for query, result in zip(queries, results):
+        assert_top_k(index, docs, query, 20, result)
+    assert all(len(doc_ids) == 0 for doc_ids, _ in results[-2:])
@@ -0,0 +1,108 @@
+"""
+ModelRegistry: saving and loading versions, load_latest's fallback past
+incompatible or never-promoted models, and the passes_gate validation
+gate.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from model_registry import MAX_BASELINE_DROP, MAX_NDCG_DROP, ModelRegistry, passes_gate
+from ranker import Ranker
+from retriever import Retriever
+
+
+@pytest.fixture(scope="module")
+def retriever(make_items):
+    retriever = Retriever()
+    retriever.index(make_items(800))
+    return retriever
+
+
+@pytest.fixture(scope="module")
+def ranker(retriever):
+    """A ranker trained on clicks on the top results of title-word queries."""
+    rng = random.Random(0)
+    words = sorted({word for item in retriever.live_items() for word in item["title"].lower().split()})
+    clicks = []
+    for _ in range(300):
+        query = " ".join(rng.sample(words, rng.randint(1, 2)))
+        results = retriever.search(query, 10)
+        if results:
+            position = rng.randrange(len(results))
+            clicks.append({"query": query, "item_id": results[position]["id"], "position": position})
+    ranker = Ranker()
+    ranker.fit(clicks, retriever)
+    assert ranker.model is not None
+    return ranker
+
+
+def gate_meta(ndcg, baseline_ndcg=0.5, served_ndcg=None, validation_queries=100):
+    return {"ndcg": ndcg, "baseline_ndcg": baseline_ndcg, "served_ndcg": served_ndcg,
+            "validation_queries": validation_queries}
+
+
+def test_gate_accepts_first_model():
+    assert passes_gate(gate_meta(0.6))
+    assert passes_gate(gate_meta(0.0, validation_queries=0))  # Nothing to validate on, nothing served
+
+
+def test_gate_rejects_below_baseline():
+    assert not passes_gate(gate_meta(0.5 - MAX_BASELINE_DROP - 0.001))
+    assert not passes_gate(gate_meta(0.5 - MAX_BASELINE_DROP - 0.001, served_ndcg=0.3))
+    assert passes_gate(gate_meta(0.5 - MAX_BASELINE_DROP + 0.001))
+
+
+def test_gate_against_served_model():
+    assert passes_gate(gate_meta(0.6, served_ndcg=0.6 + MAX_NDCG_DROP - 0.001))
+    assert not passes_gate(gate_meta(0.6, served_ndcg=0.6 + MAX_NDCG_DROP + 0.001))
+    assert not passes_gate(gate_meta(0.9, served_ndcg=0.6, validation_queries=0))
+
+
+def test_save_and_load(tmp_path, retriever, ranker):
+    registry = ModelRegistry(str(tmp_path / "models"))
+    version = registry.save(ranker, {"ndcg": 0.5})
+    assert version == "v0001" and registry.versions() == ["v0001"]
+    assert registry.current() is None
+    meta = registry.meta(version)
+    assert meta["ndcg"] == 0.5 and meta["promoted_at"] is None and registry.compatible(meta)
+    loaded = registry.load(version)
+    assert loaded.version == version
+    doc_ids, _ = retriever.retrieve("softsoft laptop", 50)
+    np.testing.assert_allclose(loaded.score(retriever, doc_ids, "softsoft laptop"),
+                               ranker.score(retriever, doc_ids, "softsoft laptop"), rtol=1e-12)
+    assert registry.save(ranker, {}) == "v0002"
+
+
+def test_load_latest_skips_incompatible_models(tmp_path, ranker):
+    registry = ModelRegistry(str(tmp_path / "models"))
+    assert registry.load_latest() is None
+    v1, v2, v3, v4 = (registry.save(ranker, {}) for _ in range(4))
+    for version in (v1, v2, v3):
+        registry.promote(version)
+    assert registry.current() == v3
+    assert registry.load_latest()[1]["version"] == v3
+
+    # The served model was saved for other features: fall back past the
+    # never-promoted v4 to the newest promoted compatible model
+    meta = registry.meta(v3)
+    registry._write_meta(v3, dict(meta, feature_cols=meta["feature_cols"][:-1]))
+    ranker_, meta = registry.load_latest()
+    assert meta["version"] == ranker_.version == v2
+
+    meta = registry.meta(v2)
+    registry._write_meta(v2, dict(meta, format=meta["format"] + 1))
+    assert registry.load_latest()[1]["version"] == v1
+    meta = registry.meta(v1)
+    registry._write_meta(v1, dict(meta, feature_cols=list(reversed(meta["feature_cols"]))))
+    assert registry.load_latest() is None
+
+
+def test_load_latest_skips_unreadable_models(tmp_path, ranker):
+    registry = ModelRegistry(str(tmp_path / "models"))
+    v1, v2 = registry.save(ranker, {}), registry.save(ranker, {})
+    registry.promote(v1)
+    registry.promote(v2)
+    (tmp_path / "models" / v2 / "model.txt").write_text("not a model\n")
+    assert registry.load_latest()[1]["version"] == v1
@@ -0,0 +1,87 @@
+"""
+SpaceSaving against exact counts on skewed streams, and QueryStats'
+sliding windows over its bucket rings.
+"""
+import random
+from collections import Counter
+
+import pytest
+
+from query_stats import QueryStats, SpaceSaving
+
+
+def zipf_stream(rng: random.Random, n: int, n_keys: int):
+    weights = [1 / (i + 1) for i in range(n_keys)]
+    return [f"q{i}" for i in rng.choices(range(n_keys), weights, k=n)]
+
+
+@pytest.mark.parametrize("capacity", [10, 50, 200])
+def test_space_saving_error_bound(capacity):
+    stream = zipf_stream(random.Random(capacity), 20_000, 2_000)
+    summary = SpaceSaving(capacity)
+    for key in stream:
+        summary.add(key)
+    exact = Counter(stream)
+    bound = len(stream) / capacity
+    assert summary.total == len(stream) and len(summary.counts) == capacity
+    assert sum(summary.counts.values()) == len(stream)
+    assert summary.min_count == min(summary.counts.values()) <= bound
+    for key, count in summary.counts.items():
+        assert exact[key] <= count <= exact[key] + summary.min_count
+    # Every key above N / capacity is kept
+    assert {key for key, count in exact.items() if count > bound} <= set(summary.counts)
+    assert {count: keys for count, keys in summary.groups.items()} == \
+        {count: {key for key, c in summary.counts.items() if c == count} for count in set(summary.counts.values())}
+
+
+def test_space_saving_exact_below_capacity():
+    stream = zipf_stream(random.Random(0), 5_000, 50)
+    summary = SpaceSaving(100)
+    for key in stream:
+        summary.add(key)
+    assert summary.counts == Counter(stream)
+
+
+def window_counts(first: int, last: int):
+    """Exact counts of the stream recorded by test_windows_count_recent_queries, seconds first..last."""
+    counts = Counter()
+    for second in range(first, last + 1):
+        counts[f"q{second % 3}"] += second + 1
+    return counts
+
+
+def test_windows_count_recent_queries():
+    stats = QueryStats(resolutions=[(1, 10), (10, 6)], capacity=50)
+    start = 1_000_000.0
+    for second in range(30):
+        for _ in range(second + 1):
+            stats.record(f"q{second % 3}", now=start + second)
+    now = start + 29.5
+    for window, first in [(5, 25), (10, 20), (20, 10), (60, 0)]:
+        # 5 and 10 s from the 1 s ring; 20 s from the 10 s ring, in whole
+        # buckets: the current one (20..29) and the one before
+        top = stats.top(window, now=now)
+        assert {entry["query"]: entry["count"] for entry in top} == window_counts(first, 29)
+        assert [entry["count"] for entry in top] == sorted((entry["count"] for entry in top), reverse=True)
+    assert len(stats.top(60, n=2, now=now)) == 2
+
+
+def test_rollover_drops_expired_buckets():
+    stats = QueryStats(resolutions=[(1, 10), (10, 6)], capacity=50)
+    start = 2_000_000.0
+    stats.record("old", now=start)
+    assert stats.top(10, now=start + 9) == [{"query": "old", "count": 1}]
+    # Past the 1 s ring: its slot for "old" is stale even before reuse
+    assert stats.top(10, now=start + 10) == []
+    assert stats.top(60, now=start + 10) == [{"query": "old", "count": 1}]
+    # A reused slot is cleared: epoch start + 10 shares "old"'s slot in the 1 s ring
+    stats.record("new", now=start + 10)
+    assert stats.buckets[0][int(start) % 10].counts == {"new": 1}
+    # A minute on, "old" has left the coarse ring too; longer windows are capped to it
+    assert stats.top(60, now=start + 60) == [{"query": "new", "count": 1}]
+    assert stats.top(3600, now=start + 120) == []
+    # "later" reuses "old"'s slot of the coarse ring too
+    stats.record("later", now=start + 125)
+    assert stats.buckets[1][int(start // 10) % 6].counts == {"later": 1}
+    assert stats.top(3600, now=start + 125) == [{"query": "later", "count": 1}]
+    assert stats.get_stats() == {"keys": 4, "capacity": 16 * 50}
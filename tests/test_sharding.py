@@ -0,0 +1,89 @@
+"""
+ShardedSearch against a single Retriever over the same items: the global
+statistics the coordinator keeps from the shards' deltas must give every
+shard the idfs and average length of the whole catalog.
+"""
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+from engine import SearchEngine
+from retriever import Retriever
+from sharding import ShardedSearch
+
+
+def make_queries(rng: random.Random, items: List[Dict], n: int) -> List[str]:
+    words = sorted({word for item in items for word in item["title"].lower().split()})
+    queries = []
+    for _ in range(n):
+        query = rng.sample(words, rng.randint(1, 3))
+        if rng.random() < 0.2:
+            word = query[0]
+            query[0] = word[:1] + word[2:] if len(word) > 4 else "unknown"  # Typo, for fuzzy expansion
+        queries.append(" ".join(query))
+    return queries
+
+
+def assert_same_top_k(shards: ShardedSearch, retriever: Retriever, query: str, k: int):
+    terms = retriever.tokenize(query)
+    expansions = retriever.expand(terms)
+    assert shards.expand(terms) == expansions
+    hits, _, _ = shards.retrieve(query, k, expansions=expansions)
+    doc_ids, scores = retriever.retrieve_terms(terms, k, expansions=expansions)
+    np.testing.assert_allclose([score for _, _, score in hits], scores, rtol=1e-9)
+    # Ties may break differently across shards: every hit has its reference score
+    all_ids, all_scores = retriever.retrieve_terms(terms, len(retriever.doc_map), expansions=expansions)
+    reference = dict(zip((item["id"] for item in retriever.store.project(all_ids, ["id"])), all_scores.tolist()))
+    ids = [item["id"] for item in shards.fetch(hits, ["id"])]
+    assert len(set(ids)) == len(ids)
+    np.testing.assert_allclose([reference[item_id] for item_id in ids], scores, rtol=1e-9)
+
+
+def assert_same_stats(shards: ShardedSearch, retriever: Retriever):
+    bm25 = retriever.bm25
+    assert len(shards) == len(bm25)
+    assert shards.stats.query(["x"])[1] == pytest.approx(bm25.avgdl)
+    words = {word for item in retriever.live_items() for word in retriever.tokenize(item["title"])}
+    for word in words:
+        assert shards.stats._freq(word) == bm25.doc_freq(word), word
+
+
+@pytest.fixture
+def shards():
+    search = ShardedSearch(3)
+    yield search
+    search.close()
+
+
+def test_matches_single_retriever_through_writes(shards, make_items):
+    rng = random.Random(0)
+    items = make_items(1500)
+    shards.add_items(items[:1000])
+    shards.add_items(items[1000:])
+    retriever = Retriever()
+    retriever.index(items[:1000])
+    retriever = retriever.with_fuzzy().with_items(items[1000:])
+    assert_same_stats(shards, retriever)
+    for query in make_queries(rng, items, 60):
+        assert_same_top_k(shards, retriever, query, 20)
+
+    # Replacements (new titles for old ids), new items, and deletes
+    updated = [dict(item, title=item["title"] + " Extra Zzyzx") for item in rng.sample(items, 200)]
+    added = make_items(300, seed=1, start=5000)
+    replaced = shards.add_items(updated + added)
+    assert sorted(item["id"] for item in replaced) == sorted(item["id"] for item in updated)
+    retriever = retriever.with_items(updated + added)
+    deleted = [item["id"] for item in rng.sample(items + added, 400)]
+    removed = shards.delete_items(deleted + ["missing"])
+    assert sorted(item["id"] for item in removed) == sorted(deleted)
+    retriever = retriever.without_items(deleted)
+    assert_same_stats(shards, retriever)
+    for query in make_queries(rng, items + added, 60) + ["zzyzx", "extra zzyzx laptop"]:
+        assert_same_top_k(shards, retriever, query, 20)
+
+
+def test_dense_and_shards_rejected():
+    with pytest.raises(ValueError):
+        SearchEngine(dense=True, shards=2)
@@ -0,0 +1,66 @@
+"""
+Suggester kept up to date by deltas (with_items) against one rebuilt from
+the final items: the ranked suggestions must be the same.
+"""
+import random
+from typing import List
+
+import pytest
+
+import suggest
+from retriever import Retriever
+from suggest import MAX_SUGGESTIONS, Suggester
+
+PREFIXES = ["s", "so", "sof", "b", "br", "bra", "l", "la", "lux", "e", "3", "softsoft ", "new la", "zz", "quokka"]
+
+
+def rebuilt(retriever: Retriever) -> Suggester:
+    return Suggester.from_store(retriever.store, retriever.bm25.live_doc_ids())
+
+
+def assert_same_suggestions(suggester: Suggester, expected: Suggester, queries: List = ()):
+    for text in PREFIXES:
+        for n in (1, 5, MAX_SUGGESTIONS):
+            got, want = suggester.suggest(text, n, list(queries)), expected.suggest(text, n, list(queries))
+            assert [s["text"] for s in got] == [s["text"] for s in want], (text, n)
+            assert [s["score"] for s in got] == pytest.approx([s["score"] for s in want], abs=1e-4)
+
+
+@pytest.mark.parametrize("max_delta", [suggest.MAX_DELTA, 10])
+def test_deltas_match_full_rebuild(make_items, monkeypatch, max_delta):
+    """Through small deltas, and (with a low MAX_DELTA) rebuilds of the sorted arrays."""
+    monkeypatch.setattr(suggest, "MAX_DELTA", max_delta)
+    rng = random.Random(0)
+    retriever = Retriever()
+    retriever.index(make_items(800))
+    suggester = rebuilt(retriever)
+    for batch in range(4):
+        live = retriever.live_items()
+        replaced = [dict(item, title=item["title"] + " Quokka") for item in rng.sample(live, 20)]
+        added = make_items(50, seed=batch + 1, start=10_000 * (batch + 1))
+        # As SearchEngine.add_items: the old versions of replaced items are discounted
+        old = retriever.store.hydrate([retriever.doc_map[item["id"]] for item in replaced])
+        retriever = retriever.with_items(replaced + added)
+        suggester = suggester.with_items(replaced + added, old)
+        deleted = rng.sample(retriever.live_items(), 40)
+        retriever = retriever.without_items([item["id"] for item in deleted])
+        suggester = suggester.with_items([], deleted)
+        assert_same_suggestions(suggester, rebuilt(retriever))
+    assert_same_suggestions(suggester, rebuilt(retriever), [("softsoft new laptop", 3), ("quokka", 40)])
+
+
+def test_removing_every_item_of_a_key():
+    item = {"id": "a", "title": "Zzyzx Phone", "brand": "BrandA", "category": "Books"}
+    suggester = Suggester({"phone": 5.0}).with_items([item])
+    assert [s["text"] for s in suggester.suggest("zz")] == ["zzyzx"]
+    suggester = suggester.with_items([], [item])
+    assert suggester.suggest("zz") == []
+    assert [s["text"] for s in suggester.suggest("ph")] == ["phone"]
+
+
+def test_engine_suggester_matches_rebuild(engine, make_items):
+    engine.add_items([dict(item, title="Quokka " + item["title"]) for item in make_items(30, seed=1, start=1000)])
+    engine.add_items([dict(item, brand="BrandZ") for item in engine.snapshot.retriever.live_items()[:25]])
+    engine.delete_items([f"item_{i}" for i in range(100, 160)] + ["item_1000"])
+    retriever = engine.snapshot.retriever
+    assert_same_suggestions(engine.snapshot.suggester, rebuilt(retriever))
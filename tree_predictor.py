@@ -0,0 +1,184 @@
+import numpy as np
+from typing import Dict, List
+
+# LightGBM treats |x| <= kZeroThreshold as zero for missing_type "Zero"
+ZERO_THRESHOLD = 1e-35
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+# Leaf bitvectors are uint64
+MAX_LEAVES = 64
+_ALL_LEAVES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+class TreeEnsemble:
+    """
+    In-process predictor for a trained LightGBM booster (numerical splits,
+    one tree per iteration, as used by the LambdaRank ranker).
+
+    All trees are flattened into shared node arrays (feature, threshold,
+    left, right, leaf value), and scored for a whole batch at once instead
+    of going through the sklearn wrapper and the C API for each small
+    batch.
+
+    When every tree has at most 64 leaves and no split has a missing-value
+    rule, `predict` uses QuickScorer-style bitvectors: a split whose test
+    fails rules out the leaves of its left subtree, and the exit leaf of a
+    tree is the leftmost leaf still alive. Per feature, splits are sorted
+    by threshold, so the failed splits for a value are a prefix found with
+    `searchsorted`, and the AND of their masks is precomputed per prefix.
+    A batch then costs one searchsorted and one gather per feature.
+    Otherwise every (row, tree) pair walks down one level per step (leaves
+    point to themselves).
+    """
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray,
+                 right: np.ndarray, value: np.ndarray, default_left: np.ndarray,
+                 missing_type: np.ndarray, roots: np.ndarray, max_depth: int):
+        self.feature = feature  # -1 for leaves
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.default_left = default_left
+        self.missing_type = missing_type
+        self.roots = roots
+        self.max_depth = max_depth
+
+        self.split_thresholds: Dict[int, np.ndarray] = {}  # feature -> sorted thresholds
+        self.split_masks: Dict[int, np.ndarray] = {}  # feature -> (len + 1, n_trees) prefix ANDs
+        self.leaf_values = None  # (n_trees, MAX_LEAVES), leaves numbered left to right
+        if not np.any((feature >= 0) & (missing_type != MISSING_NONE)):
+            self._build_bitvectors()
+
+    def _build_bitvectors(self):
+        n_trees = len(self.roots)
+        leaf_values = np.zeros((n_trees, MAX_LEAVES), dtype=np.float64)
+        split_tree, split_mask = [], []
+        split_nodes = []
+
+        def visit(node: int, tree: int, first_leaf: int) -> int:
+            """Numbers leaves left to right; returns the number of leaves."""
+            if self.feature[node] < 0:
+                if first_leaf >= MAX_LEAVES:
+                    raise ValueError("too many leaves")
+                leaf_values[tree, first_leaf] = self.value[node]
+                return 1
+            n_left = visit(self.left[node], tree, first_leaf)
+            n_right = visit(self.right[node], tree, first_leaf + n_left)
+            # A failed test (x > threshold) rules out the left subtree
+            left_bits = ((1 << n_left) - 1) << first_leaf
+            split_nodes.append(node)
+            split_tree.append(tree)
+            split_mask.append(~left_bits & 0xFFFFFFFFFFFFFFFF)
+            return n_left + n_right
+
+        try:
+            for tree, root in enumerate(self.roots.tolist()):
+                visit(root, tree, 0)
+        except ValueError:
+            return
+
+        split_nodes = np.array(split_nodes, dtype=np.int64)
+        split_tree = np.array(split_tree, dtype=np.int64)
+        split_mask = np.array(split_mask, dtype=np.uint64)
+        for f in np.unique(self.feature[split_nodes]).tolist():
+            sel = np.flatnonzero(self.feature[split_nodes] == f)
+            sel = sel[np.argsort(self.threshold[split_nodes[sel]], kind="stable")]
+            masks = np.full((len(sel) + 1, n_trees), _ALL_LEAVES, dtype=np.uint64)
+            masks[np.arange(1, len(sel) + 1), split_tree[sel]] = split_mask[sel]
+            self.split_thresholds[f] = self.threshold[split_nodes[sel]]
+            self.split_masks[f] = np.bitwise_and.accumulate(masks, axis=0)
+        self.leaf_values = leaf_values
+
+    @classmethod
+    def from_booster(cls, booster) -> "TreeEnsemble":
+        """Exports a `lightgbm.Booster` (e.g. `LGBMRanker.booster_`)."""
+        model = booster.dump_model()
+        if model.get("num_tree_per_iteration", 1) != 1:
+            raise ValueError("Only single-output models can be compiled")
+
+        nodes: Dict[str, List] = {key: [] for key in
+                                  ("feature", "threshold", "left", "right", "value", "default_left", "missing_type")}
+        roots = []
+        max_depth = 0
+
+        def add(node: Dict, depth: int) -> int:
+            nonlocal max_depth
+            idx = len(nodes["feature"])
+            for values in nodes.values():
+                values.append(0)
+            if "leaf_value" in node:
+                max_depth = max(max_depth, depth)
+                nodes["feature"][idx] = -1
+                nodes["left"][idx] = nodes["right"][idx] = idx
+                nodes["value"][idx] = node["leaf_value"]
+                return idx
+            if node.get("decision_type", "<=") != "<=":
+                raise ValueError("Categorical splits are not supported")
+            nodes["feature"][idx] = node["split_feature"]
+            nodes["threshold"][idx] = node["threshold"]
+            nodes["default_left"][idx] = node.get("default_left", True)
+            nodes["missing_type"][idx] = _MISSING_TYPES[node.get("missing_type", "None")]
+            nodes["left"][idx] = add(node["left_child"], depth + 1)
+            nodes["right"][idx] = add(node["right_child"], depth + 1)
+            return idx
+
+        for tree in model["tree_info"]:
+            roots.append(add(tree["tree_structure"], 0))
+
+        return cls(
+            feature=np.array(nodes["feature"], dtype=np.int32),
+            threshold=np.array(nodes["threshold"], dtype=np.float64),
+            left=np.array(nodes["left"], dtype=np.int32),
+            right=np.array(nodes["right"], dtype=np.int32),
+            value=np.array(nodes["value"], dtype=np.float64),
+            default_left=np.array(nodes["default_left"], dtype=bool),
+            missing_type=np.array(nodes["missing_type"], dtype=np.int8),
+            roots=np.array(roots, dtype=np.int32),
+            max_depth=max_depth,
+        )
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Raw scores for each row of X, like `Booster.predict`."""
+        X = np.asarray(X, dtype=np.float64)
+        n_rows = len(X)
+        if not n_rows or not len(self.roots):
+            return np.zeros(n_rows, dtype=np.float64)
+        if self.leaf_values is not None:
+            return self._predict_bitvectors(X)
+        return self._predict_traverse(X)
+
+    def _predict_bitvectors(self, X: np.ndarray) -> np.ndarray:
+        # Without missing-value rules LightGBM just maps NaN to 0
+        X = np.nan_to_num(X, nan=0.0)
+        alive = np.full((len(X), len(self.roots)), _ALL_LEAVES, dtype=np.uint64)
+        for f, thresholds in self.split_thresholds.items():
+            # Splits with threshold < x fail (x <= threshold goes left)
+            alive &= self.split_masks[f][np.searchsorted(thresholds, X[:, f], side="left")]
+        lowest = alive & (~alive + np.uint64(1))
+        # Powers of two convert to float exactly
+        leaf = np.log2(lowest.astype(np.float64)).astype(np.int64)
+        return self.leaf_values[np.arange(len(self.roots)), leaf].sum(axis=1)
+
+    def _predict_traverse(self, X: np.ndarray) -> np.ndarray:
+        n_rows = len(X)
+        nodes = np.tile(self.roots, n_rows)  # row-major (row, tree) pairs
+        rows = np.repeat(np.arange(n_rows), len(self.roots))
+        active = np.flatnonzero(self.feature[nodes] >= 0)
+        for _ in range(self.max_depth):
+            if not len(active):
+                break
+            node = nodes[active]
+            x = X[rows[active], self.feature[node]]
+            missing = self.missing_type[node]
+            is_nan = np.isnan(x)
+            # Same decision rule as LightGBM's NumericalDecision
+            x = np.where(is_nan & (missing != MISSING_NAN), 0.0, x)
+            use_default = ((missing == MISSING_ZERO) & (np.abs(x) <= ZERO_THRESHOLD)) | (
+                (missing == MISSING_NAN) & is_nan)
+            go_left = np.where(use_default, self.default_left[node], x <= self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+            nodes[active] = node
+            active = active[self.feature[node] >= 0]
+
+        return self.value[nodes].reshape(n_rows, len(self.roots)).sum(axis=1)